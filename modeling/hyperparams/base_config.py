@@ -260,6 +260,12 @@ class RuntimeConfig(Config):
       loss_scale: The type of loss scale. This is used when setting the mixed
         precision policy.
       run_eagerly: Whether or not to run the experiment eagerly.
+      training_loop: 'compile_fit' to train with Keras `fit`, or 'ctl' to train
+        with a custom loop that runs `steps_per_loop` steps per `tf.function`
+        call.
+      steps_per_loop: The number of training steps of each custom loop call.
+        Logging, summaries, checkpoints and evaluation only happen between
+        calls. Defaults to the number of steps of an epoch.
 
     """
     distribution_strategy: str = 'mirrored'
@@ -276,6 +282,8 @@ class RuntimeConfig(Config):
     num_packs: int = 1
     loss_scale: Optional[str] = None
     run_eagerly: bool = False
+    training_loop: str = 'compile_fit'
+    steps_per_loop: Optional[int] = None
 
 
 @dataclasses.dataclass
@@ -304,8 +312,12 @@ class CallbacksConfig(Config):
         Defaults to True.
       enable_time_history: Whether or not to enable TimeHistory Callbacks.
         Defaults to True.
+      async_checkpoint: Whether or not to write the checkpoints in a background
+        thread, from a snapshot of the variables in host memory. Defaults to
+        False.
     
     """
     enable_checkpoint_and_export: bool = True
     enable_tensorboard: bool = True
     enable_time_history: bool = True
+    async_checkpoint: bool = False
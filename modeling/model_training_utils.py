@@ -24,6 +24,7 @@ import tempfile
 
 from absl import logging
 import tensorflow as tf
+from modeling.training import evaluator as evaluator_lib
 from staging.training import grad_utils
 from utils.misc import distribution_utils
 
@@ -343,27 +344,25 @@ def run_customized_training_loop(
       """
       strategy.run(_replicated_step, args=(next(iterator),))
 
-    def test_step(iterator):
-      """Calculates evaluation metrics on distributed devices."""
-
-      def _test_step_fn(inputs):
-        """Replicated accuracy calculation."""
-
-        inputs, labels = inputs
-        model_outputs = model(inputs, training=False)
-        for metric in eval_metrics:
-          metric.update_state(labels, model_outputs)
-
-      strategy.run(_test_step_fn, args=(next(iterator),))
-
     if not run_eagerly:
       train_single_step = tf.function(train_single_step)
-      test_step = tf.function(test_step)
 
-    def _run_evaluation(current_training_step, test_iterator):
+    # The eval dataset and test step are built once, and reused by every
+    # evaluation.
+    evaluator = None
+    if eval_input_fn:
+      evaluator = evaluator_lib.Evaluator(
+          strategy,
+          model,
+          eval_metrics,
+          dataset_fn=lambda: strategy.experimental_distribute_datasets_from_function(  # pylint: disable=g-long-lambda
+              eval_input_fn),
+          eval_steps=eval_steps,
+          use_tf_function=not run_eagerly)
+
+    def _run_evaluation(current_training_step):
       """Runs validation steps and aggregate metrics."""
-      for _ in range(eval_steps):
-        test_step(test_iterator)
+      evaluator.evaluate()
 
       with eval_summary_writer.as_default():
         for metric in eval_metrics + model.metrics:
@@ -456,8 +455,7 @@ def run_customized_training_loop(
                 '%s_step_%d.ckpt' % (sub_model_export_name, current_step))
         if eval_input_fn:
           logging.info('Running evaluation after step: %s.', current_step)
-          _run_evaluation(current_step,
-                          _get_input_iterator(eval_input_fn, strategy))
+          _run_evaluation(current_step)
           # Re-initialize evaluation metric.
           for metric in eval_metrics + model.metrics:
             metric.reset_states()
@@ -470,8 +468,7 @@ def run_customized_training_loop(
 
     if eval_input_fn:
       logging.info('Running final evaluation after training is complete.')
-      _run_evaluation(current_step,
-                      _get_input_iterator(eval_input_fn, strategy))
+      _run_evaluation(current_step)
 
     training_summary = {
         'total_training_steps': total_training_steps,
@@ -482,6 +479,9 @@ def run_customized_training_loop(
       training_summary['last_train_metrics'] = _float_metric_value(
           train_metrics[0])
       training_summary['eval_metrics'] = _float_metric_value(eval_metrics[0])
+    if evaluator:
+      # The first setup includes building the eval dataset
+      training_summary['eval_setup_seconds'] = evaluator.setup_times
 
     write_txt_summary(training_summary, summary_dir)
 
@@ -18,6 +18,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
 import os
 
 from absl.testing import parameterized
@@ -191,6 +192,10 @@ class ModelTrainingUtilsTest(tf.test.TestCase, parameterized.TestCase):
     self.assertNotEmpty(
         tf.io.gfile.glob(
             os.path.join(model_dir, 'summaries/training_summary*')))
+    # The eval setup time is recorded for the two epochs and the final eval.
+    with tf.io.gfile.GFile(
+        os.path.join(model_dir, 'summaries/training_summary.txt')) as f:
+      self.assertLen(json.load(f)['eval_setup_seconds'], 3)
 
     # Loss and accuracy values should be written into summaries.
     self.assertTrue(
@@ -25,12 +25,13 @@ import os
 from absl import flags
 from absl import logging
 
-import numpy as np
 import tensorflow as tf
 
 # pylint: disable=unused-import,g-import-not-at-top,redefined-outer-name,reimported
 from typing import Optional, Dict, List, Text, Callable, Union, Iterator, Any
 from modeling.hyperparams import params_dict
+from modeling.training import evaluator as evaluator_lib
+from utils.misc import async_checkpoint
 from utils.misc import distribution_utils
 from utils import hyperparams_flags
 
@@ -40,11 +41,19 @@ strategy_flags_dict = hyperparams_flags.strategy_flags_dict
 hparam_flags_dict = hyperparams_flags.hparam_flags_dict
 
 
-def _save_checkpoint(checkpoint, model_dir, checkpoint_prefix):
-  """Saves model to model_dir with provided checkpoint prefix."""
+def _save_checkpoint(checkpoint, model_dir, checkpoint_prefix,
+                     checkpoint_writer=None):
+  """Saves model to model_dir with provided checkpoint prefix.
+
+  With an `AsyncCheckpointWriter`, only snapshots the variables and writes
+  them in the background.
+  """
 
   checkpoint_path = os.path.join(model_dir, checkpoint_prefix)
-  saved_path = checkpoint.save(checkpoint_path)
+  if checkpoint_writer is not None:
+    saved_path = checkpoint_writer.save(checkpoint_path)
+  else:
+    saved_path = checkpoint.save(checkpoint_path)
   logging.info('Saving model as TF checkpoint: %s', saved_path)
 
 
@@ -124,6 +133,7 @@ class DistributedExecutor(object):
     self.train_summary_writer = None
     self.eval_summary_writer = None
     self.global_train_step = None
+    self.evaluator = None
 
   @property
   def checkpoint_name(self):
@@ -154,6 +164,19 @@ class DistributedExecutor(object):
     else:
       logging.warning('model_dir is empty, so skip the save config.')
 
+  def _get_distributed_dataset(
+      self, input_fn: Callable[..., tf.data.Dataset],
+      strategy: tf.distribute.Strategy) -> Any:
+    """Returns the distributed dataset of `input_fn`."""
+    # When training with multiple TPU workers, datasets needs to be cloned
+    # across workers. Since Dataset instance cannot be cloned in eager mode,
+    # we instead pass callable that returns a dataset.
+    if self._is_multi_host:
+      return strategy.experimental_distribute_datasets_from_function(input_fn)
+    else:
+      input_data = input_fn()
+      return strategy.experimental_distribute_dataset(input_data)
+
   def _get_input_iterator(
       self, input_fn: Callable[..., tf.data.Dataset],
       strategy: tf.distribute.Strategy) -> Optional[Iterator[Any]]:
@@ -169,15 +192,20 @@ class DistributedExecutor(object):
 
     if input_fn is None:
       return None
-    # When training with multiple TPU workers, datasets needs to be cloned
-    # across workers. Since Dataset instance cannot be cloned in eager mode,
-    # we instead pass callable that returns a dataset.
-    if self._is_multi_host:
-      return iter(
-          strategy.experimental_distribute_datasets_from_function(input_fn))
-    else:
-      input_data = input_fn()
-      return iter(strategy.experimental_distribute_dataset(input_data))
+    return iter(self._get_distributed_dataset(input_fn, strategy))
+
+  def _create_evaluator(self, strategy, model, metric, eval_input_fn):
+    """Creates an evaluator of `metric`, reusing its input pipeline."""
+    if not isinstance(metric, tf.keras.metrics.Metric):
+      raise ValueError(
+          'Metric must be an instance of tf.keras.metrics.Metric '
+          'for running in test_step. Actual {}'.format(metric))
+    return evaluator_lib.Evaluator(
+        strategy,
+        model,
+        [metric],
+        dataset_fn=lambda: self._get_distributed_dataset(eval_input_fn,
+                                                         strategy))
 
   def _create_replicated_step(self,
                               strategy,
@@ -257,31 +285,6 @@ class DistributedExecutor(object):
 
     return train_step
 
-  def _create_test_step(self, strategy, model, metric):
-    """Creates a distributed test step."""
-
-    @tf.function
-    def test_step(iterator):
-      """Calculates evaluation metrics on distributed devices."""
-      if not metric:
-        logging.info('Skip test_step because metric is None (%s)', metric)
-        return None, None
-      if not isinstance(metric, tf.keras.metrics.Metric):
-        raise ValueError(
-            'Metric must be an instance of tf.keras.metrics.Metric '
-            'for running in test_step. Actual {}'.format(metric))
-
-      def _test_step_fn(inputs):
-        """Replicated accuracy calculation."""
-        inputs, labels = inputs
-        model_outputs = model(inputs, training=False)
-        metric.update_state(labels, model_outputs)
-        return labels, model_outputs
-
-      return strategy.run(_test_step_fn, args=(next(iterator),))
-
-    return test_step
-
   def train(self,
             train_input_fn: Callable[[params_dict.ParamsDict], tf.data.Dataset],
             eval_input_fn: Callable[[params_dict.ParamsDict],
@@ -295,7 +298,8 @@ class DistributedExecutor(object):
                                         SummaryWriter] = SummaryWriter,
             init_checkpoint: Callable[[tf.keras.Model], Any] = None,
             custom_callbacks: List[tf.keras.callbacks.Callback] = None,
-            save_config: bool = True):
+            save_config: bool = True,
+            lag_metrics: Optional[bool] = None):
     """Runs distributed training.
 
     Args:
@@ -315,6 +319,13 @@ class DistributedExecutor(object):
         training. More specifically, `on_batch_begin()`, `on_batch_end()`,
         methods are invoked during training.
       save_config: bool. Whether to save params to model_dir.
+      lag_metrics: bool. Whether to fetch the loss, training metrics and
+        learning rate of a loop only after the next loop is started, so that
+        the host never waits for the device to log them. The NaN check of the
+        loss runs on the device, and raises one loop later, except before a
+        checkpoint: the loss of the loop is then checked first, so that NaN
+        weights are never saved. The last loop is fetched before the final
+        checkpoint. Defaults to `--lag_metrics`.
 
     Returns:
       The training loss and eval metrics.
@@ -328,6 +339,8 @@ class DistributedExecutor(object):
                        'eval_metric_fn must be a callable.')
     train_metric_fn = train_metric_fn or _no_metric
     eval_metric_fn = eval_metric_fn or _no_metric
+    if lag_metrics is None:
+      lag_metrics = FLAGS.lag_metrics
 
     if custom_callbacks and iterations_per_loop != 1:
       logging.error(
@@ -393,6 +406,9 @@ class DistributedExecutor(object):
 
       current_step = optimizer.iterations.numpy()
       checkpoint_name = self.checkpoint_name
+      checkpoint_writer = None
+      if FLAGS.async_checkpoint:
+        checkpoint_writer = async_checkpoint.AsyncCheckpointWriter(checkpoint)
 
       eval_metric = eval_metric_fn()
       train_metric = train_metric_fn()
@@ -409,31 +425,44 @@ class DistributedExecutor(object):
         loss_fn=self.loss_fn(),
         optimizer=optimizer,
         metric=train_metric)
-    test_step = None
+    evaluator = None
     if eval_input_fn and eval_metric:
       self.global_train_step = model.optimizer.iterations
-      test_step = self._create_test_step(strategy, model, metric=eval_metric)
-
-    logging.info('Training started')
-    last_save_checkpoint_step = current_step
-    while current_step < total_steps:
+      # The eval dataset and test step are built once for all the loops
+      evaluator = self._create_evaluator(strategy, model, eval_metric,
+                                         eval_input_fn)
+      self.evaluator = evaluator
 
-      num_steps = _steps_to_run(current_step, total_steps, iterations_per_loop)
-      _run_callbacks_on_batch_begin(current_step)
-      train_loss = train_step(train_iterator,
-                              tf.convert_to_tensor(num_steps, dtype=tf.int32))
-      _run_callbacks_on_batch_end(current_step)
-      current_step += num_steps
-
-      train_loss = tf.nest.map_structure(lambda x: x.numpy().astype(float),
-                                         train_loss)
+    def _loop_outputs(train_loss, step):
+      """Returns the outputs of a loop to report, without waiting for them."""
       if not isinstance(train_loss, dict):
         train_loss = {'total_loss': train_loss}
-      if np.isnan(train_loss['total_loss']):
-        raise ValueError('total loss is NaN.')
-
+      outputs = {
+          'step': step,
+          'train_loss': train_loss,
+          'is_nan': tf.reduce_any(tf.math.is_nan(train_loss['total_loss'])),
+      }
+      if train_metric:
+        outputs['train_metric'] = train_metric.result()
+      if callable(optimizer.lr):
+        outputs['learning_rate'] = optimizer.lr(step)
+      else:
+        outputs['learning_rate'] = tf.identity(optimizer.lr)
+      return outputs
+
+    def _check_nan(outputs):
+      """Raises if the loss of a loop is NaN."""
+      if outputs['is_nan'].numpy():
+        raise ValueError('total loss is NaN at step {}.'.format(
+            outputs['step']))
+
+    def _report_loop(outputs):
+      """Fetches, checks, logs and writes the outputs of a loop."""
+      _check_nan(outputs)
+      train_loss = tf.nest.map_structure(lambda x: x.numpy().astype(float),
+                                         outputs['train_loss'])
       if train_metric:
-        train_metric_result = train_metric.result()
+        train_metric_result = outputs['train_metric']
         if isinstance(train_metric, tf.keras.metrics.Metric):
           train_metric_result = tf.nest.map_structure(
               lambda x: x.numpy().astype(float), train_metric_result)
@@ -441,18 +470,35 @@ class DistributedExecutor(object):
           train_metric_result = {'metric': train_metric_result}
         train_metric_result.update(train_loss)
       else:
-        train_metric_result = train_loss
-      if callable(optimizer.lr):
-        train_metric_result.update(
-            {'learning_rate': optimizer.lr(current_step).numpy()})
-      else:
-        train_metric_result.update({'learning_rate': optimizer.lr.numpy()})
+        train_metric_result = dict(train_loss)
+      train_metric_result.update(
+          {'learning_rate': outputs['learning_rate'].numpy()})
       logging.info('Train Step: %d/%d  / loss = %s / training metric = %s',
-                   current_step, total_steps, train_loss,
+                   outputs['step'], total_steps, train_loss,
                    train_metric_result)
 
-      train_summary_writer(
-          metrics=train_metric_result, step=optimizer.iterations)
+      train_summary_writer(metrics=train_metric_result, step=outputs['step'])
+      return train_loss
+
+    logging.info('Training started')
+    last_save_checkpoint_step = current_step
+    lagged_outputs = None
+    while current_step < total_steps:
+
+      num_steps = _steps_to_run(current_step, total_steps, iterations_per_loop)
+      _run_callbacks_on_batch_begin(current_step)
+      train_loss = train_step(train_iterator,
+                              tf.convert_to_tensor(num_steps, dtype=tf.int32))
+      _run_callbacks_on_batch_end(current_step)
+      current_step += num_steps
+
+      # The outputs of this loop are read before its metrics are reset, and
+      # fetched once the next loop is queued on the device.
+      outputs = _loop_outputs(train_loss, current_step)
+      if lag_metrics:
+        outputs, lagged_outputs = lagged_outputs, outputs
+      if outputs is not None:
+        train_loss = _report_loop(outputs)
 
       # Saves model checkpoints and run validation steps at every
       # iterations_per_loop steps.
@@ -460,14 +506,17 @@ class DistributedExecutor(object):
       # step of training.
       if save_freq > 0 and current_step < total_steps and (
           current_step - last_save_checkpoint_step) >= save_freq:
+        if lagged_outputs is not None:
+          # The save waits for the loop anyway, check its loss before it
+          _check_nan(lagged_outputs)
         _save_checkpoint(checkpoint, model_dir,
-                         checkpoint_name.format(step=current_step))
+                         checkpoint_name.format(step=current_step),
+                         checkpoint_writer)
         last_save_checkpoint_step = current_step
 
-      if test_step:
-        eval_iterator = self._get_input_iterator(eval_input_fn, strategy)
-        eval_metric_result = self._run_evaluation(test_step, current_step,
-                                                  eval_metric, eval_iterator)
+      if evaluator:
+        eval_metric_result = self._run_evaluation(evaluator, current_step,
+                                                  eval_metric)
         logging.info('Step: %s evalation metric = %s.', current_step,
                      eval_metric_result)
         test_summary_writer(
@@ -479,36 +528,36 @@ class DistributedExecutor(object):
       if train_metric and current_step < total_steps:
         train_metric.reset_states()
 
+    if lagged_outputs is not None:
+      train_loss = _report_loop(lagged_outputs)
+
     # Reaches the end of training and saves the last checkpoint.
     if last_save_checkpoint_step < total_steps:
       _save_checkpoint(checkpoint, model_dir,
-                       checkpoint_name.format(step=current_step))
+                       checkpoint_name.format(step=current_step),
+                       checkpoint_writer)
+    if checkpoint_writer is not None:
+      checkpoint_writer.close()
 
-    if test_step:
+    if evaluator:
       logging.info('Running final evaluation after training is complete.')
-      eval_iterator = self._get_input_iterator(eval_input_fn, strategy)
-      eval_metric_result = self._run_evaluation(test_step, current_step,
-                                                eval_metric, eval_iterator)
+      eval_metric_result = self._run_evaluation(evaluator, current_step,
+                                                eval_metric)
       logging.info('Final evaluation metric = %s.', eval_metric_result)
       test_summary_writer(
           metrics=eval_metric_result, step=optimizer.iterations)
 
     return train_loss, eval_metric_result
 
-  def _run_evaluation(self, test_step, current_training_step, metric,
-                      test_iterator):
+  def _run_evaluation(self, evaluator, current_training_step, metric):
     """Runs validation steps and aggregate metrics."""
-    if not test_iterator or not metric:
+    if not evaluator or not metric:
       logging.warning(
-          'Both test_iterator (%s) and metrics (%s) must not be None.',
-          test_iterator, metric)
+          'Both evaluator (%s) and metrics (%s) must not be None.',
+          evaluator, metric)
       return None
     logging.info('Running evaluation after step: %s.', current_training_step)
-    while True:
-      try:
-        test_step(test_iterator)
-      except (StopIteration, tf.errors.OutOfRangeError):
-        break
+    evaluator.evaluate()
 
     metric_result = metric.result()
     if isinstance(metric, tf.keras.metrics.Metric):
@@ -556,6 +605,9 @@ class DistributedExecutor(object):
 
     summary_writer = summary_writer_fn(model_dir, 'eval')
     self.eval_summary_writer = summary_writer.writer
+    # The model, test step and eval dataset are built once for all the
+    # checkpoints, which are restored in turn.
+    evaluator = self.build_evaluator(eval_input_fn, eval_metric_fn)
 
     # Read checkpoints from the given model directory
     # until `eval_timeout` seconds elapses.
@@ -568,29 +620,25 @@ class DistributedExecutor(object):
           checkpoint_path=checkpoint_path,
           eval_input_fn=eval_input_fn,
           eval_metric_fn=eval_metric_fn,
-          summary_writer=summary_writer)
+          summary_writer=summary_writer,
+          evaluator=evaluator)
       if total_steps > 0 and current_step >= total_steps:
         logging.info('Evaluation finished after training step %d', current_step)
         break
     return eval_metric_result
 
-  def evaluate_checkpoint(self,
-                          checkpoint_path: Text,
-                          eval_input_fn: Callable[[params_dict.ParamsDict],
-                                                  tf.data.Dataset],
-                          eval_metric_fn: Callable[[], Any],
-                          summary_writer: SummaryWriter = None):
-    """Runs distributed evaluation on the one checkpoint.
+  def build_evaluator(
+      self,
+      eval_input_fn: Callable[[params_dict.ParamsDict], tf.data.Dataset],
+      eval_metric_fn: Callable[[], Any]) -> evaluator_lib.Evaluator:
+    """Builds the model and an evaluator to restore checkpoints into.
 
     Args:
-      eval_input_fn: (Optional) same type as train_input_fn. If not None, will
-        trigger evaluting metric on eval data. If None, will not run eval step.
+      eval_input_fn: same type as train_input_fn.
       eval_metric_fn: metric_fn for evaluation in test_step.
-      checkpoint_path: the checkpoint to evaluate.
-      summary_writer_fn: function to create summary writer.
 
     Returns:
-      Eval metrics dictionary of the last checkpoint.
+      An `Evaluator` of the model of `model_fn`.
     """
     if not callable(eval_metric_fn):
       raise ValueError('if `eval_metric_fn` is specified, '
@@ -598,38 +646,61 @@ class DistributedExecutor(object):
 
     params = self._params
     strategy = self._strategy
-    # To reduce unnecessary send/receive input pipeline operation, we place
-    # input pipeline ops in worker task.
     with strategy.scope():
-
       # To correctly place the model weights on accelerators,
       # model and optimizer should be created in scope.
       model = self.model_fn(params.as_dict())
-      checkpoint = tf.train.Checkpoint(model=model)
-
       eval_metric = eval_metric_fn()
       assert eval_metric, 'eval_metric does not exist'
-      test_step = self._create_test_step(strategy, model, metric=eval_metric)
-
-      logging.info('Starting to evaluate.')
-      if not checkpoint_path:
-        raise ValueError('checkpoint path is empty')
-      reader = tf.compat.v1.train.NewCheckpointReader(checkpoint_path)
-      current_step = reader.get_tensor(
-          'optimizer/iter/.ATTRIBUTES/VARIABLE_VALUE')
-      logging.info(
-          'Checkpoint file %s found and restoring from '
-          'checkpoint', checkpoint_path)
-      checkpoint.restore(checkpoint_path)
+      evaluator = self._create_evaluator(strategy, model, eval_metric,
+                                         eval_input_fn)
+    self.global_train_step = model.optimizer.iterations
+    self.evaluator = evaluator
+    return evaluator
 
-      self.global_train_step = model.optimizer.iterations
-      eval_iterator = self._get_input_iterator(eval_input_fn, strategy)
-      eval_metric_result = self._run_evaluation(test_step, current_step,
-                                                eval_metric, eval_iterator)
-      logging.info('Step: %s evalation metric = %s.', current_step,
-                   eval_metric_result)
+  def evaluate_checkpoint(self,
+                          checkpoint_path: Text,
+                          eval_input_fn: Callable[[params_dict.ParamsDict],
+                                                  tf.data.Dataset],
+                          eval_metric_fn: Callable[[], Any],
+                          summary_writer: SummaryWriter = None,
+                          evaluator: evaluator_lib.Evaluator = None):
+    """Runs distributed evaluation on the one checkpoint.
+
+    Args:
+      eval_input_fn: (Optional) same type as train_input_fn. If not None, will
+        trigger evaluting metric on eval data. If None, will not run eval step.
+      eval_metric_fn: metric_fn for evaluation in test_step.
+      checkpoint_path: the checkpoint to evaluate.
+      summary_writer_fn: function to create summary writer.
+      evaluator: (Optional) an evaluator of `build_evaluator` to restore the
+        checkpoint into. If None, a new one is built.
+
+    Returns:
+      Eval metrics dictionary of the last checkpoint.
+    """
+    if evaluator is None:
+      evaluator = self.build_evaluator(eval_input_fn, eval_metric_fn)
+    eval_metric, = evaluator.metrics
+
+    logging.info('Starting to evaluate.')
+    if not checkpoint_path:
+      raise ValueError('checkpoint path is empty')
+    reader = tf.compat.v1.train.NewCheckpointReader(checkpoint_path)
+    current_step = reader.get_tensor(
+        'optimizer/iter/.ATTRIBUTES/VARIABLE_VALUE')
+    logging.info(
+        'Checkpoint file %s found and restoring from '
+        'checkpoint', checkpoint_path)
+    evaluator.restore(checkpoint_path)
+
+    eval_metric_result = self._run_evaluation(evaluator, current_step,
+                                              eval_metric)
+    logging.info('Step: %s evalation metric = %s.', current_step,
+                 eval_metric_result)
+    if summary_writer:
       summary_writer(metrics=eval_metric_result, step=current_step)
-      eval_metric.reset_states()
+    eval_metric.reset_states()
 
     return eval_metric_result, current_step
 
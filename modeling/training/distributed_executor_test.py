@@ -0,0 +1,200 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for distributed_executor."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from absl import flags
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from modeling.hyperparams import params_dict
+from modeling.training import distributed_executor
+from utils import hyperparams_flags
+
+FLAGS = flags.FLAGS
+
+hyperparams_flags.define_common_hparams_flags()
+
+_BATCH_SIZE = 4
+
+
+def _model_fn(params):
+  del params
+  inputs = tf.keras.layers.Input(shape=(3,))
+  outputs = tf.keras.layers.Dense(
+      1, kernel_initializer='ones', bias_initializer='zeros')(inputs)
+  model = tf.keras.Model(inputs, outputs)
+  model.optimizer = tf.keras.optimizers.SGD(0.01)
+  return model
+
+
+def _loss_fn():
+  return lambda labels, outputs: tf.reduce_mean(
+      tf.square(labels - outputs), axis=-1)
+
+
+def _input_fn(num_batches, nan_from_batch=None):
+  """Returns a dataset of fixed batches, with NaN labels from a batch on."""
+  num_examples = num_batches * _BATCH_SIZE
+  features = np.linspace(-1., 1., num_examples * 3, dtype=np.float32)
+  features = features.reshape([num_examples, 3])
+  labels = np.sum(features, axis=1, keepdims=True) * 0.5
+  if nan_from_batch is not None:
+    labels[nan_from_batch * _BATCH_SIZE:] = np.nan
+
+  def input_fn(params=None):
+    del params
+    dataset = tf.data.Dataset.from_tensor_slices((features, labels))
+    return dataset.batch(_BATCH_SIZE, drop_remainder=True)
+
+  return input_fn
+
+
+class _RecordingSummaryWriter(object):
+  """Records the written metrics by step instead of writing them."""
+
+  def __init__(self, model_dir, name):
+    del model_dir, name
+    self.writer = tf.summary.create_noop_writer()
+    self.metrics = {}
+
+  def __call__(self, metrics, step):
+    self.metrics[int(step)] = metrics
+
+
+def _recording_writer_fn(writers):
+  """Returns a summary_writer_fn adding its writers to `writers` by name."""
+
+  def summary_writer_fn(model_dir, name):
+    writers[name] = _RecordingSummaryWriter(model_dir, name)
+    return writers[name]
+
+  return summary_writer_fn
+
+
+class DistributedExecutorTest(parameterized.TestCase, tf.test.TestCase):
+
+  def setUp(self):
+    super(DistributedExecutorTest, self).setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+
+  def _executor(self):
+    return distributed_executor.DistributedExecutor(
+        strategy=tf.distribute.get_strategy(),
+        params=params_dict.ParamsDict({}),
+        model_fn=_model_fn,
+        loss_fn=_loss_fn)
+
+  def _train(self, model_dir, input_fn, lag_metrics, total_steps=6):
+    """Trains in loops of 2 steps, returning the loss and summaries."""
+    writers = {}
+    train_loss, _ = self._executor().train(
+        train_input_fn=input_fn,
+        model_dir=model_dir,
+        total_steps=total_steps,
+        iterations_per_loop=2,
+        train_metric_fn=lambda: tf.keras.metrics.MeanSquaredError('mse'),
+        summary_writer_fn=_recording_writer_fn(writers),
+        save_config=False,
+        lag_metrics=lag_metrics)
+    return train_loss, writers['eval_train'].metrics
+
+  def test_lagged_metrics_match(self):
+    input_fn = _input_fn(num_batches=6)
+
+    train_loss, summaries = self._train(
+        os.path.join(self.get_temp_dir(), 'not_lagged'), input_fn,
+        lag_metrics=False)
+    lagged_train_loss, lagged_summaries = self._train(
+        os.path.join(self.get_temp_dir(), 'lagged'), input_fn,
+        lag_metrics=True)
+
+    self.assertEqual([2, 4, 6], sorted(summaries))
+    self.assertEqual(sorted(summaries), sorted(lagged_summaries))
+    for step in summaries:
+      self.assertAllClose(summaries[step], lagged_summaries[step])
+    self.assertAllClose(train_loss, lagged_train_loss)
+
+  def test_lag_metrics_flag(self):
+    FLAGS.lag_metrics = True
+    self.addCleanup(setattr, FLAGS, 'lag_metrics', False)
+
+    _, summaries = self._train(self.get_temp_dir(),
+                               _input_fn(num_batches=4),
+                               lag_metrics=None,
+                               total_steps=4)
+
+    self.assertEqual([2, 4], sorted(summaries))
+
+  @parameterized.named_parameters(('not_lagged', False), ('lagged', True))
+  def test_nan_loss_is_not_checkpointed(self, lag_metrics):
+    model_dir = self.get_temp_dir()
+    # The second loop, steps 3 and 4, has a NaN loss and NaN weights
+    input_fn = _input_fn(num_batches=6, nan_from_batch=2)
+
+    with self.assertRaisesRegex(ValueError, 'NaN'):
+      self._train(model_dir, input_fn, lag_metrics=lag_metrics)
+
+    latest_checkpoint = tf.train.latest_checkpoint(model_dir)
+    self.assertIn('ctl_step_2.ckpt', latest_checkpoint)
+    self.assertEmpty(
+        tf.io.gfile.glob(os.path.join(model_dir, 'ctl_step_4.ckpt*')))
+    for name, _ in tf.train.list_variables(latest_checkpoint):
+      value = tf.train.load_variable(latest_checkpoint, name)
+      if np.issubdtype(np.asarray(value).dtype, np.floating):
+        self.assertTrue(np.all(np.isfinite(value)), name)
+
+  def _rebuild_and_evaluate(self, checkpoint_path, input_fn):
+    """Evaluates a checkpoint in a new model, as for every checkpoint before."""
+    model = _model_fn(None)
+    tf.train.Checkpoint(model=model).restore(checkpoint_path).expect_partial()
+    metric = tf.keras.metrics.MeanSquaredError('mse')
+    for inputs, labels in input_fn():
+      metric.update_state(labels, model(inputs, training=False))
+    return metric.result().numpy()
+
+  def test_evaluate_checkpoints_with_one_evaluator(self):
+    model_dir = self.get_temp_dir()
+    input_fn = _input_fn(num_batches=6)
+    self._train(model_dir, input_fn, lag_metrics=False)
+    checkpoints = sorted(
+        path[:-len('.index')]
+        for path in tf.io.gfile.glob(os.path.join(model_dir, '*.index')))
+    self.assertLen(checkpoints, 3)
+    eval_metric_fn = lambda: tf.keras.metrics.MeanSquaredError('mse')
+
+    executor = self._executor()
+    evaluator = executor.build_evaluator(input_fn, eval_metric_fn)
+    results, steps = [], []
+    for checkpoint_path in checkpoints:
+      result, step = executor.evaluate_checkpoint(
+          checkpoint_path, input_fn, eval_metric_fn, evaluator=evaluator)
+      self.assertAllClose(
+          self._rebuild_and_evaluate(checkpoint_path, input_fn), result)
+      results.append(result)
+      steps.append(int(step))
+    self.assertEqual([2, 4, 6], steps)
+    self.assertNotAllClose(results[0], results[-1])
+
+    writers = {}
+    result = self._executor().evaluate_from_model_dir(
+        model_dir, input_fn, eval_metric_fn,
+        total_steps=6,
+        eval_timeout=1,
+        min_eval_interval=0,
+        summary_writer_fn=_recording_writer_fn(writers))
+
+    self.assertAllClose(
+        self._rebuild_and_evaluate(checkpoints[-1], input_fn), result)
+    self.assertAllClose({6: result}, writers['eval'].metrics)
+
+
+if __name__ == '__main__':
+  tf.test.main()
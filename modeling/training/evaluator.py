@@ -0,0 +1,107 @@
+# Lint as: python3
+# ==============================================================================
+"""An evaluator keeping its model, test step and input pipeline across evals."""
+
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import time
+
+from absl import logging
+import tensorflow as tf
+from typing import Any, Callable, Dict, List, Optional, Text
+
+
+class Evaluator(object):
+  """Evaluates a model repeatedly, e.g. after every training loop.
+
+  The distributed evaluation dataset and the `tf.function` of the test step
+  are built on the first evaluation, and reused by the next ones: each
+  evaluation only creates a new iterator over the same dataset. `restore`
+  loads the weights of a checkpoint into the same model, so evaluating a
+  series of checkpoints neither rebuilds the model nor retraces the step.
+
+  The setup time of every evaluation, the time spent restoring the weights and
+  creating the input pipeline before the first step, is recorded in
+  `setup_times`.
+  """
+
+  def __init__(self,
+               strategy: tf.distribute.Strategy,
+               model: tf.keras.Model,
+               metrics: List[tf.keras.metrics.Metric],
+               dataset_fn: Callable[[], Any],
+               eval_steps: Optional[int] = None,
+               use_tf_function: bool = True):
+    """Creates an evaluator.
+
+    Args:
+      strategy: the distribution strategy of `model`.
+      model: the Keras model, built in the scope of `strategy`.
+      metrics: the metrics of the labels and the model outputs.
+      dataset_fn: returns the distributed evaluation dataset, of (inputs,
+        labels) batches. Only called once.
+      eval_steps: the number of steps of an evaluation, or None to evaluate
+        until the end of the dataset.
+      use_tf_function: whether to run the test step as a `tf.function`.
+    """
+    self._strategy = strategy
+    self.model = model
+    self.metrics = metrics
+    self._dataset_fn = dataset_fn
+    self._eval_steps = eval_steps
+    self._dataset = None
+    self._checkpoint = None
+    self._pending_setup_time = 0.
+    self.setup_times = []
+
+    def test_step(iterator):
+      """Updates the metrics with a batch of every replica."""
+
+      def _test_step_fn(inputs):
+        inputs, labels = inputs
+        model_outputs = model(inputs, training=False)
+        for metric in metrics:
+          metric.update_state(labels, model_outputs)
+
+      strategy.run(_test_step_fn, args=(next(iterator),))
+
+    self._test_step = tf.function(test_step) if use_tf_function else test_step
+
+  def restore(self, checkpoint_path: Text):
+    """Restores the model weights of a `tf.train.Checkpoint(model=...)`."""
+    start_time = time.time()
+    if self._checkpoint is None:
+      self._checkpoint = tf.train.Checkpoint(model=self.model)
+    with self._strategy.scope():
+      self._checkpoint.restore(checkpoint_path).expect_partial()
+    self._pending_setup_time += time.time() - start_time
+
+  def evaluate(self) -> Dict[Text, Any]:
+    """Evaluates the model.
+
+    Returns:
+      The results of the metrics by name.
+    """
+    start_time = time.time()
+    if self._dataset is None:
+      self._dataset = self._dataset_fn()
+    iterator = iter(self._dataset)
+    for metric in self.metrics:
+      metric.reset_states()
+    setup_time = self._pending_setup_time + time.time() - start_time
+    self._pending_setup_time = 0.
+    self.setup_times.append(setup_time)
+
+    step = 0
+    while self._eval_steps is None or step < self._eval_steps:
+      try:
+        self._test_step(iterator)
+      except (StopIteration, tf.errors.OutOfRangeError):
+        break
+      step += 1
+    logging.info('Evaluated %d steps in %.2f seconds, after a setup of %.2f '
+                 'seconds.', step, time.time() - start_time, setup_time)
+    return {metric.name: metric.result() for metric in self.metrics}
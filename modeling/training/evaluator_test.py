@@ -0,0 +1,115 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for evaluator."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from modeling.training import evaluator as evaluator_lib
+
+_NUM_BATCHES = 5
+_BATCH_SIZE = 2
+
+
+class _CountingModel(tf.keras.Model):
+  """A linear model counting the traces of its call."""
+
+  def __init__(self):
+    super(_CountingModel, self).__init__()
+    self.dense = tf.keras.layers.Dense(
+        1, kernel_initializer='ones', bias_initializer='zeros')
+    self.num_calls = 0
+
+  def call(self, inputs, training=None):
+    self.num_calls += 1
+    return self.dense(inputs)
+
+
+def _dataset_fn():
+  # Inputs of ones and labels of zeros: the absolute error of an example is
+  # the sum of the kernel and bias.
+  inputs = tf.ones([_NUM_BATCHES * _BATCH_SIZE, 3])
+  labels = tf.zeros([_NUM_BATCHES * _BATCH_SIZE, 1])
+  dataset = tf.data.Dataset.from_tensor_slices((inputs, labels))
+  dataset = dataset.batch(_BATCH_SIZE)
+  return tf.distribute.get_strategy().experimental_distribute_dataset(dataset)
+
+
+class EvaluatorTest(tf.test.TestCase):
+
+  def _evaluator(self, eval_steps=None):
+    model = _CountingModel()
+    model(tf.ones([1, 3]))
+    metric = tf.keras.metrics.MeanAbsoluteError('mae')
+    return evaluator_lib.Evaluator(
+        tf.distribute.get_strategy(),
+        model, [metric],
+        dataset_fn=_dataset_fn,
+        eval_steps=eval_steps)
+
+  def _save_checkpoint(self, kernel_value, name):
+    """Saves a checkpoint of a model with all its kernel set to a value."""
+    model = _CountingModel()
+    model(tf.ones([1, 3]))
+    model.dense.kernel.assign(tf.fill([3, 1], kernel_value))
+    return tf.train.Checkpoint(model=model).save(
+        os.path.join(self.get_temp_dir(), name))
+
+  def test_restore_checkpoints_without_retracing(self):
+    first_checkpoint = self._save_checkpoint(2., 'first')
+    second_checkpoint = self._save_checkpoint(-1., 'second')
+    evaluator = self._evaluator()
+    num_calls = evaluator.model.num_calls
+
+    evaluator.restore(first_checkpoint)
+    self.assertAllClose({'mae': 6.}, evaluator.evaluate())
+    evaluator.restore(second_checkpoint)
+    self.assertAllClose({'mae': 3.}, evaluator.evaluate())
+    evaluator.restore(first_checkpoint)
+    self.assertAllClose({'mae': 6.}, evaluator.evaluate())
+
+    # The test step is only traced by the first evaluation
+    self.assertEqual(num_calls + 1, evaluator.model.num_calls)
+    self.assertLen(evaluator.setup_times, 3)
+
+  def test_evaluates_until_end_of_dataset(self):
+    evaluator = self._evaluator()
+    metric, = evaluator.metrics
+
+    for _ in range(2):
+      self.assertAllClose({'mae': 3.}, evaluator.evaluate())
+      # Every example of the dataset, once per evaluation
+      self.assertEqual(_NUM_BATCHES * _BATCH_SIZE, int(metric.count))
+
+  def test_evaluates_eval_steps(self):
+    evaluator = self._evaluator(eval_steps=2)
+    metric, = evaluator.metrics
+
+    evaluator.evaluate()
+
+    self.assertEqual(2 * _BATCH_SIZE, int(metric.count))
+
+  def test_dataset_fn_is_called_once(self):
+    num_datasets = []
+
+    def dataset_fn():
+      num_datasets.append(1)
+      return _dataset_fn()
+
+    evaluator = evaluator_lib.Evaluator(
+        tf.distribute.get_strategy(),
+        _CountingModel(), [tf.keras.metrics.MeanAbsoluteError('mae')],
+        dataset_fn=dataset_fn)
+    evaluator.evaluate()
+    evaluator.evaluate()
+
+    self.assertLen(num_datasets, 1)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -27,6 +27,7 @@ import tensorflow as tf
 from typing import Callable, Dict, Optional, Text
 
 from staging.training import utils
+from utils.misc import async_checkpoint
 
 
 class Controller(object):
@@ -71,7 +72,9 @@ class Controller(object):
         training (passed to the `num_steps` parameter of `train_fn`).
       summary_dir: The directory to restore and write checkpoints and summaries.
         If None, it will be set to `checkpoint_manager.directory`.
-      checkpoint_manager: An instance of `tf.train.CheckpointManager`.
+      checkpoint_manager: An instance of `tf.train.CheckpointManager`. With an
+        `AsyncCheckpointManager`, checkpoints are written in the background
+        and flushed at the end of `train`.
       summary_interval: Step interval for training summaries. Note that this
         argument only applies to the summaries outside the training loop. If the
         value is None, then training summaries are not enabled.
@@ -271,6 +274,10 @@ class Controller(object):
     self.summary_manager.write_summaries(train_outputs, always_write=True)
     self.summary_manager.flush()
     self._maybe_save_checkpoints(current_step, force_trigger=True)
+    if isinstance(self.checkpoint_manager,
+                  async_checkpoint.AsyncCheckpointManager):
+      # Training is done, so wait for the checkpoints to be written
+      self.checkpoint_manager.flush()
     if evaluate:
       self._maybe_evaluate(current_step, force_trigger=True)
 
@@ -71,6 +71,12 @@ def define_common_hparams_flags():
             'See also the help message of `--config_file`.'))
   flags.DEFINE_integer('save_checkpoint_freq', None,
                        'Number of steps to save checkpoint.')
+  flags.DEFINE_bool('async_checkpoint', False,
+                    'Whether to write checkpoints in a background thread, '
+                    'from a snapshot of the variables in host memory.')
+  flags.DEFINE_bool('lag_metrics', False,
+                    'Whether the custom training loop fetches the loss and '
+                    'metrics of a loop only after the next one is started.')
 
 
 def initialize_common_flags():
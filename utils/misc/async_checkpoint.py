@@ -0,0 +1,282 @@
+# Lint as: python3
+# ==============================================================================
+"""Writes checkpoints in a background thread.
+
+Saving a checkpoint serializes every variable, including the optimizer slots,
+while the training step waits. `AsyncCheckpointWriter` only waits for the
+values to be copied to host memory, and writes the checkpoint files in a
+background thread:
+
+  * the checkpoint is written under a temporary prefix, and its files are
+    renamed into place once complete, the `.index` file last,
+  * the `checkpoint` state file of the directory is only updated after that,
+    so the latest checkpoint is always complete, even after a preemption,
+  * at most `max_in_flight` snapshots are pending; further saves wait for the
+    oldest one, which bounds the host memory used,
+  * `flush` waits for the pending writes, and raises the error of a failed
+    one. The writer thread is also joined at interpreter exit.
+
+The checkpoints are the same as those of `tf.train.Checkpoint.save` or
+`tf.keras.Model.save_weights` for the same root object.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+from concurrent import futures
+import os
+import threading
+
+from absl import logging
+import tensorflow as tf
+from typing import Any, Callable, List, Optional, Text
+
+from tensorflow.python.training.tracking import base as trackable_base  # pylint: disable=g-direct-tensorflow-import
+from tensorflow.python.training.tracking import graph_view  # pylint: disable=g-direct-tensorflow-import
+
+_TEMP_SUFFIX = '.tmp'
+_INDEX_SUFFIX = '.index'
+
+
+def _snapshot(root):
+  """Returns the names, slices and host values of the checkpoint of `root`."""
+  saveables, object_graph, _ = graph_view.ObjectGraphView(
+      root).serialize_object_graph()
+  names = [trackable_base.OBJECT_GRAPH_PROTO_KEY]
+  slices = ['']
+  tensors = [tf.constant(object_graph.SerializeToString())]
+  for saveable in saveables:
+    for spec in saveable.specs:
+      names.append(spec.name)
+      slices.append(spec.slice_spec)
+      tensors.append(spec.tensor)
+  # Copies all the values before any of them is awaited
+  values = [tensor.numpy() for tensor in tensors]
+  return names, slices, values
+
+
+def _write(file_prefix, names, slices, values):
+  """Writes a checkpoint, then renames its files to `file_prefix`."""
+  temp_prefix = file_prefix + _TEMP_SUFFIX
+  with tf.device('/cpu:0'):
+    tf.raw_ops.SaveV2(prefix=temp_prefix,
+                      tensor_names=names,
+                      shape_and_slices=slices,
+                      tensors=[tf.constant(value) for value in values])
+  temp_files = tf.io.gfile.glob(temp_prefix + '.*')
+  # The index makes the checkpoint visible, so it is renamed last
+  temp_files.sort(key=lambda path: path.endswith(_INDEX_SUFFIX))
+  for temp_file in temp_files:
+    tf.io.gfile.rename(temp_file,
+                       file_prefix + temp_file[len(temp_prefix):],
+                       overwrite=True)
+
+
+def record_checkpoint(file_prefix, all_file_prefixes=None):
+  """Records a written checkpoint as the latest one of its directory."""
+  directory = os.path.dirname(file_prefix)
+  tf.compat.v1.train.update_checkpoint_state(
+      directory,
+      os.path.basename(file_prefix),
+      all_model_checkpoint_paths=[
+          os.path.basename(path)
+          for path in all_file_prefixes or [file_prefix]])
+
+
+def delete_checkpoint(file_prefix):
+  """Deletes the files of a checkpoint."""
+  for path in tf.io.gfile.glob(file_prefix + '.*'):
+    tf.io.gfile.remove(path)
+
+
+class AsyncCheckpointWriter(object):
+  """Writes the checkpoints of a trackable object in a background thread."""
+
+  def __init__(self, root, max_in_flight: int = 1):
+    """Creates a writer.
+
+    Args:
+      root: the root trackable object of the checkpoints, e.g. a
+        `tf.train.Checkpoint` or a Keras model.
+      max_in_flight: the maximum number of snapshots waiting to be written.
+    """
+    if max_in_flight < 1:
+      raise ValueError('max_in_flight should be positive, got {}.'.format(
+          max_in_flight))
+    self._root = root
+    self._slots = threading.BoundedSemaphore(max_in_flight)
+    self._executor = futures.ThreadPoolExecutor(max_workers=1)
+    self._pending = []
+    self._saved_prefixes = []
+
+  def _check_errors(self, wait: bool):
+    """Raises the error of the first failed write, if any."""
+    pending = []
+    for future in self._pending:
+      if wait or future.done():
+        future.result()
+      else:
+        pending.append(future)
+    self._pending = pending
+
+  def write(self,
+            file_prefix: Text,
+            on_written: Optional[Callable[[Text], Any]] = None) -> Text:
+    """Snapshots the variables and writes them to `file_prefix`.
+
+    Args:
+      file_prefix: the prefix of the checkpoint files.
+      on_written: called in the background thread with `file_prefix` once the
+        checkpoint is in place, e.g. to record it as the latest one.
+
+    Returns:
+      `file_prefix`.
+    """
+    self._check_errors(wait=False)
+    self._slots.acquire()
+    try:
+      snapshot = _snapshot(self._root)
+    except Exception:
+      self._slots.release()
+      raise
+
+    def write_fn():
+      try:
+        _write(file_prefix, *snapshot)
+        if on_written is not None:
+          on_written(file_prefix)
+        logging.info('Wrote the checkpoint %s.', file_prefix)
+      finally:
+        self._slots.release()
+
+    self._pending.append(self._executor.submit(write_fn))
+    return file_prefix
+
+  def save(self, file_prefix: Text) -> Text:
+    """Like `tf.train.Checkpoint.save`, numbers and records the checkpoint.
+
+    Args:
+      file_prefix: the prefix of the checkpoints, numbered by the
+        `save_counter` of the root `tf.train.Checkpoint`.
+
+    Returns:
+      The prefix of the checkpoint files.
+    """
+    save_counter = self._root.save_counter
+    save_counter.assign_add(1)
+    file_prefix = '{}-{}'.format(file_prefix, int(save_counter.numpy()))
+
+    def on_written(path):
+      self._saved_prefixes.append(path)
+      record_checkpoint(path, self._saved_prefixes)
+
+    return self.write(file_prefix, on_written=on_written)
+
+  def flush(self):
+    """Waits for the pending checkpoints, and raises any write error."""
+    self._check_errors(wait=True)
+
+  def close(self):
+    """Flushes and stops the background thread."""
+    try:
+      self.flush()
+    finally:
+      self._executor.shutdown(wait=True)
+
+
+class AsyncCheckpointManager(tf.train.CheckpointManager):
+  """A `tf.train.CheckpointManager` writing in the background.
+
+  `save` returns once the variables are copied to host memory. A checkpoint
+  only becomes the `latest_checkpoint`, and the oldest ones beyond
+  `max_to_keep` are only deleted, once it is written.
+  """
+
+  def __init__(self,
+               checkpoint: tf.train.Checkpoint,
+               directory: Text,
+               max_to_keep: Optional[int],
+               checkpoint_name: Text = 'ckpt',
+               step_counter: Optional[tf.Variable] = None,
+               checkpoint_interval: Optional[int] = None,
+               max_in_flight: int = 1):
+    """Creates a manager, see `tf.train.CheckpointManager`.
+
+    Args:
+      checkpoint: the `tf.train.Checkpoint` to save and restore.
+      directory: the directory of the checkpoints.
+      max_to_keep: the number of checkpoints to keep, None to keep all.
+      checkpoint_name: the prefix of the checkpoint names.
+      step_counter: the step variable, required by `checkpoint_interval`.
+      checkpoint_interval: the minimum number of steps between checkpoints.
+      max_in_flight: the maximum number of snapshots waiting to be written.
+    """
+    super(AsyncCheckpointManager, self).__init__(
+        checkpoint,
+        directory,
+        max_to_keep,
+        checkpoint_name=checkpoint_name,
+        step_counter=step_counter,
+        checkpoint_interval=checkpoint_interval)
+    self._writer = AsyncCheckpointWriter(checkpoint,
+                                         max_in_flight=max_in_flight)
+    self._async_prefix = os.path.join(directory, checkpoint_name)
+    self._async_max_to_keep = max_to_keep
+    self._async_step_counter = step_counter
+    self._async_checkpoint_interval = checkpoint_interval
+    self._last_saved_step = None
+    self._written = list(super(AsyncCheckpointManager, self).checkpoints)
+    self._written_lock = threading.Lock()
+
+  @property
+  def latest_checkpoint(self) -> Optional[Text]:
+    """The prefix of the latest written checkpoint, if any."""
+    with self._written_lock:
+      return self._written[-1] if self._written else None
+
+  @property
+  def checkpoints(self) -> List[Text]:
+    """The prefixes of the kept written checkpoints, oldest first."""
+    with self._written_lock:
+      return list(self._written)
+
+  def _on_written(self, file_prefix):
+    with self._written_lock:
+      self._written.append(file_prefix)
+      if self._async_max_to_keep is not None:
+        while len(self._written) > self._async_max_to_keep:
+          delete_checkpoint(self._written.pop(0))
+      record_checkpoint(file_prefix, self._written)
+
+  def save(self, checkpoint_number=None, check_interval: bool = True
+          ) -> Optional[Text]:
+    """Starts writing a checkpoint, see `tf.train.CheckpointManager.save`.
+
+    Returns:
+      The prefix of the checkpoint being written, or None if the interval
+      since the last checkpoint is too short.
+    """
+    if self._async_checkpoint_interval is not None:
+      current_step = int(self._async_step_counter.numpy())
+      if self._last_saved_step is not None:
+        if current_step == self._last_saved_step:
+          return None
+        if check_interval and current_step < (
+            self._last_saved_step + self._async_checkpoint_interval):
+          return None
+      self._last_saved_step = current_step
+
+    save_counter = self.checkpoint.save_counter
+    save_counter.assign_add(1)
+    if checkpoint_number is None:
+      checkpoint_number = save_counter
+    if isinstance(checkpoint_number, tf.Variable):
+      checkpoint_number = checkpoint_number.numpy()
+    file_prefix = '{}-{}'.format(self._async_prefix, int(checkpoint_number))
+    return self._writer.write(file_prefix, on_written=self._on_written)
+
+  def flush(self):
+    """Waits for the pending checkpoints, and raises any write error."""
+    self._writer.flush()
@@ -0,0 +1,83 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for async_checkpoint."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from utils.misc import async_checkpoint
+
+
+def _model():
+  inputs = tf.keras.layers.Input(shape=(3,))
+  outputs = tf.keras.layers.Dense(2)(inputs)
+  model = tf.keras.Model(inputs, outputs)
+  model.compile(optimizer=tf.keras.optimizers.SGD(0.1, momentum=0.9),
+                loss='mse')
+  model.fit(tf.ones((4, 3)), tf.ones((4, 2)), verbose=0)
+  return model
+
+
+class AsyncCheckpointTest(tf.test.TestCase):
+
+  def test_snapshot_is_taken_before_the_write(self):
+    variable = tf.Variable(1.)
+    checkpoint = tf.train.Checkpoint(variable=variable)
+    writer = async_checkpoint.AsyncCheckpointWriter(checkpoint)
+    prefix = os.path.join(self.get_temp_dir(), 'ckpt')
+
+    path = writer.save(prefix)
+    variable.assign(2.)
+    writer.close()
+
+    self.assertEqual(path, tf.train.latest_checkpoint(self.get_temp_dir()))
+    self.assertEmpty(tf.io.gfile.glob(path + '.tmp*'))
+    checkpoint.restore(path).assert_consumed()
+    self.assertEqual(1., variable.numpy())
+
+  def test_same_checkpoint_as_save_weights(self):
+    model = _model()
+    path = os.path.join(self.get_temp_dir(), 'model.ckpt')
+    writer = async_checkpoint.AsyncCheckpointWriter(model)
+
+    writer.write(path, on_written=async_checkpoint.record_checkpoint)
+    writer.flush()
+
+    self.assertEqual(path, tf.train.latest_checkpoint(self.get_temp_dir()))
+    restored = _model()
+    restored.load_weights(path).assert_consumed()
+    for expected, actual in zip(model.optimizer.weights,
+                                restored.optimizer.weights):
+      self.assertAllClose(expected, actual)
+
+  def test_manager_keeps_written_checkpoints(self):
+    step = tf.Variable(0, dtype=tf.int64)
+    manager = async_checkpoint.AsyncCheckpointManager(
+        tf.train.Checkpoint(step=step),
+        self.get_temp_dir(),
+        max_to_keep=2,
+        step_counter=step,
+        checkpoint_interval=2,
+        max_in_flight=2)
+
+    for _ in range(6):
+      step.assign_add(1)
+      manager.save(checkpoint_number=step)
+    manager.flush()
+
+    self.assertEqual(
+        [os.path.join(self.get_temp_dir(), 'ckpt-%d' % i) for i in [3, 5]],
+        manager.checkpoints)
+    self.assertEqual(manager.latest_checkpoint,
+                     tf.train.latest_checkpoint(self.get_temp_dir()))
+    self.assertEmpty(
+        tf.io.gfile.glob(os.path.join(self.get_temp_dir(), 'ckpt-1.*')))
+
+
+if __name__ == '__main__':
+  tf.test.main()
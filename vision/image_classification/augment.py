@@ -516,10 +516,12 @@ def invert(image: tf.Tensor) -> tf.Tensor:
 
 
 def wrap(image: tf.Tensor) -> tf.Tensor:
-    """Returns 'image' with an extra channel set to all 1s."""
-    shape = tf.shape(image)
-    extended_channel = tf.ones([shape[0], shape[1], 1], image.dtype)
-    extended = tf.concat([image, extended_channel], axis=2)
+    """Returns 'image' with an extra channel set to all 1s.
+
+    Works on a single [height, width, C] image or a [N, height, width, C] batch.
+    """
+    extended_channel = tf.ones_like(image[..., :1])
+    extended = tf.concat([image, extended_channel], axis=-1)
     return extended
 
 
@@ -535,15 +537,16 @@ def unwrap(image: tf.Tensor, replace: int) -> tf.Tensor:
 
 
     Args:
-      image: A 3D Image Tensor with 4 channels.
+      image: A 3D or 4D (batched) Image Tensor with 4 channels.
       replace: A one or three value 1D tensor to fill empty pixels.
 
     Returns:
-      image: A 3D image Tensor with 3 channels.
+      image: An image Tensor of the same rank with 3 channels.
     """
     image_shape = tf.shape(image)
-    # Flatten the spatial dimensions.
-    flattened_image = tf.reshape(image, [-1, image_shape[2]])
+    # Flatten the spatial (and batch) dimensions.
+    flattened_image = tf.reshape(
+        image, [tf.reduce_prod(image_shape[:-1]), image_shape[-1]])
 
     # Find all pixels where the last channel is zero.
     alpha_channel = tf.expand_dims(flattened_image[:, 3], axis=-1)
@@ -557,10 +560,209 @@ def unwrap(image: tf.Tensor, replace: int) -> tf.Tensor:
         flattened_image)
 
     image = tf.reshape(flattened_image, image_shape)
-    image = tf.slice(image, [0, 0, 0], [image_shape[0], image_shape[1], 3])
+    image = image[..., :3]
     return image
 
 
+# The functions below operate on a batch of images of shape [N, H, W, 3]. They
+# mirror the single image ops above, but compute per-image statistics with
+# reductions over the spatial axes instead of calling the single image op once
+# per example. Ops that take a random sign flip it independently per example.
+
+
+def _randomly_negate_batch(tensor, batch_size: tf.Tensor) -> tf.Tensor:
+    """Returns `tensor` broadcast to `batch_size`, negated with 50% prob each."""
+    tensor = tf.convert_to_tensor(tensor, dtype=tf.float32)
+    should_flip = tf.random.uniform([batch_size]) < 0.5
+    return tf.where(should_flip, -tensor, tensor)
+
+
+def cutout_batch(images: tf.Tensor,
+                 pad_size: int,
+                 replace: int = 0) -> tf.Tensor:
+    """Applies `cutout` with an independently sampled location per image.
+
+    Args:
+      images: An image Tensor of type uint8 and shape [N, H, W, 3].
+      pad_size: The mask will be of size (2*pad_size x 2*pad_size).
+      replace: What pixel value to fill in the masked area.
+
+    Returns:
+      An image Tensor that is of type uint8.
+    """
+    shape = tf.shape(images)
+    batch_size, image_height, image_width = shape[0], shape[1], shape[2]
+
+    cutout_center_height = tf.random.uniform(
+        shape=[batch_size, 1, 1, 1], minval=0, maxval=image_height,
+        dtype=tf.int32)
+    cutout_center_width = tf.random.uniform(
+        shape=[batch_size, 1, 1, 1], minval=0, maxval=image_width,
+        dtype=tf.int32)
+
+    rows = tf.reshape(tf.range(image_height), [1, -1, 1, 1])
+    cols = tf.reshape(tf.range(image_width), [1, 1, -1, 1])
+    inside = tf.logical_and(
+        tf.logical_and(rows >= cutout_center_height - pad_size,
+                       rows < cutout_center_height + pad_size),
+        tf.logical_and(cols >= cutout_center_width - pad_size,
+                       cols < cutout_center_width + pad_size))
+    return tf.where(
+        inside,
+        tf.ones_like(images, dtype=images.dtype) * replace,
+        images)
+
+
+def contrast_batch(images: tf.Tensor, factor: float) -> tf.Tensor:
+    """Applies `contrast` to each image in a batch."""
+    shape = tf.shape(images)
+    degenerate = tf.image.rgb_to_grayscale(images)
+    # Same as `contrast`: the grayscale histogram of each image sums to its
+    # number of pixels, so the mean is the same for every image in the batch.
+    mean = tf.cast(shape[1] * shape[2], tf.float32) / 256.0
+    degenerate = tf.ones_like(degenerate, dtype=tf.float32) * mean
+    degenerate = tf.clip_by_value(degenerate, 0.0, 255.0)
+    degenerate = tf.image.grayscale_to_rgb(tf.cast(degenerate, tf.uint8))
+    return blend(degenerate, images, factor)
+
+
+def wrapped_rotate_batch(images: tf.Tensor,
+                         degrees: float,
+                         replace: int) -> tf.Tensor:
+    """Applies `wrapped_rotate` with a random direction per image."""
+    degrees = _randomly_negate_batch(degrees, tf.shape(images)[0])
+    images = rotate(wrap(images), degrees=degrees)
+    return unwrap(images, replace)
+
+
+def translate_x_batch(images: tf.Tensor,
+                      pixels: int,
+                      replace: int) -> tf.Tensor:
+    """Applies `translate_x` with a random direction per image."""
+    pixels = _randomly_negate_batch(pixels, tf.shape(images)[0])
+    translations = tf.stack([-pixels, tf.zeros_like(pixels)], axis=1)
+    images = translate(wrap(images), translations)
+    return unwrap(images, replace)
+
+
+def translate_y_batch(images: tf.Tensor,
+                      pixels: int,
+                      replace: int) -> tf.Tensor:
+    """Applies `translate_y` with a random direction per image."""
+    pixels = _randomly_negate_batch(pixels, tf.shape(images)[0])
+    translations = tf.stack([tf.zeros_like(pixels), -pixels], axis=1)
+    images = translate(wrap(images), translations)
+    return unwrap(images, replace)
+
+
+def _shear_transforms(level: tf.Tensor, axis: int) -> tf.Tensor:
+    """Builds one shear projective transform per element of `level`."""
+    ones = tf.ones_like(level)
+    zeros = tf.zeros_like(level)
+    if axis == 0:
+        transforms = [ones, level, zeros, zeros, ones, zeros, zeros, zeros]
+    else:
+        transforms = [ones, zeros, zeros, level, ones, zeros, zeros, zeros]
+    return tf.stack(transforms, axis=1)
+
+
+def shear_x_batch(images: tf.Tensor, level: float, replace: int) -> tf.Tensor:
+    """Applies `shear_x` with a random direction per image."""
+    level = _randomly_negate_batch(level, tf.shape(images)[0])
+    images = transform(image=wrap(images),
+                       transforms=_shear_transforms(level, axis=0))
+    return unwrap(images, replace)
+
+
+def shear_y_batch(images: tf.Tensor, level: float, replace: int) -> tf.Tensor:
+    """Applies `shear_y` with a random direction per image."""
+    level = _randomly_negate_batch(level, tf.shape(images)[0])
+    images = transform(image=wrap(images),
+                       transforms=_shear_transforms(level, axis=1))
+    return unwrap(images, replace)
+
+
+def autocontrast_batch(images: tf.Tensor) -> tf.Tensor:
+    """Applies `autocontrast` to each image and channel in a batch."""
+    lo = tf.cast(tf.reduce_min(images, axis=[1, 2], keepdims=True), tf.float32)
+    hi = tf.cast(tf.reduce_max(images, axis=[1, 2], keepdims=True), tf.float32)
+    should_scale = hi > lo
+
+    # Channels with a single value are left unchanged, as in `autocontrast`.
+    scale = 255.0 / tf.where(should_scale, hi - lo, tf.ones_like(hi))
+    offset = -lo * scale
+    scaled = tf.cast(images, tf.float32) * scale + offset
+    scaled = tf.cast(tf.clip_by_value(scaled, 0.0, 255.0), tf.uint8)
+    return tf.where(should_scale, scaled, images)
+
+
+def sharpness_batch(images: tf.Tensor, factor: float) -> tf.Tensor:
+    """Applies `sharpness` to each image in a batch."""
+    orig_images = images
+    images = tf.cast(images, tf.float32)
+    # SMOOTH PIL Kernel.
+    kernel = tf.constant(
+        [[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=tf.float32,
+        shape=[3, 3, 1, 1]) / 13.
+    # Tile across channel dimension.
+    kernel = tf.tile(kernel, [1, 1, 3, 1])
+    strides = [1, 1, 1, 1]
+    degenerate = tf.nn.depthwise_conv2d(
+        images, kernel, strides, padding='VALID', dilations=[1, 1])
+    degenerate = tf.clip_by_value(degenerate, 0.0, 255.0)
+    degenerate = tf.cast(degenerate, tf.uint8)
+
+    # For the borders of the resulting images, fill in the values of the
+    # original images.
+    paddings = [[0, 0], [1, 1], [1, 1], [0, 0]]
+    padded_mask = tf.pad(tf.ones_like(degenerate), paddings)
+    padded_degenerate = tf.pad(degenerate, paddings)
+    result = tf.where(tf.equal(padded_mask, 1), padded_degenerate, orig_images)
+
+    # Blend the final result.
+    return blend(result, orig_images, factor)
+
+
+def equalize_batch(images: tf.Tensor) -> tf.Tensor:
+    """Applies `equalize` to each image and channel in a batch."""
+    shape = tf.shape(images)
+    batch_size = shape[0]
+    num_pixels = shape[1] * shape[2]
+
+    # [N, 3, H * W], so every (image, channel) pair is a row.
+    pixels = tf.transpose(images, [0, 3, 1, 2])
+    pixels = tf.cast(tf.reshape(pixels, [batch_size, 3, num_pixels]), tf.int32)
+
+    # Compute all of the histograms with a single segment sum.
+    row_offsets = tf.reshape(tf.range(batch_size * 3) * 256,
+                             [batch_size, 3, 1])
+    histo = tf.math.unsorted_segment_sum(tf.ones_like(pixels),
+                                         pixels + row_offsets,
+                                         batch_size * 3 * 256)
+    histo = tf.reshape(histo, [batch_size, 3, 256])
+
+    # The step ignores the last nonzero bin of each histogram.
+    reversed_nonzero = tf.reverse(tf.cast(histo > 0, tf.int32), axis=[-1])
+    last_nonzero = 255 - tf.argmax(reversed_nonzero, axis=-1,
+                                   output_type=tf.int32)
+    last_nonzero_count = tf.gather(histo, last_nonzero, batch_dims=2)
+    step = (tf.reduce_sum(histo, axis=-1) - last_nonzero_count) // 255
+    step = step[..., None]
+
+    # Build the lookup tables as in `equalize`, with a guarded division for the
+    # rows that will be left unchanged.
+    safe_step = tf.maximum(step, 1)
+    lut = (tf.cumsum(histo, axis=-1) + (safe_step // 2)) // safe_step
+    lut = tf.concat([tf.zeros_like(lut[..., :1]), lut[..., :-1]], axis=-1)
+    lut = tf.clip_by_value(lut, 0, 255)
+
+    result = tf.where(tf.equal(step, 0),
+                      pixels,
+                      tf.gather(lut, pixels, batch_dims=2))
+    result = tf.reshape(result, [batch_size, 3, shape[1], shape[2]])
+    return tf.cast(tf.transpose(result, [0, 2, 3, 1]), tf.uint8)
+
+
 def _randomly_negate_tensor(tensor):
     """With 50% prob turn the tensor negative."""
     should_flip = tf.cast(tf.floor(tf.random.uniform([]) + 0.5), tf.bool)
@@ -568,9 +770,10 @@ def _randomly_negate_tensor(tensor):
     return final_tensor
 
 
-def _rotate_level_to_arg(level: float):
+def _rotate_level_to_arg(level: float, randomly_negate: bool = True):
     level = (level / _MAX_LEVEL) * 30.
-    level = _randomly_negate_tensor(level)
+    if randomly_negate:
+        level = _randomly_negate_tensor(level)
     return (level,)
 
 
@@ -587,17 +790,21 @@ def _enhance_level_to_arg(level: float):
     return ((level / _MAX_LEVEL) * 1.8 + 0.1,)
 
 
-def _shear_level_to_arg(level: float):
+def _shear_level_to_arg(level: float, randomly_negate: bool = True):
     level = (level / _MAX_LEVEL) * 0.3
-    # Flip level to negative with 50% chance.
-    level = _randomly_negate_tensor(level)
+    if randomly_negate:
+        # Flip level to negative with 50% chance.
+        level = _randomly_negate_tensor(level)
     return (level,)
 
 
-def _translate_level_to_arg(level: float, translate_const: float):
+def _translate_level_to_arg(level: float,
+                            translate_const: float,
+                            randomly_negate: bool = True):
     level = (level / _MAX_LEVEL) * float(translate_const)
-    # Flip level to negative with 50% chance.
-    level = _randomly_negate_tensor(level)
+    if randomly_negate:
+        # Flip level to negative with 50% chance.
+        level = _randomly_negate_tensor(level)
     return (level,)
 
 
@@ -635,6 +842,31 @@ def select_and_apply_random_policy(policies: Any, image: tf.Tensor):
     return image
 
 
+def _apply_to_selected(func: Any,
+                       images: tf.Tensor,
+                       args: Any,
+                       should_apply: tf.Tensor) -> tf.Tensor:
+    """Apply batched `func` w/ `args` to the images where `should_apply` is set.
+
+    Only the selected images are gathered and passed to `func`, so the cost of
+    an op is proportional to the number of images it is applied to.
+
+    Args:
+      func: A batched image op, see `BATCH_NAME_TO_FUNC`.
+      images: An image Tensor of shape [N, height, width, 3].
+      args: A tuple of extra arguments for `func`.
+      should_apply: A boolean Tensor of shape [N].
+
+    Returns:
+      A Tensor of the same shape and type as `images`.
+    """
+    assert isinstance(args, tuple)
+    indices = tf.where(should_apply)
+    selected = tf.gather_nd(images, indices)
+    augmented = func(selected, *args)
+    return tf.tensor_scatter_nd_update(images, indices, augmented)
+
+
 NAME_TO_FUNC = {
     'AutoContrast': autocontrast,
     'Equalize': equalize,
@@ -654,6 +886,26 @@ NAME_TO_FUNC = {
     'Cutout': cutout,
 }
 
+# Batched versions of NAME_TO_FUNC. Pixel-wise ops work on batches as is.
+BATCH_NAME_TO_FUNC = {
+    'AutoContrast': autocontrast_batch,
+    'Equalize': equalize_batch,
+    'Invert': invert,
+    'Rotate': wrapped_rotate_batch,
+    'Posterize': posterize,
+    'Solarize': solarize,
+    'SolarizeAdd': solarize_add,
+    'Color': color,
+    'Contrast': contrast_batch,
+    'Brightness': brightness,
+    'Sharpness': sharpness_batch,
+    'ShearX': shear_x_batch,
+    'ShearY': shear_y_batch,
+    'TranslateX': translate_x_batch,
+    'TranslateY': translate_y_batch,
+    'Cutout': cutout_batch,
+}
+
 # Functions that have a 'replace' parameter
 REPLACE_FUNCS = frozenset({
     'Rotate',
@@ -665,21 +917,37 @@ REPLACE_FUNCS = frozenset({
 })
 
 
-def level_to_arg(cutout_const: float, translate_const: float):
-    """Creates a dict mapping image operation names to their arguments."""
+def level_to_arg(cutout_const: float,
+                 translate_const: float,
+                 randomly_negate: bool = True):
+    """Creates a dict mapping image operation names to their arguments.
+
+    Args:
+      cutout_const: multiplier for applying cutout.
+      translate_const: multiplier for applying translation.
+      randomly_negate: whether to flip the sign of rotate, shear and translate
+        arguments with 50% chance. The batched ops take unsigned arguments and
+        draw the sign per image instead.
+
+    Returns:
+      A dict mapping op names to functions of `level`.
+    """
 
     no_arg = lambda level: ()
     posterize_arg = lambda level: _mult_to_arg(level, 4)
     solarize_arg = lambda level: _mult_to_arg(level, 256)
     solarize_add_arg = lambda level: _mult_to_arg(level, 110)
     cutout_arg = lambda level: _mult_to_arg(level, cutout_const)
-    translate_arg = lambda level: _translate_level_to_arg(level, translate_const)
+    rotate_arg = lambda level: _rotate_level_to_arg(level, randomly_negate)
+    shear_arg = lambda level: _shear_level_to_arg(level, randomly_negate)
+    translate_arg = lambda level: _translate_level_to_arg(
+        level, translate_const, randomly_negate)
 
     args = {
         'AutoContrast': no_arg,
         'Equalize': no_arg,
         'Invert': no_arg,
-        'Rotate': _rotate_level_to_arg,
+        'Rotate': rotate_arg,
         'Posterize': posterize_arg,
         'Solarize': solarize_arg,
         'SolarizeAdd': solarize_add_arg,
@@ -687,8 +955,8 @@ def level_to_arg(cutout_const: float, translate_const: float):
         'Contrast': _enhance_level_to_arg,
         'Brightness': _enhance_level_to_arg,
         'Sharpness': _enhance_level_to_arg,
-        'ShearX': _shear_level_to_arg,
-        'ShearY': _shear_level_to_arg,
+        'ShearX': shear_arg,
+        'ShearY': shear_arg,
         'Cutout': cutout_arg,
         'TranslateX': translate_arg,
         'TranslateY': translate_arg,
@@ -701,10 +969,20 @@ def _parse_policy_info(name: Text,
                        level: float,
                        replace_value: List[int],
                        cutout_const: float,
-                       translate_const: float) -> Tuple[Any, float, Any]:
-    """Return the function that corresponds to `name` and update `level` param."""
-    func = NAME_TO_FUNC[name]
-    args = level_to_arg(cutout_const, translate_const)[name](level)
+                       translate_const: float,
+                       batched: bool = False) -> Tuple[Any, float, Any]:
+    """Return the function that corresponds to `name` and update `level` param.
+
+    If `batched` is set, the returned function operates on a batch of images of
+    shape [N, height, width, 3].
+    """
+    if batched:
+        func = BATCH_NAME_TO_FUNC[name]
+    else:
+        func = NAME_TO_FUNC[name]
+    args = level_to_arg(cutout_const,
+                        translate_const,
+                        randomly_negate=not batched)[name](level)
 
     if name in REPLACE_FUNCS:
         # Add in replace arg if it is required for the function that is called.
@@ -727,6 +1005,22 @@ class ImageAugment(object):
         """
         raise NotImplementedError()
 
+    def distort_batch(self, images: tf.Tensor) -> tf.Tensor:
+        """Given a batch of images, returns distorted images with the same shape.
+
+        Every image is distorted independently with the same distribution as
+        `distort`. Subclasses override this to vectorize the distortion across
+        the batch.
+
+        Args:
+          images: `Tensor` of shape [N, height, width, 3] representing a batch
+            of images.
+
+        Returns:
+          The augmented version of `images`.
+        """
+        return tf.map_fn(self.distort, images)
+
 
 class AutoAugment(ImageAugment):
     """Applies the AutoAugment policy to images.
@@ -828,6 +1122,46 @@ class AutoAugment(ImageAugment):
         image = tf.cast(image, dtype=input_image_type)
         return image
 
+    def distort_batch(self, images: tf.Tensor) -> tf.Tensor:
+        """Applies the AutoAugment policy to each image in `images`.
+
+        A policy is sampled for every image. Each op of each policy is then run
+        once on the images that selected that policy and drew the op.
+
+        Args:
+          images: `Tensor` of shape [N, height, width, 3] representing a batch
+            of images.
+
+        Returns:
+          The augmented version of `images`.
+        """
+        input_image_type = images.dtype
+
+        if input_image_type != tf.uint8:
+            images = tf.clip_by_value(images, 0.0, 255.0)
+            images = tf.cast(images, dtype=tf.uint8)
+
+        replace_value = [128] * 3
+        batch_size = tf.shape(images)[0]
+
+        policy_to_select = tf.random.uniform(
+            [batch_size], maxval=len(self.policies), dtype=tf.int32)
+        for (i, policy) in enumerate(self.policies):
+            selected_policy = tf.equal(policy_to_select, i)
+            for policy_info in policy:
+                policy_info = list(policy_info) + [
+                    replace_value, self.cutout_const, self.translate_const
+                ]
+                func, prob, args = _parse_policy_info(*policy_info, batched=True)
+                if prob <= 0.0:
+                    continue
+                should_apply_op = tf.logical_and(
+                    selected_policy, tf.random.uniform([batch_size]) < prob)
+                images = _apply_to_selected(func, images, args, should_apply_op)
+
+        images = tf.cast(images, dtype=input_image_type)
+        return images
+
     @staticmethod
     def policy_v0():
         """Autoaugment policy that was used in AutoAugment Paper.
@@ -985,3 +1319,44 @@ class RandAugment(ImageAugment):
 
         image = tf.cast(image, dtype=input_image_type)
         return image
+
+    def distort_batch(self, images: tf.Tensor) -> tf.Tensor:
+        """Applies the RandAugment policy to each image in `images`.
+
+        For every layer an op is sampled per image, and each op is run once on
+        the images that selected it.
+
+        Args:
+          images: `Tensor` of shape [N, height, width, 3] representing a batch
+            of images.
+
+        Returns:
+          The augmented version of `images`.
+        """
+        input_image_type = images.dtype
+
+        if input_image_type != tf.uint8:
+            images = tf.clip_by_value(images, 0.0, 255.0)
+            images = tf.cast(images, dtype=tf.uint8)
+
+        replace_value = [128] * 3
+        batch_size = tf.shape(images)[0]
+
+        for _ in range(self.num_layers):
+            # As in `distort`, the extra index selects the identity op.
+            op_to_select = tf.random.uniform(
+                [batch_size], maxval=len(self.available_ops) + 1, dtype=tf.int32)
+
+            for (i, op_name) in enumerate(self.available_ops):
+                func, _, args = _parse_policy_info(op_name,
+                                                   1.0,
+                                                   self.magnitude,
+                                                   replace_value,
+                                                   self.cutout_const,
+                                                   self.translate_const,
+                                                   batched=True)
+                images = _apply_to_selected(func, images, args,
+                                            tf.equal(op_to_select, i))
+
+        images = tf.cast(images, dtype=input_image_type)
+        return images
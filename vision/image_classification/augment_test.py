@@ -132,5 +132,71 @@ class AutoaugmentTest(tf.test.TestCase):
 
     self.assertEqual((224, 224, 3), image.shape)
 
+  def test_autoaugment_batch(self):
+    """Smoke test for the batched AutoAugment policy."""
+    images = tf.zeros((4, 224, 224, 3), dtype=tf.uint8)
+
+    augmenter = augment.AutoAugment()
+    aug_images = augmenter.distort_batch(images)
+
+    self.assertEqual((4, 224, 224, 3), aug_images.shape)
+
+  def test_randaug_batch(self):
+    """Smoke test for the batched RandAugment policy."""
+    images = tf.zeros((4, 224, 224, 3), dtype=tf.float32)
+
+    augmenter = augment.RandAugment()
+    aug_images = augmenter.distort_batch(images)
+
+    self.assertEqual((4, 224, 224, 3), aug_images.shape)
+    self.assertEqual(tf.float32, aug_images.dtype)
+
+  def test_all_policy_ops_batch(self):
+    """Smoke test to be sure all batched augmentation functions can execute."""
+
+    prob = 1
+    magnitude = 10
+    replace_value = [128] * 3
+    cutout_const = 100
+    translate_const = 250
+
+    images = tf.ones((4, 224, 224, 3), dtype=tf.uint8)
+
+    for op_name in augment.BATCH_NAME_TO_FUNC:
+      func, _, args = augment._parse_policy_info(op_name,
+                                                 prob,
+                                                 magnitude,
+                                                 replace_value,
+                                                 cutout_const,
+                                                 translate_const,
+                                                 batched=True)
+      images = func(images, *args)
+
+    self.assertEqual((4, 224, 224, 3), images.shape)
+
+  def test_deterministic_batch_ops_match_single_image_ops(self):
+    """The batched ops give the same result as the ops on each image."""
+    images = tf.random.uniform((3, 16, 16, 3), maxval=256, dtype=tf.int32)
+    images = tf.cast(images, tf.uint8)
+
+    ops = [
+        (augment.autocontrast, augment.autocontrast_batch, ()),
+        (augment.equalize, augment.equalize_batch, ()),
+        (augment.contrast, augment.contrast_batch, (1.5,)),
+        (augment.sharpness, augment.sharpness_batch, (1.5,)),
+    ]
+    for single_op, batch_op, args in ops:
+      expected = tf.stack([single_op(image, *args) for image in images])
+      self.assertAllEqual(expected, batch_op(images, *args))
+
+  def test_apply_to_selected(self):
+    images = tf.zeros((4, 2, 2, 3), dtype=tf.uint8)
+    should_apply = tf.constant([True, False, True, False])
+
+    result = augment._apply_to_selected(augment.invert, images, (),
+                                        should_apply)
+
+    self.assertAllEqual([255, 0, 255, 0], result[:, 0, 0, 0])
+
 if __name__ == '__main__':
   tf.test.main()
@@ -5,14 +5,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
 import os
 from absl import logging
 
 import tensorflow as tf
-from typing import Any, List, MutableMapping
+from typing import Any, List, Mapping, MutableMapping, Optional
 
+from utils.misc import async_checkpoint as async_checkpoint_lib
 from utils.misc import keras_utils
 
+# Suffix of the file next to a checkpoint holding the input pipeline position.
+INPUT_STATE_SUFFIX = '.input_state.json'
+
 
 def get_callbacks(model_checkpoint: bool = True,
                   include_tensorboard: bool = True,
@@ -20,17 +25,28 @@ def get_callbacks(model_checkpoint: bool = True,
                   track_lr: bool = True,
                   write_model_weights: bool = True,
                   initial_step: int = 0,
+                  initial_examples: int = 0,
+                  checkpoint_steps: Optional[int] = None,
                   batch_size: int = 0,
                   log_steps: int = 0,
-                  model_dir: str = None) -> List[tf.keras.callbacks.Callback]:
+                  model_dir: str = None,
+                  async_checkpoint: bool = False
+                  ) -> List[tf.keras.callbacks.Callback]:
     """Get all callbacks."""
     model_dir = model_dir or ''
     callbacks = []
     if model_checkpoint:
         ckpt_full_path = os.path.join(model_dir, 'model.ckpt-{epoch:04d}')
         callbacks.append(
-            tf.keras.callbacks.ModelCheckpoint(
-                ckpt_full_path, save_weights_only=True, verbose=1))
+            InputStateModelCheckpoint(
+                ckpt_full_path,
+                batch_size=batch_size,
+                initial_step=initial_step,
+                initial_examples=initial_examples,
+                save_weights_only=True,
+                save_freq=checkpoint_steps or 'epoch',
+                async_checkpoint=async_checkpoint,
+                verbose=1))
     if include_tensorboard:
         callbacks.append(
             CustomTensorBoard(
@@ -47,6 +63,20 @@ def get_callbacks(model_checkpoint: bool = True,
     return callbacks
 
 
+def write_input_state(checkpoint: str, state: Mapping[str, int]):
+    """Writes the input pipeline position next to `checkpoint`."""
+    with tf.io.gfile.GFile(checkpoint + INPUT_STATE_SUFFIX, 'w') as f:
+        json.dump(state, f)
+
+
+def read_input_state(checkpoint: str) -> Optional[Mapping[str, int]]:
+    """Reads the input pipeline position saved next to `checkpoint`, if any."""
+    if not checkpoint or not tf.io.gfile.exists(checkpoint + INPUT_STATE_SUFFIX):
+        return None
+    with tf.io.gfile.GFile(checkpoint + INPUT_STATE_SUFFIX, 'r') as f:
+        return json.load(f)
+
+
 def get_scalar_from_tensor(t: tf.Tensor) -> int:
     """Utility function to convert a Tensor to a scalar."""
     t = tf.keras.backend.get_value(t)
@@ -134,3 +164,90 @@ class CustomTensorBoard(tf.keras.callbacks.TensorBoard):
             optimizer = optimizer._optimizer  # pylint:disable=protected-access
 
         return optimizer
+
+
+class InputStateModelCheckpoint(tf.keras.callbacks.ModelCheckpoint):
+    """A ModelCheckpoint that also saves the position of the input pipeline.
+
+    Next to every checkpoint, a JSON file records the training step and the
+    number of training examples read so far. The example count does not
+    depend on the batch size, so training can resume from the same position
+    of the input stream even if the number of replicas changes.
+
+    Attributes:
+      filepath: the path of the checkpoint files, see `ModelCheckpoint`.
+      batch_size: the global batch size.
+      initial_step: the step of the restored checkpoint.
+      initial_examples: the number of examples read at `initial_step`.
+      async_checkpoint: whether to snapshot the weights to host memory and
+        write them in a background thread. The checkpoint and its input state
+        are only recorded as the latest ones once written, and pending writes
+        are flushed at the end of training. Requires `save_weights_only`.
+      **kwargs: additional arguments for `ModelCheckpoint`.
+    """
+
+    def __init__(self,
+                 filepath: str,
+                 batch_size: int,
+                 initial_step: int = 0,
+                 initial_examples: int = 0,
+                 async_checkpoint: bool = False,
+                 **kwargs):
+        super(InputStateModelCheckpoint, self).__init__(filepath, **kwargs)
+        if async_checkpoint and (not self.save_weights_only or
+                                 self.save_best_only):
+            raise ValueError('async_checkpoint requires save_weights_only and '
+                             'not save_best_only.')
+        self._batch_size = batch_size
+        self._initial_step = initial_step
+        self._initial_examples = initial_examples
+        self._async_checkpoint = async_checkpoint
+        self._checkpoint_writer = None
+
+    def set_model(self, model: tf.keras.Model):
+        super(InputStateModelCheckpoint, self).set_model(model)
+        if self._async_checkpoint:
+            self._checkpoint_writer = async_checkpoint_lib.AsyncCheckpointWriter(
+                model)
+
+    def _input_state(self) -> Mapping[str, int]:
+        step = int(get_scalar_from_tensor(self.model.optimizer.iterations))
+        examples = (self._initial_examples +
+                    (step - self._initial_step) * self._batch_size)
+        return {'step': step, 'examples': examples}
+
+    def _save_model(self,
+                    epoch: int,
+                    logs: MutableMapping[str, Any]) -> None:
+        if self._checkpoint_writer is not None:
+            self._save_model_async(epoch, logs)
+            return
+        super(InputStateModelCheckpoint, self)._save_model(epoch, logs)
+        checkpoint = tf.train.latest_checkpoint(os.path.dirname(self.filepath))
+        if not checkpoint:
+            return
+        write_input_state(checkpoint, self._input_state())
+
+    def _save_model_async(self,
+                          epoch: int,
+                          logs: MutableMapping[str, Any]) -> None:
+        """Like `ModelCheckpoint._save_model` of the weights only."""
+        if (not isinstance(self.save_freq, int) and
+                self.epochs_since_last_save < self.period):
+            return
+        self.epochs_since_last_save = 0
+        filepath = self._get_file_path(epoch, logs or {})
+        if self.verbose > 0:
+            logging.info('Epoch %05d: saving model to %s', epoch + 1, filepath)
+        input_state = self._input_state()
+
+        def on_written(checkpoint):
+            write_input_state(checkpoint, input_state)
+            async_checkpoint_lib.record_checkpoint(checkpoint)
+
+        self._checkpoint_writer.write(filepath, on_written=on_written)
+
+    def on_train_end(self, logs: MutableMapping[str, Any] = None) -> None:
+        super(InputStateModelCheckpoint, self).on_train_end(logs)
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.flush()
@@ -0,0 +1,193 @@
+# Lint as: python3
+# ==============================================================================
+"""Custom training loop of an image classifier.
+
+`ClassifierRunnable` plugs a Keras classifier into the `Controller` of
+`staging.training`: each call of `train` runs `num_steps` training steps in a
+single `tf.function`, with a `tf.while_loop`, and the controller only logs,
+writes summaries, saves checkpoints and evaluates between those calls.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+from typing import Any, Callable, Dict, List, Optional, Text
+
+import tensorflow as tf
+
+from staging.training import standard_runnable
+from utils.misc import keras_utils
+
+
+class ClassifierRunnable(standard_runnable.StandardTrainable,
+                         standard_runnable.StandardEvaluable):
+    """Trains and evaluates a classifier in loops of several steps."""
+
+    def __init__(self,
+                 strategy: tf.distribute.Strategy,
+                 model: tf.keras.Model,
+                 optimizer: tf.keras.optimizers.Optimizer,
+                 loss_fn: tf.keras.losses.Loss,
+                 metric_fn: Callable[[], List[tf.keras.metrics.Metric]],
+                 train_dataset_fn: Callable[[int], tf.data.Dataset],
+                 global_batch_size: int,
+                 eval_dataset_fn: Optional[
+                     Callable[[], tf.data.Dataset]] = None,
+                 time_callback: Optional[keras_utils.TimeHistory] = None):
+        """Initializes the runnable, under the scope of `strategy`.
+
+        Args:
+          strategy: the distribution strategy.
+          model: a Keras model outputting class probabilities.
+          optimizer: the optimizer, possibly a `LossScaleOptimizer`. Its
+            `iterations` are the global step.
+          loss_fn: the classification loss, with no reduction.
+          metric_fn: returns new metrics of labels and probabilities, e.g. the
+            accuracy. Called once for training and once for evaluation.
+          train_dataset_fn: maps the global step to resume from to the (not
+            distributed) training dataset, of global batches.
+          global_batch_size: the global batch size of the training dataset.
+          eval_dataset_fn: returns the validation dataset, of global batches.
+          time_callback: a `TimeHistory` updated at each training loop, as
+            Keras `fit` would at each step.
+        """
+        standard_runnable.StandardTrainable.__init__(self,
+                                                     use_tf_while_loop=True)
+        standard_runnable.StandardEvaluable.__init__(self)
+        self.strategy = strategy
+        self.model = model
+        self.optimizer = optimizer
+        self.loss_fn = loss_fn
+        self.train_dataset_fn = train_dataset_fn
+        self.eval_dataset_fn = eval_dataset_fn
+        self.global_batch_size = global_batch_size
+        self.time_callback = time_callback
+        self.global_step = optimizer.iterations
+        # The training results of each loop, like a Keras `History`
+        self.history = {}
+        self.eval_outputs = None
+
+        self.train_loss = tf.keras.metrics.Mean('loss', dtype=tf.float32)
+        self.train_metrics = metric_fn()
+        self.test_loss = tf.keras.metrics.Mean('loss', dtype=tf.float32)
+        self.test_metrics = metric_fn()
+        self._initial_step = None
+
+    def build_train_dataset(self):
+        """See base class."""
+        return self.strategy.experimental_distribute_dataset(
+            self.train_dataset_fn(self._initial_step))
+
+    def build_eval_dataset(self):
+        """See base class."""
+        return self.strategy.experimental_distribute_dataset(
+            self.eval_dataset_fn())
+
+    def _compute_loss(self, labels, probabilities):
+        """The loss of a replica batch, and its share of the global loss."""
+        per_example_loss = self.loss_fn(labels, probabilities)
+        loss = tf.reduce_mean(per_example_loss)
+        replica_loss = tf.nn.compute_average_loss(
+            per_example_loss, global_batch_size=self.global_batch_size)
+        if self.model.losses:
+            regularization_loss = tf.add_n(self.model.losses)
+            loss += regularization_loss
+            replica_loss += tf.nn.scale_regularization_loss(
+                regularization_loss)
+        return loss, replica_loss
+
+    def train(self,
+              num_steps: Optional[tf.Tensor]
+              ) -> Optional[Dict[Text, tf.Tensor]]:
+        """See base class."""
+        if self._initial_step is None:
+            # The global step restored by the controller, if any
+            self._initial_step = int(self.global_step.numpy())
+            if self.time_callback is not None:
+                self.time_callback.on_epoch_begin(0)
+        if self.time_callback is not None:
+            self.time_callback.on_batch_begin(0)
+        outputs = super(ClassifierRunnable, self).train(num_steps)
+        for name, value in outputs.items():
+            self.history.setdefault(name, []).append(float(value.numpy()))
+        if self.time_callback is not None:
+            # The loop counts as one batch of all the steps it ran
+            self.time_callback.on_batch_end(
+                int(self.global_step.numpy()) - self._initial_step - 1)
+        return outputs
+
+    def train_loop_begin(self):
+        """See base class."""
+        self.train_loss.reset_states()
+        for metric in self.train_metrics:
+            metric.reset_states()
+
+    def train_step(self, iterator):
+        """See base class."""
+        optimizer = self.optimizer
+        scale_loss = isinstance(
+            optimizer, tf.keras.mixed_precision.experimental.LossScaleOptimizer)
+
+        def step_fn(inputs):
+            images, labels = inputs
+            with tf.GradientTape() as tape:
+                probabilities = self.model(images, training=True)
+                loss, replica_loss = self._compute_loss(labels, probabilities)
+                if scale_loss:
+                    replica_loss = optimizer.get_scaled_loss(replica_loss)
+            variables = self.model.trainable_variables
+            gradients = tape.gradient(replica_loss, variables)
+            if scale_loss:
+                gradients = optimizer.get_unscaled_gradients(gradients)
+            optimizer.apply_gradients(zip(gradients, variables))
+
+            self.train_loss.update_state(loss)
+            for metric in self.train_metrics:
+                metric.update_state(labels, probabilities)
+
+        self.strategy.run(step_fn, args=(next(iterator),))
+
+    def train_loop_end(self) -> Dict[Text, tf.Tensor]:
+        """See base class."""
+        return self._results(self.train_loss, self.train_metrics)
+
+    def eval_begin(self):
+        """See base class."""
+        self.test_loss.reset_states()
+        for metric in self.test_metrics:
+            metric.reset_states()
+
+    def eval_step(self, iterator):
+        """See base class."""
+
+        def step_fn(inputs):
+            images, labels = inputs
+            probabilities = self.model(images, training=False)
+            loss, _ = self._compute_loss(labels, probabilities)
+            self.test_loss.update_state(loss)
+            for metric in self.test_metrics:
+                metric.update_state(labels, probabilities)
+
+        self.strategy.run(step_fn, args=(next(iterator),))
+
+    def eval_end(self) -> Dict[Text, tf.Tensor]:
+        """See base class."""
+        self.eval_outputs = self._results(self.test_loss, self.test_metrics)
+        return self.eval_outputs
+
+    def end_training(self):
+        """Completes the time callback once the controller is done."""
+        if self.time_callback is not None:
+            if self._initial_step is not None:
+                self.time_callback.on_epoch_end(0)
+            self.time_callback.on_train_end()
+
+    @staticmethod
+    def _results(loss: tf.keras.metrics.Metric,
+                 metrics: List[tf.keras.metrics.Metric]
+                 ) -> Dict[Text, Any]:
+        results = {loss.name: loss.result()}
+        for metric in metrics:
+            results[metric.name] = metric.result()
+        return results
@@ -0,0 +1,89 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for classifier_runnable."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from staging.training import controller
+from utils.misc import keras_utils
+from vision.image_classification import classifier_runnable, test_utils
+
+
+def _dataset(batch_size: int) -> tf.data.Dataset:
+    images = tf.random.uniform((batch_size, 8, 8, 3))
+    labels = tf.random.uniform((batch_size, 1), maxval=4, dtype=tf.int32)
+    return tf.data.Dataset.from_tensors((images, labels)).repeat()
+
+
+class ClassifierRunnableTest(tf.test.TestCase):
+
+    def test_train_and_evaluate(self):
+        strategy = tf.distribute.get_strategy()
+        model = test_utils.small_classifier(num_classes=4,
+                                            image_size=8,
+                                            num_filters=4,
+                                            weight_decay=1e-4)
+        optimizer = tf.keras.optimizers.SGD(0.1)
+        time_callback = keras_utils.TimeHistory(batch_size=4, log_steps=2)
+        initial_steps = []
+
+        def train_dataset_fn(initial_step):
+            initial_steps.append(initial_step)
+            return _dataset(4)
+
+        runnable = classifier_runnable.ClassifierRunnable(
+            strategy,
+            model,
+            optimizer,
+            loss_fn=tf.keras.losses.SparseCategoricalCrossentropy(
+                reduction=tf.keras.losses.Reduction.NONE),
+            metric_fn=lambda: [tf.keras.metrics.SparseCategoricalAccuracy(
+                name='accuracy')],
+            train_dataset_fn=train_dataset_fn,
+            global_batch_size=4,
+            eval_dataset_fn=lambda: _dataset(4).take(2),
+            time_callback=time_callback)
+        model_dir = self.get_temp_dir()
+        checkpoint_manager = tf.train.CheckpointManager(
+            tf.train.Checkpoint(model=model, optimizer=optimizer),
+            directory=model_dir,
+            max_to_keep=None,
+            step_counter=optimizer.iterations,
+            checkpoint_interval=2)
+
+        controller.Controller(
+            strategy=strategy,
+            train_fn=runnable.train,
+            eval_fn=runnable.evaluate,
+            global_step=optimizer.iterations,
+            train_steps=6,
+            steps_per_loop=2,
+            summary_dir=os.path.join(model_dir, 'train'),
+            checkpoint_manager=checkpoint_manager,
+            summary_interval=2,
+            eval_steps=2,
+            eval_interval=4).train()
+        runnable.end_training()
+
+        self.assertEqual(6, int(optimizer.iterations))
+        self.assertEqual([0], initial_steps)
+        # One entry per loop of 2 steps
+        self.assertLen(runnable.history['loss'], 3)
+        self.assertLen(runnable.history['accuracy'], 3)
+        self.assertEqual(['loss', 'accuracy'], list(runnable.eval_outputs))
+        self.assertEqual(6, time_callback.global_steps)
+        self.assertLen(time_callback.timestamp_log, 4)
+        self.assertEqual(
+            6, int(tf.train.load_variable(
+                checkpoint_manager.latest_checkpoint,
+                'optimizer/iter/.ATTRIBUTES/VARIABLE_VALUE')))
+
+
+if __name__ == '__main__':
+    tf.test.main()
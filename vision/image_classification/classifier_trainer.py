@@ -7,22 +7,28 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import re
 
+import dataclasses
 import pprint
-from typing import Any, Tuple, Text, Optional, Mapping
+from typing import Any, Callable, List, Tuple, Text, Optional, Mapping
 
 from absl import app
 from absl import flags
 from absl import logging
+import numpy as np
 import tensorflow as tf
+import tensorflow_model_optimization as tfmot
 
 from modeling import performance
 from modeling.hyperparams import params_dict
+from staging.training import controller as training_controller
 from utils import hyperparams_flags
 from utils.logs import logger
+from utils.misc import async_checkpoint
 from utils.misc import distribution_utils
 from utils.misc import keras_utils
-from vision.image_classification import dataset_factory, callbacks as custom_callbacks, optimizer_factory
+from vision.image_classification import classifier_runnable, dataset_factory, callbacks as custom_callbacks, distillation, learning_rate as learning_rate_lib, optimizer_factory, prediction, preprocessing, pruning, quantization
 from vision.image_classification.configs import base_configs
 from vision.image_classification.configs import configs
 from benchmark.models import resnet_common
@@ -51,6 +57,201 @@ def get_models() -> Mapping[str, tf.keras.Model]:
     }
 
 
+def add_input_normalization(model: tf.keras.Model,
+                            mean_subtract: bool,
+                            standardize: bool) -> tf.keras.Model:
+    """Prepends a layer normalizing uint8 images to `model`.
+
+    Args:
+      model: a Keras model taking normalized float images.
+      mean_subtract: whether or not to apply mean subtraction.
+      standardize: whether or not to apply standardization.
+
+    Returns:
+      A Keras model taking uint8 images of the same shape as `model`.
+    """
+    inputs = tf.keras.layers.Input(batch_shape=model.input_shape,
+                                   dtype=tf.uint8)
+    x = preprocessing.NormalizeImages(mean_subtract=mean_subtract,
+                                      standardize=standardize,
+                                      name='normalize_images')(inputs)
+    outputs = model(x)
+    return tf.keras.Model(inputs, outputs, name=model.name)
+
+
+def allow_any_image_size(model: tf.keras.Model) -> tf.keras.Model:
+    """Rebuilds `model` to take images of any height and width.
+
+    Args:
+      model: a Keras functional model, whose weights do not depend on the size
+        of its input images, e.g. ending with a global pooling.
+
+    Returns:
+      A newly initialized copy of `model` with unknown spatial input dims.
+
+    Raises:
+      ValueError if `model` flattens its feature maps.
+    """
+    if any(isinstance(layer, tf.keras.layers.Flatten)
+           for layer in model.layers):
+        raise ValueError('Model {} flattens its feature maps, its weights '
+                         'depend on the image size.'.format(model.name))
+    batch_size, _, _, num_channels = model.input_shape
+    inputs = tf.keras.layers.Input(shape=(None, None, num_channels),
+                                   batch_size=batch_size)
+    return tf.keras.models.clone_model(model, input_tensors=inputs)
+
+
+def _uses_several_image_sizes(params: base_configs.ExperimentConfig) -> bool:
+    """Whether the model of `params` is run on images of different sizes."""
+    if params.train.progressive_resizing:
+        return True
+    validation_config = params.validation_dataset
+    return (validation_config is not None and
+            validation_config.image_size != params.train_dataset.image_size)
+
+
+def build_model(params: base_configs.ExperimentConfig,
+                quantize_aware: bool = False,
+                model_name: Optional[str] = None,
+                model_params: Optional[Mapping[str, Any]] = None
+                ) -> tf.keras.Model:
+    """Builds the model of `params` for the images of the train dataset.
+
+    Args:
+      params: the experiment config.
+      quantize_aware: whether to build the model with fake quantization, e.g.
+        to restore the checkpoints of quantization aware training.
+      model_name: the name of another model to build for the same images,
+        e.g. a distillation teacher. Defaults to `params.model.name`.
+      model_params: the parameters of `model_name`. Defaults to
+        `params.model.model_params`.
+
+    Returns:
+      The Keras model.
+    """
+    if model_name is None:
+        model_name = params.model.name
+        model_params = params.model.model_params.as_dict()
+    model = get_models()[model_name](**model_params)
+    if _uses_several_image_sizes(params):
+        model = allow_any_image_size(model)
+    dataset_config = params.train_dataset
+    if dataset_config.normalize_in_model:
+        model = add_input_normalization(
+            model,
+            mean_subtract=dataset_config.mean_subtract,
+            standardize=dataset_config.standardize)
+    if quantize_aware:
+        model = make_quantize_aware(params, model)
+    return model
+
+
+def make_quantize_aware(params: base_configs.ExperimentConfig,
+                        model: tf.keras.Model) -> tf.keras.Model:
+    """Returns a copy of `model` with fake quantization and the same weights.
+
+    The layers are wrapped with the default 8 bit scheme of the TensorFlow
+    Model Optimization toolkit, which simulates int8 inference in training.
+    The input normalization of `normalize_in_model` stays in float.
+    """
+    dtype = params.train_dataset.dtype
+    if dtype not in ('float32', 'fp32'):
+        raise ValueError('Quantization aware training requires float32, got '
+                         '{}.'.format(dtype))
+    dataset_config = params.train_dataset
+    if dataset_config.normalize_in_model:
+        quantized_model = tfmot.quantization.keras.quantize_model(
+            model.layers[-1])
+        return add_input_normalization(
+            quantized_model,
+            mean_subtract=dataset_config.mean_subtract,
+            standardize=dataset_config.standardize)
+    return tfmot.quantization.keras.quantize_model(model)
+
+
+def build_teacher(params: base_configs.ExperimentConfig) -> tf.keras.Model:
+    """Builds the frozen teacher of distillation and restores its weights."""
+    config = params.train.distillation
+    if config.teacher_checkpoint is None:
+        raise ValueError('Distillation requires a teacher_checkpoint.')
+    if tf.saved_model.contains_saved_model(config.teacher_checkpoint):
+        teacher = _load_saved_model(config.teacher_checkpoint)
+    else:
+        model_params = (config.teacher_model_params.as_dict()
+                        if config.teacher_model_params else
+                        {'num_classes': params.model.num_classes})
+        teacher = build_model(params,
+                              model_name=config.teacher_model,
+                              model_params=model_params)
+        teacher.load_weights(config.teacher_checkpoint)
+    teacher.trainable = False
+    return teacher
+
+
+def recalibrate_batch_norm(
+        model: tf.keras.Model,
+        dataset: tf.data.Dataset,
+        steps: int,
+        strategy: Optional[tf.distribute.Strategy] = None) -> int:
+    """Re-estimates the batch normalization statistics of `model`.
+
+    The moving mean and variance of every batch normalization layer are
+    replaced by their average over `steps` batches of `dataset`, computed in
+    training mode. The other weights are unchanged.
+
+    Args:
+      model: a Keras model, whose variables were created by `strategy`.
+      dataset: a dataset of batched images and labels.
+      steps: the number of batches to average the statistics over.
+      strategy: the distribution strategy of `model`, if any.
+
+    Returns:
+      The number of batches used, fewer than `steps` if `dataset` ends.
+    """
+    strategy = strategy or tf.distribute.get_strategy()
+    bn_layers = [layer for layer in model.submodules
+                 if isinstance(layer, tf.keras.layers.BatchNormalization)]
+    if not bn_layers:
+        logging.warning('Model %s has no batch normalization to recalibrate.',
+                        model.name)
+        return 0
+
+    @tf.function
+    def forward(images):
+        strategy.run(lambda x: model(x, training=True), args=(images,))
+
+    # With a momentum of 0, the moving statistics are those of the last batch
+    momentums = [layer.momentum for layer in bn_layers]
+    means = [0.] * len(bn_layers)
+    squares = [0.] * len(bn_layers)
+    num_batches = 0
+    try:
+        for layer in bn_layers:
+            layer.momentum = 0.
+        batches = strategy.experimental_distribute_dataset(dataset.take(steps))
+        for images, _ in batches:
+            forward(images)
+            num_batches += 1
+            for i, layer in enumerate(bn_layers):
+                mean = layer.moving_mean.numpy()
+                means[i] += mean
+                squares[i] += layer.moving_variance.numpy() + np.square(mean)
+    finally:
+        for layer, momentum in zip(bn_layers, momentums):
+            layer.momentum = momentum
+
+    if num_batches:
+        for layer, total, total_squares in zip(bn_layers, means, squares):
+            mean = total / num_batches
+            layer.moving_mean.assign(mean)
+            layer.moving_variance.assign(
+                total_squares / num_batches - np.square(mean))
+    logging.info('Recalibrated %d batch normalization layers on %d batches.',
+                 len(bn_layers), num_batches)
+    return num_batches
+
+
 def get_dtype_map() -> Mapping[str, tf.dtypes.DType]:
     """Returns the mapping from dtype string representations to TF dtypes."""
     return {
@@ -86,6 +287,18 @@ def _get_metrics(one_hot: bool) -> Mapping[Text, Any]:
         }
 
 
+def _get_loss(params: base_configs.ExperimentConfig,
+              one_hot: bool,
+              reduction: str = tf.keras.losses.Reduction.AUTO
+              ) -> tf.keras.losses.Loss:
+    """Returns the classification loss of `params`."""
+    if one_hot:
+        return tf.keras.losses.CategoricalCrossentropy(
+            label_smoothing=params.model.loss.label_smoothing,
+            reduction=reduction)
+    return tf.keras.losses.SparseCategoricalCrossentropy(reduction=reduction)
+
+
 def get_image_size_from_model(
         params: base_configs.ExperimentConfig) -> Optional[int]:
     """If the given model has a preferred image size, return it."""
@@ -107,18 +320,32 @@ def _get_dataset_builders(params: base_configs.ExperimentConfig,
 
     image_size = get_image_size_from_model(params)
 
+    train_overrides = {}
+    distillation_config = params.train.distillation
+    if distillation_config and distillation_config.cache_dir:
+        # The teacher logits are cached for fixed crops of the train images
+        train_overrides['fixed_crops'] = distillation_config.num_cached_crops
+
+    if (params.validation_dataset is not None and
+            params.validation_dataset.has_data and
+            params.validation_dataset.normalize_in_model !=
+            params.train_dataset.normalize_in_model):
+        raise ValueError('The train and validation datasets must agree on '
+                         'normalize_in_model.')
+
     dataset_configs = [
         params.train_dataset, params.validation_dataset
     ]
     builders = []
 
-    for config in dataset_configs:
+    for config, overrides in zip(dataset_configs, [train_overrides, {}]):
         if config is not None and config.has_data:
             builder = dataset_factory.DatasetBuilder(
                 config,
                 image_size=image_size or config.image_size,
                 num_devices=num_devices,
-                one_hot=one_hot)
+                one_hot=one_hot,
+                **overrides)
         else:
             builder = None
         builders.append(builder)
@@ -126,6 +353,201 @@ def _get_dataset_builders(params: base_configs.ExperimentConfig,
     return builders
 
 
+def _get_recalibration_builder(
+        params: base_configs.ExperimentConfig,
+        validation_builder: Optional[dataset_factory.DatasetBuilder]
+) -> dataset_factory.DatasetBuilder:
+    """Returns the builder of the batch norm recalibration images.
+
+    The images of `params.evaluation.bn_recalibration_split` are preprocessed
+    like the validation images, but are never written to the evaluation cache.
+    """
+    if validation_builder is None:
+        raise ValueError('bn_recalibration_steps requires a validation dataset '
+                         'with data, whose preprocessing is used for the '
+                         'recalibration images.')
+    return dataset_factory.DatasetBuilder(
+        validation_builder.config,
+        split=params.evaluation.bn_recalibration_split,
+        is_training=False,
+        eval_cache_dir=None)
+
+
+@dataclasses.dataclass
+class _TrainPhase:
+    """A range of training epochs with the same input and model."""
+    builder: dataset_factory.DatasetBuilder
+    start_epoch: int
+    end_epoch: int
+    steps_per_epoch: int
+    start_step: int
+    start_examples: int
+    quantize_aware: bool = False
+
+    @property
+    def end_step(self) -> int:
+        return (self.start_step +
+                (self.end_epoch - self.start_epoch) * self.steps_per_epoch)
+
+    @property
+    def end_examples(self) -> int:
+        return (self.start_examples + (self.end_step - self.start_step) *
+                self.builder.global_batch_size)
+
+
+def _get_train_phases(params: base_configs.ExperimentConfig,
+                      train_builder: dataset_factory.DatasetBuilder,
+                      train_steps: int) -> List[_TrainPhase]:
+    """Splits training into the phases of `params.train.progressive_resizing`.
+
+    Without progressive resizing, training is a single phase of
+    `train_builder`. The number of steps per epoch of a phase is `train_steps`
+    scaled by the ratio of the batch sizes, so that an epoch reads about the
+    same number of examples in every phase. A phase is split where the
+    quantization aware training of `params.model.quantize_aware` starts.
+    """
+    train_epochs = params.train.epochs
+    schedule = params.train.progressive_resizing or []
+    epochs = [phase.epoch for phase in schedule]
+    if any(start >= end for start, end in zip(epochs, epochs[1:])):
+        raise ValueError('The progressive resizing phases must have '
+                         'increasing epochs, got {}.'.format(epochs))
+    if epochs and (epochs[0] < 0 or epochs[-1] >= train_epochs):
+        raise ValueError('The progressive resizing phases must start within '
+                         'the {} train epochs, got {}.'.format(train_epochs,
+                                                              epochs))
+
+    builders = []
+    if not epochs or epochs[0] > 0:
+        builders.append(train_builder)
+    for phase in schedule:
+        image_size = phase.image_size or train_builder.image_size
+        batch_size = phase.batch_size or max(1, int(
+            train_builder.config.batch_size *
+            (train_builder.image_size / image_size) ** 2))
+        builders.append(dataset_factory.DatasetBuilder(
+            train_builder.config,
+            image_size=image_size,
+            batch_size=batch_size))
+    if len(builders) > len(schedule):
+        epochs = [0] + epochs
+
+    if params.model.quantize_aware < 0:
+        raise ValueError('quantize_aware must be a number of epochs, got '
+                         '{}.'.format(params.model.quantize_aware))
+    quantize_epoch = train_epochs
+    if params.model.quantize_aware:
+        quantize_epoch = max(0, train_epochs - params.model.quantize_aware)
+        if quantize_epoch not in epochs:
+            # Split the phase running the first quantization aware epoch
+            index = len([epoch for epoch in epochs if epoch < quantize_epoch])
+            epochs.insert(index, quantize_epoch)
+            builders.insert(index, builders[index - 1])
+
+    phases = []
+    start_step, start_examples = 0, 0
+    for builder, start_epoch, end_epoch in zip(builders, epochs,
+                                               epochs[1:] + [train_epochs]):
+        steps_per_epoch = max(1, train_steps *
+                              train_builder.global_batch_size //
+                              builder.global_batch_size)
+        phase = _TrainPhase(builder=builder,
+                            start_epoch=start_epoch,
+                            end_epoch=end_epoch,
+                            steps_per_epoch=steps_per_epoch,
+                            start_step=start_step,
+                            start_examples=start_examples,
+                            quantize_aware=start_epoch >= quantize_epoch)
+        phases.append(phase)
+        start_step, start_examples = phase.end_step, phase.end_examples
+    return phases
+
+
+def _find_phase(phases: List[_TrainPhase], step: int) -> _TrainPhase:
+    """Returns the train phase running `step`."""
+    return [phase for phase in phases if phase.start_step <= step][-1]
+
+
+def _fit_phase(model: tf.keras.Model,
+               phase: _TrainPhase,
+               initial_step: int,
+               initial_examples: int,
+               build_dataset: Callable[[dataset_factory.DatasetBuilder, int],
+                                       tf.data.Dataset],
+               **fit_kwargs: Any) -> tf.keras.callbacks.History:
+    """Trains `model` from `initial_step` to the end of `phase`.
+
+    When resuming in the middle of an epoch, the rest of that epoch is trained
+    first. The indexed record reader then restarts right after the examples
+    read by it, so the next epochs line up with the steps of the phase.
+
+    Args:
+      model: the compiled model, at `initial_step`.
+      phase: the phase running `initial_step`.
+      initial_step: the step training starts from.
+      initial_examples: the number of examples read at `initial_step`.
+      build_dataset: returns the train dataset of a builder, starting after a
+        number of examples.
+      **fit_kwargs: additional arguments of `model.fit`.
+
+    Returns:
+      The history of the last `fit` that trained an epoch.
+    """
+    builder = phase.builder
+    train_dataset = build_dataset(builder, initial_examples)
+    initial_epoch, steps_in_epoch = divmod(initial_step - phase.start_step,
+                                           phase.steps_per_epoch)
+    initial_epoch += phase.start_epoch
+    history = None
+    if steps_in_epoch > 0:
+        # Finish the interrupted epoch, then continue with a new dataset
+        # that starts right after the examples read by it.
+        logging.info('Resuming epoch %d at step %d.', initial_epoch,
+                     steps_in_epoch)
+        remaining_steps = phase.steps_per_epoch - steps_in_epoch
+        history = model.fit(
+            train_dataset,
+            epochs=initial_epoch + 1,
+            steps_per_epoch=remaining_steps,
+            initial_epoch=initial_epoch,
+            **fit_kwargs)
+        initial_epoch += 1
+        if builder.config.use_record_index:
+            initial_examples += remaining_steps * builder.global_batch_size
+            train_dataset = build_dataset(builder, initial_examples)
+
+    phase_history = model.fit(
+        train_dataset,
+        epochs=phase.end_epoch,
+        steps_per_epoch=phase.steps_per_epoch,
+        initial_epoch=initial_epoch,
+        **fit_kwargs)
+    if history is None or phase_history.history:
+        history = phase_history
+    return history
+
+
+def _get_checkpoint_step(checkpoint: str) -> int:
+    """Returns the optimizer step saved in a `model.save_weights` checkpoint."""
+    for name, _ in tf.train.list_variables(checkpoint):
+        if re.match(r'optimizer/(.*/)?iter/\.ATTRIBUTES/VARIABLE_VALUE$', name):
+            return int(tf.train.load_variable(checkpoint, name))
+    return 0
+
+
+def restore_weights(model: tf.keras.Model, checkpoint: str):
+    """Restores the weights of `model` from a checkpoint of either loop.
+
+    `model.save_weights` checkpoints have the model as root, while those of
+    the custom training loop hold it as `model`, next to the optimizer.
+    """
+    if any(name.startswith('model/')
+           for name, _ in tf.train.list_variables(checkpoint)):
+        tf.train.Checkpoint(model=model).restore(checkpoint).expect_partial()
+    else:
+        model.load_weights(checkpoint)
+
+
 def get_loss_scale(params: base_configs.ExperimentConfig,
                    fp16_default: float = 128.) -> float:
     """Returns the loss scale for initializations."""
@@ -223,6 +645,34 @@ def resume_from_checkpoint(model: tf.keras.Model,
     return int(initial_epoch)
 
 
+def _get_initial_examples(params: base_configs.ExperimentConfig,
+                          phases: List[_TrainPhase],
+                          initial_step: int) -> int:
+    """Returns the number of training examples read by the restored checkpoint.
+
+    Only the indexed record reader can start from an offset. Other input
+    pipelines start a fresh stream when resuming.
+    """
+    if not initial_step or not params.train_dataset.use_record_index:
+        return 0
+
+    latest_checkpoint = tf.train.latest_checkpoint(params.model_dir)
+    input_state = custom_callbacks.read_input_state(latest_checkpoint)
+    if input_state is None or input_state['step'] != initial_step:
+        # Assume the global batch sizes did not change.
+        phase = _find_phase(phases, initial_step)
+        examples = (phase.start_examples +
+                    (initial_step - phase.start_step) *
+                    phase.builder.global_batch_size)
+        logging.warning('No input state saved for checkpoint %s, assuming %d '
+                        'examples were read.', latest_checkpoint, examples)
+        return examples
+
+    logging.info('Resuming the input pipeline after %d examples.',
+                 input_state['examples'])
+    return int(input_state['examples'])
+
+
 def initialize(params: base_configs.ExperimentConfig,
                dataset_builder: dataset_factory.DatasetBuilder):
     """Initializes backend related initializations."""
@@ -260,7 +710,8 @@ def define_classifier_flags():
     flags.DEFINE_string(
         'mode',
         default=None,
-        help='Mode to run: `train`, `eval`, `train_and_eval` or `export`.')
+        help='Mode to run: `train_and_eval`, `export_only`, `predict` or '
+        '`prune`.')
     flags.DEFINE_bool(
         'run_eagerly',
         default=None,
@@ -310,27 +761,80 @@ def train_and_eval(
     one_hot = label_smoothing and label_smoothing > 0
 
     builders = _get_dataset_builders(params, strategy, one_hot)
-    datasets = [builder.build() if builder else None for builder in builders]
 
-    # Unpack datasets and builders based on train/val/test splits
+    # Unpack builders based on train/val/test splits
     train_builder, validation_builder = builders  # pylint: disable=unbalanced-tuple-unpacking
-    train_dataset, validation_dataset = datasets
+    # The train dataset is built once the input position is restored
+    validation_dataset = (validation_builder.build()
+                          if validation_builder else None)
+    recalibration_builder = None
+    if params.evaluation.bn_recalibration_steps:
+        # Built before training, so that a missing validation set fails early
+        recalibration_builder = _get_recalibration_builder(params,
+                                                           validation_builder)
 
-    train_epochs = params.train.epochs
     train_steps = params.train.steps or train_builder.num_steps
     validation_steps = params.evaluation.steps or validation_builder.num_steps
+    phases = _get_train_phases(params, train_builder, train_steps)
 
     initialize(params, train_builder)
 
     logging.info('Global batch size: %d', train_builder.global_batch_size)
 
+    distillation_config = params.train.distillation
+    if train_builder.use_fixed_crops and not (
+            distillation_config and distillation_config.cache_dir):
+        raise ValueError('fixed_crops requires a distillation cache_dir.')
+
     with strategy_scope:
-        model_params = params.model.model_params.as_dict()
-        model = get_models()[params.model.name](**model_params)
+        teacher_fn = None
+        teacher_cache = None
+        if distillation_config:
+            teacher = build_teacher(params)
+
+            def teacher_fn(images):
+                return distillation.log_probabilities(
+                    teacher(images, training=False))
+
+            if distillation_config.cache_dir:
+                teacher_cache = distillation.TeacherCache(
+                    distillation_config.cache_dir,
+                    num_records=train_builder.num_examples,
+                    num_classes=train_builder.num_classes,
+                    num_crops=distillation_config.num_cached_crops,
+                    description={
+                        'teacher_model': distillation_config.teacher_model,
+                        'teacher_checkpoint':
+                            distillation_config.teacher_checkpoint,
+                        'image_size': train_builder.image_size,
+                    })
+                teacher_cache.fill(teacher_fn, train_builder)
+
+        def distill(model):
+            if distillation_config is None:
+                return model
+            return distillation.DistillationModel(
+                model,
+                teacher_fn=teacher_fn,
+                temperature=distillation_config.temperature,
+                alpha=distillation_config.alpha)
+
+        model = distill(build_model(params))
         learning_rate = optimizer_factory.build_learning_rate(
             params=params.model.learning_rate,
             batch_size=train_builder.global_batch_size,
             train_steps=train_steps)
+        if params.train.progressive_resizing:
+            learning_rate = learning_rate_lib.PhasedBatchSizeSchedule(
+                learning_rate,
+                steps_per_epoch=train_steps,
+                phase_epochs=[phase.start_epoch for phase in phases],
+                phase_steps=[phase.start_step for phase in phases],
+                phase_steps_per_epoch=[phase.steps_per_epoch
+                                       for phase in phases],
+                phase_multipliers=[phase.builder.global_batch_size /
+                                   train_builder.global_batch_size
+                                   for phase in phases])
         optimizer = optimizer_factory.build_optimizer(
             optimizer_name=params.model.optimizer.name,
             base_learning_rate=learning_rate,
@@ -343,33 +847,37 @@ def train_and_eval(
         metrics_map = _get_metrics(one_hot)
         metrics = [metrics_map[metric] for metric in params.train.metrics]
 
-        if one_hot:
-            loss_obj = tf.keras.losses.CategoricalCrossentropy(
-                label_smoothing=params.model.loss.label_smoothing)
-        else:
-            loss_obj = tf.keras.losses.SparseCategoricalCrossentropy()
+        loss_obj = _get_loss(params, one_hot)
         model.compile(optimizer=optimizer,
                       loss=loss_obj,
                       metrics=metrics)
 
-        initial_epoch = 0
+        def quantize(model):
+            # The optimizer keeps its step, the learning rate schedule goes on
+            quantized_model = distill(make_quantize_aware(params, model))
+            quantized_model.compile(optimizer=optimizer,
+                                    loss=loss_obj,
+                                    metrics=metrics)
+            return quantized_model
+
+        quantized = False
+        initial_step = 0
+        initial_examples = 0
         if params.train.resume_checkpoint:
-            initial_epoch = resume_from_checkpoint(model=model,
-                                                   model_dir=params.model_dir,
-                                                   train_steps=train_steps)
+            latest_checkpoint = tf.train.latest_checkpoint(params.model_dir)
+            if latest_checkpoint and _find_phase(
+                    phases,
+                    _get_checkpoint_step(latest_checkpoint)).quantize_aware:
+                model = quantize(model)
+                quantized = True
+            resume_from_checkpoint(model=model,
+                                   model_dir=params.model_dir,
+                                   train_steps=train_steps)
+            initial_step = int(model.optimizer.iterations.numpy())
+            initial_examples = _get_initial_examples(params, phases,
+                                                     initial_step)
 
     serialize_config(params=params, model_dir=params.model_dir)
-    # TODO(dankondratyuk): callbacks significantly slow down training
-    callbacks = custom_callbacks.get_callbacks(
-        model_checkpoint=params.train.callbacks.enable_checkpoint_and_export,
-        include_tensorboard=params.train.callbacks.enable_tensorboard,
-        time_history=params.train.callbacks.enable_time_history,
-        track_lr=params.train.tensorboard.track_lr,
-        write_model_weights=params.train.tensorboard.write_model_weights,
-        initial_step=initial_epoch * train_steps,
-        batch_size=train_builder.global_batch_size,
-        log_steps=params.train.time_history.log_steps,
-        model_dir=params.model_dir)
 
     if params.evaluation.skip_eval:
         validation_kwargs = {}
@@ -382,13 +890,65 @@ def train_and_eval(
 
     model.summary()
 
-    history = model.fit(
-        train_dataset,
-        epochs=train_epochs,
-        steps_per_epoch=train_steps,
-        initial_epoch=initial_epoch,
-        callbacks=callbacks,
-        **validation_kwargs)
+    def build_train_dataset(builder, start_offset):
+        dataset = builder.build(start_offset=start_offset)
+        if teacher_cache is not None:
+            dataset = teacher_cache.attach(dataset)
+        return dataset
+
+    history = None
+    callbacks = []
+    for phase in phases:
+        if initial_step >= phase.end_step:
+            continue
+        if phase.quantize_aware and not quantized:
+            logging.info('Training with fake quantization from epoch %d.',
+                         phase.start_epoch)
+            with strategy_scope:
+                model = quantize(model)
+            quantized = True
+        builder = phase.builder
+        if len(phases) > 1:
+            logging.info('Training epochs %d to %d with image size %d and '
+                         'global batch size %d.', phase.start_epoch,
+                         phase.end_epoch, builder.image_size,
+                         builder.global_batch_size)
+
+        # TODO(dankondratyuk): callbacks significantly slow down training
+        callbacks = custom_callbacks.get_callbacks(
+            model_checkpoint=(
+                params.train.callbacks.enable_checkpoint_and_export),
+            include_tensorboard=params.train.callbacks.enable_tensorboard,
+            time_history=params.train.callbacks.enable_time_history,
+            track_lr=params.train.tensorboard.track_lr,
+            write_model_weights=params.train.tensorboard.write_model_weights,
+            initial_step=initial_step,
+            initial_examples=initial_examples,
+            checkpoint_steps=params.train.checkpoint_steps,
+            batch_size=builder.global_batch_size,
+            log_steps=params.train.time_history.log_steps,
+            model_dir=params.model_dir,
+            async_checkpoint=params.train.callbacks.async_checkpoint)
+
+        phase_history = _fit_phase(model, phase, initial_step,
+                                   initial_examples, build_train_dataset,
+                                   callbacks=callbacks, **validation_kwargs)
+        if history is None or phase_history.history:
+            history = phase_history
+
+        initial_step = phase.end_step
+        if builder.config.use_record_index:
+            initial_examples = phase.end_examples
+
+    if recalibration_builder is not None:
+        with strategy_scope:
+            recalibrate_batch_norm(
+                model,
+                recalibration_builder.build(),
+                steps=params.evaluation.bn_recalibration_steps,
+                strategy=strategy)
+        model.save_weights(
+            os.path.join(params.model_dir, 'recalibrated', 'model.ckpt'))
 
     validation_output = None
     if not params.evaluation.skip_eval:
@@ -402,20 +962,363 @@ def train_and_eval(
     return stats
 
 
-def export(params: base_configs.ExperimentConfig):
-    """Runs the model export functionality."""
+def train_and_eval_ctl(
+        params: base_configs.ExperimentConfig,
+        strategy_override: tf.distribute.Strategy) -> Mapping[str, Any]:
+    """Runs the train and eval path using a custom training loop.
+
+    Each `tf.function` call runs `params.runtime.steps_per_loop` training steps
+    in a `tf.while_loop`. Logging, TensorBoard summaries, checkpoints and
+    evaluation only happen between calls, so their intervals are rounded up to
+    a multiple of the loop steps. Checkpoints of the model and optimizer are
+    written by a `tf.train.CheckpointManager` every
+    `params.train.checkpoint_steps`, or every epoch, and training always
+    resumes from the latest one of `params.model_dir`.
+
+    Progressive resizing, quantization aware training, distillation and batch
+    normalization recalibration are only supported by `train_and_eval`.
+
+    Returns:
+      The same stats as `train_and_eval`.
+    """
+    logging.info('Running train and eval with a custom training loop.')
+    if (params.train.progressive_resizing or params.model.quantize_aware or
+            params.train.distillation or
+            params.evaluation.bn_recalibration_steps):
+        raise ValueError('The custom training loop does not support '
+                         'progressive resizing, quantization aware training, '
+                         'distillation or batch norm recalibration.')
+
+    strategy = strategy_override or distribution_utils.get_distribution_strategy(
+        distribution_strategy=params.runtime.distribution_strategy,
+        all_reduce_alg=params.runtime.all_reduce_alg,
+        num_gpus=params.runtime.num_gpus,
+        tpu_address=params.runtime.tpu)
+    strategy_scope = distribution_utils.get_strategy_scope(strategy)
+
+    logging.info('Detected %d devices.',
+                 strategy.num_replicas_in_sync if strategy else 1)
+
+    label_smoothing = params.model.loss.label_smoothing
+    one_hot = label_smoothing and label_smoothing > 0
+
+    builders = _get_dataset_builders(params, strategy, one_hot)
+    train_builder, validation_builder = builders  # pylint: disable=unbalanced-tuple-unpacking
+
+    train_steps = params.train.steps or train_builder.num_steps
+    validation_steps = params.evaluation.steps or validation_builder.num_steps
+    steps_per_loop = params.runtime.steps_per_loop or train_steps
+    global_batch_size = train_builder.global_batch_size
+
+    initialize(params, train_builder)
+
+    logging.info('Global batch size: %d', global_batch_size)
+
+    def train_dataset_fn(initial_step):
+        initial_examples = 0
+        if train_builder.config.use_record_index:
+            initial_examples = initial_step * global_batch_size
+        return train_builder.build(start_offset=initial_examples)
+
+    time_callback = None
+    if params.train.callbacks.enable_time_history:
+        time_callback = keras_utils.TimeHistory(
+            global_batch_size,
+            params.train.time_history.log_steps,
+            logdir=(params.model_dir
+                    if params.train.callbacks.enable_tensorboard else None))
+
+    with strategy_scope:
+        model = build_model(params)
+        learning_rate = optimizer_factory.build_learning_rate(
+            params=params.model.learning_rate,
+            batch_size=global_batch_size,
+            train_steps=train_steps)
+        optimizer = optimizer_factory.build_optimizer(
+            optimizer_name=params.model.optimizer.name,
+            base_learning_rate=learning_rate,
+            params=params.model.optimizer.as_dict())
+        optimizer = performance.configure_optimizer(
+            optimizer,
+            use_float16=train_builder.dtype == 'float16',
+            loss_scale=get_loss_scale(params))
+
+        def metric_fn():
+            return [_get_metrics(one_hot)[metric]
+                    for metric in params.train.metrics]
+
+        runnable = classifier_runnable.ClassifierRunnable(
+            strategy,
+            model,
+            optimizer,
+            loss_fn=_get_loss(params, one_hot,
+                              reduction=tf.keras.losses.Reduction.NONE),
+            metric_fn=metric_fn,
+            train_dataset_fn=train_dataset_fn,
+            global_batch_size=global_batch_size,
+            eval_dataset_fn=(validation_builder.build
+                             if validation_builder else None),
+            time_callback=time_callback)
+
+        checkpoint_interval = None
+        if params.train.callbacks.enable_checkpoint_and_export:
+            checkpoint_interval = params.train.checkpoint_steps or train_steps
+        checkpoint_manager_cls = tf.train.CheckpointManager
+        if params.train.callbacks.async_checkpoint:
+            checkpoint_manager_cls = async_checkpoint.AsyncCheckpointManager
+        checkpoint_manager = checkpoint_manager_cls(
+            tf.train.Checkpoint(model=model, optimizer=optimizer),
+            directory=params.model_dir,
+            max_to_keep=None,
+            step_counter=optimizer.iterations,
+            checkpoint_interval=checkpoint_interval)
+        if (not params.train.resume_checkpoint and
+                checkpoint_manager.latest_checkpoint):
+            logging.warning('The custom training loop always resumes from '
+                            'the latest checkpoint, %s.',
+                            checkpoint_manager.latest_checkpoint)
+
+    serialize_config(params=params, model_dir=params.model_dir)
+    model.summary()
+
+    evaluate = not params.evaluation.skip_eval
+    controller = training_controller.Controller(
+        strategy=strategy,
+        train_fn=runnable.train,
+        eval_fn=runnable.evaluate if evaluate else None,
+        global_step=optimizer.iterations,
+        train_steps=params.train.epochs * train_steps,
+        steps_per_loop=steps_per_loop,
+        summary_dir=os.path.join(params.model_dir, 'train'),
+        checkpoint_manager=checkpoint_manager,
+        summary_interval=(steps_per_loop
+                          if params.train.callbacks.enable_tensorboard
+                          else None),
+        eval_summary_dir=os.path.join(params.model_dir, 'validation'),
+        eval_steps=validation_steps,
+        eval_interval=params.evaluation.epochs_between_evals * train_steps)
+    controller.train(evaluate=evaluate)
+    runnable.end_training()
+
+    history = tf.keras.callbacks.History()
+    history.history = runnable.history
+    validation_output = None
+    if runnable.eval_outputs is not None:
+        # The loss then the metrics, like `model.evaluate`
+        validation_output = [value.numpy()
+                             for value in runnable.eval_outputs.values()]
+    callbacks = [time_callback] if time_callback else []
+    return resnet_common.build_stats(history, validation_output, callbacks)
+
+
+def export(params: base_configs.ExperimentConfig
+           ) -> Optional[Mapping[str, Any]]:
+    """Runs the model export functionality.
+
+    Returns:
+      The comparison of the quantized and float models if
+      `params.export.quantization` is set, None otherwise.
+    """
     logging.info('Exporting model.')
-    model_params = params.model.model_params.as_dict()
-    model = get_models()[params.model.name](**model_params)
+    model = build_model(params,
+                        quantize_aware=bool(params.model.quantize_aware))
     checkpoint = params.export.checkpoint
     if checkpoint is None:
         logging.info('No export checkpoint was provided. Using the latest '
                      'checkpoint from model_dir.')
         checkpoint = tf.train.latest_checkpoint(params.model_dir)
 
-    model.load_weights(checkpoint)
+    restore_weights(model, checkpoint)
     model.save(params.export.destination)
 
+    if params.export.quantization is None:
+        return None
+    validation_builder = dataset_factory.DatasetBuilder(
+        params.validation_dataset)
+    return quantization.quantize_and_compare(
+        model,
+        mode=params.export.quantization,
+        destination=params.export.destination.rstrip('/') + '.tflite',
+        dataset=validation_builder.build(),
+        calibration_steps=params.export.calibration_steps,
+        eval_steps=params.export.quantization_eval_steps,
+        image_size=validation_builder.image_size)
+
+
+def _load_saved_model(model_path: str) -> tf.keras.Model:
+    """Loads a SavedModel written by `export` or `prune`."""
+    logging.info('Loading the SavedModel %s.', model_path)
+    with tfmot.quantization.keras.quantize_scope():
+        return tf.keras.models.load_model(
+            model_path,
+            custom_objects={'NormalizeImages': preprocessing.NormalizeImages},
+            compile=False)
+
+
+def load_model(params: base_configs.ExperimentConfig,
+               model_path: Optional[str] = None) -> tf.keras.Model:
+    """Loads a SavedModel, or builds the model and restores a checkpoint.
+
+    Args:
+      params: the experiment config.
+      model_path: a SavedModel directory or a checkpoint. Defaults to the
+        latest checkpoint of `params.model_dir`.
+
+    Returns:
+      The Keras model.
+    """
+    if model_path is None:
+        model_path = tf.train.latest_checkpoint(params.model_dir)
+        if model_path is None:
+            raise ValueError('No checkpoint found in {}.'.format(
+                params.model_dir))
+    if tf.saved_model.contains_saved_model(model_path):
+        return _load_saved_model(model_path)
+    logging.info('Restoring the checkpoint %s.', model_path)
+    model = build_model(params,
+                        quantize_aware=bool(params.model.quantize_aware))
+    restore_weights(model, model_path)
+    return model
+
+
+def predict(params: base_configs.ExperimentConfig) -> Mapping[str, Any]:
+    """Runs batched prediction on the images of `params.predict`.
+
+    The images are preprocessed like the validation dataset.
+    """
+    logging.info('Running prediction.')
+    config = params.predict
+    model = load_model(params, config.model_path)
+    builder = dataset_factory.DatasetBuilder(params.validation_dataset,
+                                             one_hot=False)
+    dataset = prediction.build_dataset(
+        prediction.list_images(config.input_path),
+        preprocess_fn=lambda image: builder.preprocess(image, 0)[0],
+        batch_size=config.batch_size,
+        num_parallel_calls=(config.num_parallel_calls or
+                            tf.data.experimental.AUTOTUNE))
+    return prediction.predict(model,
+                              dataset,
+                              top_k=config.top_k,
+                              output_path=config.output_path)
+
+
+def prune(params: base_configs.ExperimentConfig,
+          strategy_override: tf.distribute.Strategy) -> Mapping[str, Any]:
+    """Prunes the filters of a trained model to a budget, and fine-tunes it.
+
+    The pruned model is rebuilt with fewer filters, fine-tuned with a cosine
+    learning rate decay, and saved as a SavedModel. Fine-tuning checkpoints
+    are written to `model_dir`/pruned, and are not resumed.
+
+    Returns:
+      The stats of fine-tuning, with the FLOPs, parameters and CPU latency of
+      the model before and after pruning, prefixed by 'original_' and
+      'pruned_'.
+    """
+    logging.info('Running pruning.')
+    config = params.prune
+    if params.model.quantize_aware:
+        raise ValueError('Pruning does not support quantization aware '
+                         'training.')
+
+    strategy = strategy_override or distribution_utils.get_distribution_strategy(
+        distribution_strategy=params.runtime.distribution_strategy,
+        all_reduce_alg=params.runtime.all_reduce_alg,
+        num_gpus=params.runtime.num_gpus,
+        tpu_address=params.runtime.tpu)
+    strategy_scope = distribution_utils.get_strategy_scope(strategy)
+
+    label_smoothing = params.model.loss.label_smoothing
+    one_hot = label_smoothing and label_smoothing > 0
+    builders = _get_dataset_builders(params, strategy, one_hot)
+    train_builder, validation_builder = builders  # pylint: disable=unbalanced-tuple-unpacking
+    train_steps = params.train.steps or train_builder.num_steps
+    validation_steps = params.evaluation.steps or validation_builder.num_steps
+    initialize(params, train_builder)
+
+    model = load_model(params, config.checkpoint)
+    dataset_config = params.train_dataset
+    if dataset_config.normalize_in_model:
+        # The input normalization is kept as is, around the pruned model
+        model = model.layers[-1]
+    image_size = validation_builder.image_size
+    original_costs = pruning.model_costs(model, image_size)
+    pruned_model = pruning.prune_to_budget(
+        model,
+        target_ratio=config.target_ratio,
+        budget=config.budget,
+        criterion=config.criterion,
+        image_size=image_size,
+        channel_multiple=config.channel_multiple)
+    pruned_costs = pruning.model_costs(pruned_model, image_size)
+    for name, original_cost in original_costs.items():
+        logging.info('%s: %.4g before pruning, %.4g after.', name,
+                     original_cost, pruned_costs[name])
+
+    finetune_dir = os.path.join(params.model_dir, 'pruned')
+    with strategy_scope:
+        # Creates the variables of the pruned model under the strategy
+        weights = pruned_model.get_weights()
+        pruned_model = tf.keras.models.clone_model(pruned_model)
+        pruned_model.set_weights(weights)
+        if dataset_config.normalize_in_model:
+            pruned_model = add_input_normalization(
+                pruned_model,
+                mean_subtract=dataset_config.mean_subtract,
+                standardize=dataset_config.standardize)
+        learning_rate = tf.keras.experimental.CosineDecay(
+            config.finetune_lr,
+            decay_steps=max(config.finetune_epochs * train_steps, 1))
+        optimizer = optimizer_factory.build_optimizer(
+            optimizer_name=params.model.optimizer.name,
+            base_learning_rate=learning_rate,
+            params=params.model.optimizer.as_dict())
+        optimizer = performance.configure_optimizer(
+            optimizer,
+            use_float16=train_builder.dtype == 'float16',
+            loss_scale=get_loss_scale(params))
+        metrics_map = _get_metrics(one_hot)
+        pruned_model.compile(
+            optimizer=optimizer,
+            loss=_get_loss(params, one_hot),
+            metrics=[metrics_map[metric] for metric in params.train.metrics])
+
+    pruned_model.summary()
+    history = None
+    callbacks = []
+    if config.finetune_epochs:
+        callbacks = custom_callbacks.get_callbacks(
+            model_checkpoint=(
+                params.train.callbacks.enable_checkpoint_and_export),
+            include_tensorboard=params.train.callbacks.enable_tensorboard,
+            time_history=params.train.callbacks.enable_time_history,
+            track_lr=params.train.tensorboard.track_lr,
+            write_model_weights=params.train.tensorboard.write_model_weights,
+            checkpoint_steps=params.train.checkpoint_steps,
+            batch_size=train_builder.global_batch_size,
+            log_steps=params.train.time_history.log_steps,
+            model_dir=finetune_dir,
+            async_checkpoint=params.train.callbacks.async_checkpoint)
+        history = pruned_model.fit(train_builder.build(),
+                                   epochs=config.finetune_epochs,
+                                   steps_per_epoch=train_steps,
+                                   callbacks=callbacks)
+
+    validation_output = None
+    if not params.evaluation.skip_eval:
+        validation_output = pruned_model.evaluate(validation_builder.build(),
+                                                  steps=validation_steps,
+                                                  verbose=2)
+    pruned_model.save(config.destination or
+                      os.path.join(finetune_dir, 'saved_model'))
+
+    stats = resnet_common.build_stats(history, validation_output, callbacks)
+    for name in original_costs:
+        stats['original_' + name] = original_costs[name]
+        stats['pruned_' + name] = pruned_costs[name]
+    return stats
+
 
 def run(flags_obj: flags.FlagValues,
         strategy_override: tf.distribute.Strategy = None) -> Mapping[str, Any]:
@@ -430,9 +1333,18 @@ def run(flags_obj: flags.FlagValues,
     """
     params = _get_params_from_flags(flags_obj)
     if params.mode == 'train_and_eval':
+        if params.runtime.training_loop == 'ctl':
+            return train_and_eval_ctl(params, strategy_override)
+        elif params.runtime.training_loop != 'compile_fit':
+            raise ValueError('{} is not a valid training loop.'.format(
+                params.runtime.training_loop))
         return train_and_eval(params, strategy_override)
     elif params.mode == 'export_only':
-        export(params)
+        return export(params)
+    elif params.mode == 'predict':
+        return predict(params)
+    elif params.mode == 'prune':
+        return prune(params, strategy_override)
     else:
         raise ValueError('{} is not a valid mode.'.format(params.mode))
 
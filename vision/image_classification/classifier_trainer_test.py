@@ -18,12 +18,16 @@ from typing import Any, Callable, Iterable, Mapping, MutableMapping, Optional, T
 from absl import flags
 from absl.testing import parameterized
 import tensorflow as tf
+import tensorflow_model_optimization as tfmot
 
 from tensorflow.python.distribute import combinations
 from tensorflow.python.distribute import strategy_combinations
 from utils.flags import core as flags_core
 from vision.image_classification import dataset_factory, test_utils, classifier_trainer
+from vision.image_classification import callbacks as custom_callbacks
+from vision.image_classification import preprocessing
 from vision.image_classification.configs import base_configs
+from vision.image_classification.squeeze import squeeze_model
 
 classifier_trainer.define_classifier_flags()
 
@@ -109,6 +113,38 @@ def get_trivial_data() -> tf.data.Dataset:
     return dataset
 
 
+class _Preempted(Exception):
+    pass
+
+
+class _PreemptAt(tf.keras.callbacks.Callback):
+    """Interrupts training once the optimizer reaches a step."""
+
+    def __init__(self, step: int):
+        super(_PreemptAt, self).__init__()
+        self._step = step
+
+    def on_train_batch_end(self, batch, logs=None):
+        if int(self.model.optimizer.iterations) >= self._step:
+            raise _Preempted()
+
+
+class _FitRecorder(tf.keras.callbacks.Callback):
+    """Records the epochs and steps per epoch of every `fit`."""
+
+    def __init__(self):
+        super(_FitRecorder, self).__init__()
+        self.fits = []
+
+    def on_train_begin(self, logs=None):
+        self.fits.append({'epochs': self.params['epochs'],
+                          'steps': self.params['steps'],
+                          'epoch_begins': []})
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.fits[-1]['epoch_begins'].append(epoch)
+
+
 def run_end_to_end(main: Callable[[Any], None],
                    extra_flags: Optional[Iterable[str]] = None,
                    model_dir: Optional[str] = None):
@@ -167,6 +203,42 @@ class ClassifierTest(tf.test.TestCase, parameterized.TestCase):
                        model_dir=model_dir)
         self.assertTrue(os.path.exists(export_path))
 
+    @combinations.generate(distribution_strategy_combinations())
+    def test_end_to_end_ctl_train_and_eval_export(self, distribution, model,
+                                                  dataset):
+        """Test train_and_eval with the custom training loop, and export."""
+        model_dir = self.get_temp_dir()
+        base_flags = [
+            '--data_dir=not_used',
+            '--model_type=' + model,
+            '--dataset=' + dataset,
+        ]
+        params = basic_params_override()
+        params['train']['steps'] = 2
+        params['runtime'] = {'training_loop': 'ctl', 'steps_per_loop': 1}
+        train_and_eval_flags = base_flags + [
+            get_params_override(params),
+            '--mode=train_and_eval',
+        ]
+
+        export_path = os.path.join(model_dir, 'export')
+        params['export'] = {'destination': export_path}
+        export_flags = base_flags + [
+            '--mode=export_only',
+            get_params_override(params)
+        ]
+
+        run = functools.partial(classifier_trainer.run,
+                                strategy_override=distribution)
+        run_end_to_end(main=run,
+                       extra_flags=train_and_eval_flags,
+                       model_dir=model_dir)
+        self.assertIsNotNone(tf.train.latest_checkpoint(model_dir))
+        run_end_to_end(main=run,
+                       extra_flags=export_flags,
+                       model_dir=model_dir)
+        self.assertTrue(os.path.exists(export_path))
+
     @combinations.generate(distribution_strategy_combinations())
     def test_end_to_end_invalid_mode(self, distribution, model, dataset):
         """Test the Keras EfficientNet model with `strategy`."""
@@ -290,6 +362,314 @@ class UtilTests(parameterized.TestCase, tf.test.TestCase):
 
         tf.io.gfile.rmtree(model_dir)
 
+    def test_checkpoint_saves_input_state(self):
+        """Tests that checkpoints record the position of the input pipeline."""
+        model = get_trivial_model(10)
+        model_dir = self.get_temp_dir()
+        callbacks = [
+            custom_callbacks.InputStateModelCheckpoint(
+                os.path.join(model_dir, 'model.ckpt-{epoch:04d}'),
+                batch_size=8,
+                initial_step=0,
+                initial_examples=4,
+                save_weights_only=True,
+                save_freq=3)
+        ]
+        model.fit(
+            get_trivial_data(),
+            callbacks=callbacks,
+            epochs=1,
+            steps_per_epoch=7)
+
+        latest_checkpoint = tf.train.latest_checkpoint(model_dir)
+        input_state = custom_callbacks.read_input_state(latest_checkpoint)
+        self.assertEqual({'step': 6, 'examples': 4 + 6 * 8}, input_state)
+
+        tf.io.gfile.rmtree(model_dir)
+
+    @parameterized.named_parameters(
+        ('mid_epoch', 6, [12, 16], [
+            {'epochs': 2, 'steps': 2, 'epoch_begins': [1]},
+            {'epochs': 3, 'steps': 4, 'epoch_begins': [2]},
+        ]),
+        ('epoch_end', 8, [16], [
+            {'epochs': 3, 'steps': 4, 'epoch_begins': [2]},
+        ]),
+    )
+    def test_fit_phase_resumes_mid_epoch(self, preempt_step, expected_offsets,
+                                         expected_fits):
+        """Tests resuming a phase from a checkpoint within an epoch."""
+        model_dir = self.get_temp_dir()
+        builder = dataset_factory.DatasetBuilder(
+            dataset_factory.DatasetConfig(builder='synthetic',
+                                          batch_size=2,
+                                          use_per_replica_batch_size=False,
+                                          use_record_index=True))
+        # 3 epochs of 4 steps of 2 examples
+        phase = classifier_trainer._TrainPhase(builder=builder,
+                                               start_epoch=0,
+                                               end_epoch=3,
+                                               steps_per_epoch=4,
+                                               start_step=0,
+                                               start_examples=0)
+        offsets = []
+
+        def build_dataset(builder, start_offset):
+            offsets.append(start_offset)
+            examples = tf.data.Dataset.range(start_offset, start_offset + 100)
+            dataset = examples.map(
+                lambda example: (tf.cast([example], tf.float32) / 100.,
+                                 tf.zeros([1])))
+            return dataset.batch(builder.global_batch_size)
+
+        def linear_model():
+            inputs = tf.keras.layers.Input(shape=(1,))
+            model = tf.keras.Model(inputs, tf.keras.layers.Dense(1)(inputs))
+            model.compile(optimizer=tf.keras.optimizers.SGD(0.01), loss='mse')
+            return model
+
+        def checkpoint(initial_step, initial_examples):
+            return custom_callbacks.InputStateModelCheckpoint(
+                os.path.join(model_dir, 'model.ckpt-{epoch:04d}'),
+                batch_size=builder.global_batch_size,
+                initial_step=initial_step,
+                initial_examples=initial_examples,
+                save_weights_only=True,
+                save_freq=2)
+
+        with self.assertRaises(_Preempted):
+            classifier_trainer._fit_phase(
+                linear_model(), phase, 0, 0, build_dataset, verbose=0,
+                callbacks=[checkpoint(0, 0), _PreemptAt(preempt_step)])
+        input_state = custom_callbacks.read_input_state(
+            tf.train.latest_checkpoint(model_dir))
+        self.assertEqual({'step': preempt_step, 'examples': 2 * preempt_step},
+                         input_state)
+
+        model = linear_model()
+        classifier_trainer.resume_from_checkpoint(model=model,
+                                                  model_dir=model_dir,
+                                                  train_steps=4)
+        initial_step = int(model.optimizer.iterations.numpy())
+        self.assertEqual(preempt_step, initial_step)
+        del offsets[:]
+        recorder = _FitRecorder()
+        classifier_trainer._fit_phase(
+            model, phase, initial_step, input_state['examples'], build_dataset,
+            verbose=0,
+            callbacks=[checkpoint(initial_step, input_state['examples']),
+                       recorder])
+
+        # The rest of the interrupted epoch, then whole epochs from its end
+        self.assertEqual(expected_offsets, offsets)
+        self.assertEqual(expected_fits, recorder.fits)
+        self.assertEqual(phase.end_step, int(model.optimizer.iterations))
+        self.assertEqual(
+            {'step': phase.end_step, 'examples': phase.end_examples},
+            custom_callbacks.read_input_state(
+                tf.train.latest_checkpoint(model_dir)))
+        self.assertEqual(24, phase.end_examples)
+
+        tf.io.gfile.rmtree(model_dir)
+
+    def _train_phases(self, schedule, train_epochs, quantize_aware=0):
+        """Returns the phases of 10 steps per epoch of batches of 8."""
+        config = base_configs.ExperimentConfig(
+            train=base_configs.TrainConfig(epochs=train_epochs,
+                                           progressive_resizing=schedule),
+            model=base_configs.ModelConfig(quantize_aware=quantize_aware))
+        train_builder = dataset_factory.DatasetBuilder(
+            dataset_factory.DatasetConfig(builder='synthetic',
+                                          image_size=224,
+                                          batch_size=8,
+                                          use_per_replica_batch_size=False))
+        phases = classifier_trainer._get_train_phases(config, train_builder,
+                                                      train_steps=10)
+        return [(phase.start_epoch, phase.end_epoch, phase.builder.image_size,
+                 phase.builder.global_batch_size, phase.steps_per_epoch,
+                 phase.start_step, phase.end_step, phase.start_examples,
+                 phase.end_examples, phase.quantize_aware)
+                for phase in phases], phases
+
+    def test_train_phases(self):
+        """Tests the phase boundaries of progressive resizing schedules."""
+        # Without a schedule, a single phase of the train dataset
+        summary, _ = self._train_phases(None, train_epochs=3)
+        self.assertEqual([(0, 3, 224, 8, 10, 0, 30, 0, 240, False)], summary)
+
+        # A schedule from epoch 0 replaces the train dataset
+        summary, _ = self._train_phases(
+            [base_configs.ResizingPhaseConfig(epoch=0, image_size=128,
+                                              batch_size=16),
+             base_configs.ResizingPhaseConfig(epoch=2)],
+            train_epochs=4)
+        self.assertEqual([(0, 2, 128, 16, 5, 0, 10, 0, 160, False),
+                          (2, 4, 224, 8, 10, 10, 30, 160, 320, False)],
+                         summary)
+
+        # A later schedule starts after the train dataset, the batch size
+        # scaled by the image area
+        summary, _ = self._train_phases(
+            [base_configs.ResizingPhaseConfig(epoch=1, image_size=112)],
+            train_epochs=3)
+        self.assertEqual([(0, 1, 224, 8, 10, 0, 10, 0, 80, False),
+                          (1, 3, 112, 32, 2, 10, 14, 80, 208, False)],
+                         summary)
+
+    def test_train_phases_split_for_quantize_aware(self):
+        """Tests that quantization aware training starts a phase."""
+        schedule = [
+            base_configs.ResizingPhaseConfig(epoch=0, image_size=128,
+                                             batch_size=16),
+            base_configs.ResizingPhaseConfig(epoch=2),
+        ]
+        # The last epoch, within the second phase
+        summary, _ = self._train_phases(schedule, train_epochs=4,
+                                        quantize_aware=1)
+        self.assertEqual([(0, 2, 128, 16, 5, 0, 10, 0, 160, False),
+                          (2, 3, 224, 8, 10, 10, 20, 160, 240, False),
+                          (3, 4, 224, 8, 10, 20, 30, 240, 320, True)],
+                         summary)
+
+        # The first epoch of a phase, which is not split
+        summary, _ = self._train_phases(schedule, train_epochs=4,
+                                        quantize_aware=2)
+        self.assertEqual([(0, 2, 128, 16, 5, 0, 10, 0, 160, False),
+                          (2, 4, 224, 8, 10, 10, 30, 160, 320, True)],
+                         summary)
+
+        # More epochs than training, all of them
+        summary, _ = self._train_phases(None, train_epochs=2,
+                                        quantize_aware=3)
+        self.assertEqual([(0, 2, 224, 8, 10, 0, 20, 0, 160, True)], summary)
+
+    def test_find_phase(self):
+        """Tests the phases resumed from at and around their boundaries."""
+        _, phases = self._train_phases(
+            [base_configs.ResizingPhaseConfig(epoch=0, image_size=128,
+                                              batch_size=16),
+             base_configs.ResizingPhaseConfig(epoch=2)],
+            train_epochs=4,
+            quantize_aware=1)
+
+        def find(step):
+            return phases.index(classifier_trainer._find_phase(phases, step))
+
+        self.assertEqual(0, find(0))
+        # The last step of a phase, then the first of the next one
+        self.assertEqual(0, find(9))
+        self.assertEqual(1, find(10))
+        self.assertEqual(1, find(19))
+        self.assertEqual(2, find(20))
+        self.assertFalse(classifier_trainer._find_phase(
+            phases, 19).quantize_aware)
+        self.assertTrue(classifier_trainer._find_phase(
+            phases, 20).quantize_aware)
+        # Training is over at the end step of the last phase
+        self.assertEqual(2, find(30))
+        self.assertEqual(phases[-1].end_step, 30)
+
+    def test_invalid_train_phases(self):
+        """Tests that schedules outside of the train epochs are rejected."""
+        for schedule, quantize_aware in [
+                ([base_configs.ResizingPhaseConfig(epoch=2),
+                  base_configs.ResizingPhaseConfig(epoch=1)], 0),
+                ([base_configs.ResizingPhaseConfig(epoch=4)], 0),
+                (None, -1)]:
+            with self.assertRaises(ValueError):
+                self._train_phases(schedule, train_epochs=4,
+                                   quantize_aware=quantize_aware)
+
+    def test_add_input_normalization(self):
+        """Tests that uint8 images are normalized by the first model layer."""
+        model = test_utils.trivial_model(num_classes=10)
+        normalized_model = classifier_trainer.add_input_normalization(
+            model, mean_subtract=True, standardize=True)
+        self.assertEqual(tf.uint8, normalized_model.input.dtype)
+
+        images = tf.random.uniform((2, 224, 224, 3), maxval=256, dtype=tf.int32)
+        images = tf.cast(images, tf.uint8)
+        expected = model(preprocessing.normalize_images(
+            tf.cast(images, tf.float32), dtype=None))
+        self.assertAllClose(expected, normalized_model(images))
+
+    def test_allow_any_image_size(self):
+        """Tests that a model rebuilt for any image size runs at several."""
+        model = classifier_trainer.allow_any_image_size(
+            squeeze_model.squeezenet(num_classes=10))
+        for image_size in (128, 192):
+            images = tf.zeros((2, image_size, image_size, 3))
+            self.assertEqual((2, 10), model(images).shape)
+
+        flatten_model = tf.keras.Sequential([
+            tf.keras.layers.Flatten(input_shape=(32, 32, 3)),
+            tf.keras.layers.Dense(10),
+        ])
+        with self.assertRaises(ValueError):
+            classifier_trainer.allow_any_image_size(flatten_model)
+
+    def test_recalibrate_batch_norm(self):
+        """Tests that the statistics are averaged over the batches."""
+        inputs = tf.keras.layers.Input(shape=(2,))
+        outputs = tf.keras.layers.BatchNormalization(momentum=0.9)(inputs)
+        model = tf.keras.Model(inputs, outputs)
+        images = tf.constant([[0., 1.], [2., 1.], [4., 5.], [6., 5.]])
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (images, tf.zeros([4]))).batch(2)
+
+        num_batches = classifier_trainer.recalibrate_batch_norm(
+            model, dataset, steps=10)
+        self.assertEqual(2, num_batches)
+        bn_layer = model.layers[-1]
+        self.assertEqual(0.9, bn_layer.momentum)
+        self.assertAllClose([3., 3.], bn_layer.moving_mean)
+        self.assertAllClose([5., 4.], bn_layer.moving_variance)
+
+    def test_recalibration_builder_skips_eval_cache(self):
+        """Tests that recalibration images are not written to the cache."""
+        config = base_configs.ExperimentConfig(
+            evaluation=base_configs.EvalConfig(bn_recalibration_steps=2))
+        validation_builder = dataset_factory.DatasetBuilder(
+            dataset_factory.DatasetConfig(builder='records',
+                                          filenames=['validation-00000'],
+                                          split='validation',
+                                          eval_cache_dir=self.get_temp_dir()))
+
+        builder = classifier_trainer._get_recalibration_builder(
+            config, validation_builder)
+        self.assertEqual(config.evaluation.bn_recalibration_split,
+                         builder.config.split)
+        self.assertFalse(builder.is_training)
+        self.assertIsNone(builder.eval_tensor_cache)
+
+        with self.assertRaisesRegex(ValueError, 'validation dataset'):
+            classifier_trainer._get_recalibration_builder(config, None)
+
+    def test_make_quantize_aware(self):
+        """Tests that fake quantization keeps the weights of the model."""
+        inputs = tf.keras.layers.Input(shape=(32, 32, 3))
+        x = tf.keras.layers.Conv2D(8, 3, name='conv')(inputs)
+        x = tf.keras.layers.ReLU()(x)
+        x = tf.keras.layers.GlobalAveragePooling2D()(x)
+        x = tf.keras.layers.Dense(10, activation='softmax')(x)
+        model = tf.keras.Model(inputs, x)
+        config = base_configs.ExperimentConfig(
+            train_dataset=dataset_factory.DatasetConfig(dtype='float32'))
+
+        quantized_model = classifier_trainer.make_quantize_aware(config, model)
+        self.assertIsInstance(quantized_model.get_layer('quant_conv'),
+                              tfmot.quantization.keras.QuantizeWrapper)
+        self.assertAllEqual(
+            model.get_layer('conv').kernel,
+            quantized_model.get_layer('quant_conv').layer.kernel)
+
+        images = tf.random.uniform((2, 32, 32, 3))
+        self.assertAllClose(model(images), quantized_model(images), atol=0.05)
+
+        with self.assertRaises(ValueError):
+            classifier_trainer.make_quantize_aware(
+                config.replace(train_dataset={'dtype': 'float16'}), model)
+
     def test_serialize_config(self):
         """Tests functionality for serializing data."""
         config = base_configs.ExperimentConfig()
@@ -23,10 +23,80 @@ class ExportConfig(base_config.Config):
     Attributes:
       checkpoint: the path to the checkpoint to export.
       destination: the path to where the checkpoint should be exported.
+      quantization: also export a post-training quantized TFLite model to
+        `destination` + '.tflite', either 'dynamic_range' (int8 weights) or
+        'full_integer' (int8 weights and activations). Its top-1 accuracy,
+        size and CPU latency are compared to the float model's. Defaults to
+        None, no quantized model.
+      calibration_steps: the number of validation dataset batches the
+        activation ranges of 'full_integer' quantization are calibrated on.
+      quantization_eval_steps: the number of validation dataset batches the
+        quantized and float models are evaluated on, the ones following the
+        `calibration_steps` calibration batches.
 
     """
     checkpoint: str = None
     destination: str = None
+    quantization: Optional[str] = None
+    calibration_steps: int = 10
+    quantization_eval_steps: int = 10
+
+
+@dataclasses.dataclass
+class PredictConfig(base_config.Config):
+    """Configuration for batched prediction.
+
+    Attributes:
+      model_path: the SavedModel directory or checkpoint to predict with.
+        Defaults to the latest checkpoint of `model_dir`.
+      input_path: the images to predict: a directory of JPEG files, a glob
+        pattern, or a text file with one image path per line.
+      output_path: the `.npz` file the top-k classes and scores are written to.
+      batch_size: the maximum number of images per batch.
+      top_k: the number of classes kept per image.
+      num_parallel_calls: the number of images read and preprocessed in
+        parallel. Defaults to `tf.data.experimental.AUTOTUNE`.
+
+    """
+    model_path: str = None
+    input_path: str = None
+    output_path: str = None
+    batch_size: int = 64
+    top_k: int = 5
+    num_parallel_calls: Optional[int] = None
+
+
+@dataclasses.dataclass
+class PruneConfig(base_config.Config):
+    """Configuration for structured channel pruning.
+
+    Attributes:
+      checkpoint: the checkpoint of the trained model to prune. Defaults to
+        the latest checkpoint of `model_dir`.
+      destination: the path the fine-tuned pruned model is saved to, as a
+        SavedModel. Defaults to `model_dir`/pruned/saved_model.
+      criterion: the ranking of the filters to keep, either 'l1' (L1 norm of
+        the filter weights) or 'bn_gamma' (absolute scale of the following
+        batch normalization).
+      budget: the cost reduced by pruning, either 'flops' or 'latency' (the
+        CPU latency of one image).
+      target_ratio: the fraction of the budget cost of the trained model the
+        pruned model keeps.
+      channel_multiple: the number of filters kept per convolution is rounded
+        up to a multiple of this.
+      finetune_epochs: the number of epochs the pruned model is fine-tuned.
+      finetune_lr: the initial learning rate of fine-tuning, decayed to 0
+        with a cosine schedule.
+
+    """
+    checkpoint: str = None
+    destination: str = None
+    criterion: str = 'l1'
+    budget: str = 'flops'
+    target_ratio: float = 0.5
+    channel_multiple: int = 8
+    finetune_epochs: int = 10
+    finetune_lr: float = 0.01
 
 
 @dataclasses.dataclass
@@ -54,6 +124,56 @@ class TimeHistoryConfig(base_config.Config):
     log_steps: int = None
 
 
+@dataclasses.dataclass
+class ResizingPhaseConfig(base_config.Config):
+    """Configuration for a phase of progressive resizing.
+
+    Attributes:
+      epoch: The first epoch of the phase. The phase lasts until the next one,
+        or the end of training.
+      image_size: The size of the train images during the phase. If None, the
+        image size of the train dataset is used. Defaults to None.
+      batch_size: The batch size during the phase, in the same units as the
+        train dataset batch size. If None, the train dataset batch size is
+        scaled by the ratio of its image area to the phase's, so that a step
+        costs about the same at every size. Defaults to None.
+
+    """
+    epoch: int = 0
+    image_size: int = None
+    batch_size: int = None
+
+
+@dataclasses.dataclass
+class DistillationConfig(base_config.Config):
+    """Configuration for knowledge distillation from a teacher model.
+
+    Attributes:
+      teacher_model: The model name of the teacher, e.g. 'resnet50'.
+      teacher_checkpoint: The checkpoint or SavedModel of the trained teacher.
+      teacher_model_params: The parameters used to create the teacher model.
+        Defaults to the number of classes of the student.
+      temperature: The softmax temperature of the soft targets.
+      alpha: The weight of the soft target loss, the label loss has weight
+        1 - alpha.
+      cache_dir: An optional local directory the teacher logits of
+        `num_cached_crops` fixed crops per training image are cached to, so
+        that the teacher runs once per crop instead of at every step. The
+        train dataset then uses these crops (see `DatasetConfig.fixed_crops`),
+        and requires `use_record_index`. The augmenter is not seen by the
+        teacher then. Defaults to None, the teacher runs at every step.
+      num_cached_crops: The number of fixed crops per training image cached.
+
+    """
+    teacher_model: str = 'resnet50'
+    teacher_checkpoint: str = None
+    teacher_model_params: Mapping[str, Any] = None
+    temperature: float = 4.
+    alpha: float = 0.9
+    cache_dir: Optional[str] = None
+    num_cached_crops: int = 10
+
+
 @dataclasses.dataclass
 class TrainConfig(base_config.Config):
     """Configuration for training.
@@ -64,6 +184,19 @@ class TrainConfig(base_config.Config):
       epochs: The number of training epochs to run. Defaults to None.
       steps: The number of steps to run per epoch. If None, then this will be
         inferred based on the number of images and batch size. Defaults to None.
+      checkpoint_steps: The number of steps between checkpoints. If None,
+        checkpoints are saved at the end of every epoch. Together with
+        `use_record_index` in the dataset config, training resumes at the exact
+        step and position of the input stream. Defaults to None.
+      progressive_resizing: A list of `ResizingPhaseConfig` with increasing
+        epochs. The train dataset is rebuilt at every phase with its image and
+        batch size, while the model keeps its weights. The learning rate
+        follows the schedule of the train dataset batch size by epoch, scaled
+        linearly with the batch size of the phase. Epochs before the first
+        phase use the train dataset as configured. Requires a model without
+        layers depending on the image size. Defaults to None.
+      distillation: A `DistillationConfig` instance, to train the model on the
+        soft targets of a teacher. Defaults to None, no distillation.
       callbacks: An instance of CallbacksConfig.
       metrics: An instance of MetricsConfig.
       tensorboard: An instance of TensorboardConfig.
@@ -72,6 +205,9 @@ class TrainConfig(base_config.Config):
     resume_checkpoint: bool = None
     epochs: int = None
     steps: int = None
+    checkpoint_steps: int = None
+    progressive_resizing: List[ResizingPhaseConfig] = None
+    distillation: DistillationConfig = None
     callbacks: CallbacksConfig = CallbacksConfig()
     metrics: MetricsConfig = None
     tensorboard: TensorboardConfig = TensorboardConfig()
@@ -89,11 +225,22 @@ class EvalConfig(base_config.Config):
         be inferred based on the number of images and batch size. Defaults to
         None.
       skip_eval: Whether or not to skip evaluation.
+      bn_recalibration_steps: The number of batches the batch normalization
+        statistics are re-estimated on after training, before the final
+        evaluation. The images are preprocessed for evaluation at the image
+        size of the validation dataset, which may be larger than the train
+        image size: the recalibration corrects the shift of the activation
+        statistics between the two resolutions. The recalibrated weights are
+        saved under `model_dir/recalibrated`. Defaults to 0, no recalibration.
+      bn_recalibration_split: The split of the validation dataset config the
+        recalibration images are read from. Defaults to 'train'.
 
     """
     epochs_between_evals: int = None
     steps: int = None
     skip_eval: bool = False
+    bn_recalibration_steps: int = 0
+    bn_recalibration_split: str = 'train'
 
 
 @dataclasses.dataclass
@@ -186,6 +333,11 @@ class ModelConfig(base_config.Config):
       num_classes: The number of classes in the model. Defaults to None.
       loss: A `LossConfig` instance. Defaults to None.
       optimizer: An `OptimizerConfig` instance. Defaults to None.
+      quantize_aware: The number of final training epochs run with fake
+        quantization of the weights and activations, so that the model keeps
+        its accuracy once quantized to int8 for export. The float model is
+        trained before, and its weights are kept. Requires float32 training.
+        Defaults to 0, no quantization aware training.
 
     """
     name: str = None
@@ -193,6 +345,7 @@ class ModelConfig(base_config.Config):
     num_classes: int = None
     loss: LossConfig = None
     optimizer: OptimizerConfig = None
+    quantize_aware: int = 0
 
 
 @dataclasses.dataclass
@@ -201,12 +354,14 @@ class ExperimentConfig(base_config.Config):
 
     Attributes:
       model_dir: The directory to use when running an experiment.
-      mode: e.g. 'train_and_eval', 'export'
+      mode: e.g. 'train_and_eval', 'export_only', 'predict', 'prune'
       runtime: A `RuntimeConfig` instance.
       train: A `TrainConfig` instance.
       evaluation: An `EvalConfig` instance.
       model: A `ModelConfig` instance.
       export: An `ExportConfig` instance.
+      predict: A `PredictConfig` instance.
+      prune: A `PruneConfig` instance.
 
     """
     model_dir: str = None
@@ -219,3 +374,5 @@ class ExperimentConfig(base_config.Config):
     evaluation: EvalConfig = None
     model: ModelConfig = None
     export: ExportConfig = None
+    predict: PredictConfig = PredictConfig()
+    prune: PruneConfig = PruneConfig()
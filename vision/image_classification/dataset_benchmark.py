@@ -0,0 +1,392 @@
+# Lint as: python3
+# ==============================================================================
+r"""Measures the throughput of a `DatasetBuilder` input pipeline.
+
+The pipeline is run alone, without any model, for a fixed number of steps to
+report images/sec together with the CPU utilization and the peak RSS of the
+process. Each stage of the pipeline (read, parse, decode, augment, batch) is
+also timed on its own, sequentially and on inputs cached in memory, to report
+its latency per image.
+
+The results are written to `metric.log` and `benchmark_run.log` in the JSON
+format of `BenchmarkFileLogger`.
+
+Without a `data_dir`, the TFRecord builders run against a small generated
+fixture of random JPEG images, so the benchmark works offline:
+
+```
+python dataset_benchmark.py \
+  --builder=records \
+  --augmenter=randaugment \
+  --benchmark_log_dir=/tmp/dataset_benchmark
+```
+
+To compare reading the records by offset with their index files against the
+interleaved `TFRecordDataset` reads, run it again with `--use_record_index`.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import os
+import resource
+import tempfile
+import time
+from typing import Any, Dict, Mapping
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+from utils.logs import logger
+from vision.image_classification import dataset_factory, record_index
+
+flags.DEFINE_enum(
+    'builder', 'records', ['tfds', 'records', 'decoded_records', 'synthetic'],
+    'The builder type used to load the dataset.')
+flags.DEFINE_string(
+    'dataset_name', 'imagenet2012',
+    'The name of the TFDS dataset, when using the tfds builder.')
+flags.DEFINE_string(
+    'data_dir', None,
+    'The directory of the dataset. The TFRecord builders use a generated '
+    'fixture if not set.')
+flags.DEFINE_enum(
+    'split', 'train', ['train', 'validation'],
+    'The split to read. Training applies the random crop and augmenter.')
+flags.DEFINE_integer('image_size', 224, 'The image height/width.')
+flags.DEFINE_integer('num_classes', 1000, 'The number of classes.')
+flags.DEFINE_integer('batch_size', 128, 'The batch size.')
+flags.DEFINE_string('dtype', 'float32', 'The dtype of the images.')
+flags.DEFINE_enum(
+    'augmenter', None, list(dataset_factory.AUGMENTERS),
+    'The augmenter to apply to training images. None by default.')
+flags.DEFINE_boolean(
+    'batched_augment', False,
+    'Whether to apply the augmenter to whole batches.')
+flags.DEFINE_boolean(
+    'use_record_index', False,
+    'Whether to read the TFRecords by offset with their index files.')
+flags.DEFINE_integer('num_steps', 100, 'The number of batches to time.')
+flags.DEFINE_integer(
+    'warmup_steps', 10,
+    'The number of batches read before timing, to fill the buffers.')
+flags.DEFINE_integer(
+    'stage_samples', 256,
+    'The number of images timed for the latency of each stage.')
+flags.DEFINE_string(
+    'benchmark_log_dir', '/tmp/dataset_benchmark',
+    'The directory of the benchmark logs.')
+
+FLAGS = flags.FLAGS
+
+STAGES = ('read', 'parse', 'decode', 'augment', 'batch')
+
+
+def write_fixture(data_dir: str,
+                  num_files: int = 2,
+                  records_per_file: int = 32,
+                  image_height: int = 300,
+                  image_width: int = 400,
+                  num_classes: int = 1000,
+                  seed: int = 0):
+    """Writes a small ImageNet-like TFRecord dataset of random JPEG images.
+
+    Both the train and validation splits are written, with the index file of
+    every shard, in the format of `imagenet/imagenet_to_tfrecord.py`.
+
+    Args:
+      data_dir: The output directory.
+      num_files: The number of shards per split.
+      records_per_file: The number of records per shard.
+      image_height: The height of the images.
+      image_width: The width of the images.
+      num_classes: The number of classes of the random labels.
+      seed: The seed of the random images and labels.
+    """
+    random = np.random.RandomState(seed)
+    for split in ('train', 'validation'):
+        output_directory = os.path.join(data_dir, split)
+        tf.io.gfile.makedirs(output_directory)
+        for shard in range(num_files):
+            output_file = os.path.join(
+                output_directory,
+                '%s-%.5d-of-%.5d' % (split, shard, num_files))
+            with tf.io.TFRecordWriter(output_file) as writer:
+                for _ in range(records_per_file):
+                    image = random.randint(
+                        0, 256, size=(image_height, image_width, 3))
+                    image_buffer = tf.io.encode_jpeg(image.astype(np.uint8))
+                    example = tf.train.Example(features=tf.train.Features(
+                        feature={
+                            'image/height': _int64_feature(image_height),
+                            'image/width': _int64_feature(image_width),
+                            'image/class/label': _int64_feature(
+                                random.randint(1, num_classes + 1)),
+                            'image/format': _bytes_feature(b'JPEG'),
+                            'image/encoded': _bytes_feature(
+                                image_buffer.numpy()),
+                        }))
+                    writer.write(example.SerializeToString())
+            record_index.write_index(output_file)
+
+
+def _int64_feature(value: int) -> tf.train.Feature:
+    """Inserts an int64 feature into Example proto."""
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def _bytes_feature(value: bytes) -> tf.train.Feature:
+    """Inserts a bytes feature into Example proto."""
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _time_per_element(dataset: tf.data.Dataset, num_elements: int) -> float:
+    """Returns the mean seconds to produce an element of `dataset`.
+
+    The first element is read before timing, to exclude tracing and start up.
+    """
+    iterator = iter(dataset.repeat())
+    next(iterator)
+    start = time.perf_counter()
+    for _ in range(num_elements):
+        next(iterator)
+    return (time.perf_counter() - start) / num_elements
+
+
+def _cached(dataset: tf.data.Dataset, num_elements: int) -> tf.data.Dataset:
+    """Returns the first elements of `dataset`, already cached in memory."""
+    dataset = dataset.take(num_elements).cache()
+    for _ in dataset:
+        pass
+    return dataset
+
+
+def measure_stage_latencies(builder: dataset_factory.DatasetBuilder,
+                            num_samples: int) -> Dict[str, float]:
+    """Times each stage of the input pipeline of `builder` on its own.
+
+    Every stage runs sequentially on the cached output of the previous stage,
+    so the latencies do not depend on the parallelism of the pipeline and are
+    the CPU cost of the stage. Stages that the builder does not have, like the
+    decoding of synthetic images, are left out.
+
+    Args:
+      builder: The dataset builder.
+      num_samples: The number of images timed per stage.
+
+    Returns:
+      A mapping from stage name to seconds per image.
+    """
+    latencies = {}
+    config = builder.config
+
+    if config.builder == 'synthetic':
+        images = _cached(builder.load_synthetic(), num_samples)
+    else:
+        if config.builder == 'tfds':
+            # TFDS reads and parses the records together
+            parsed = builder.load_tfds()
+            latencies['read'] = _time_per_element(parsed, num_samples)
+        else:
+            filenames = config.filenames or builder.record_filenames()
+            if config.use_record_index:
+                records = record_index.RecordIndex(filenames).dataset(
+                    shuffle=builder.is_training)
+            else:
+                records = tf.data.TFRecordDataset(filenames)
+            latencies['read'] = _time_per_element(records, num_samples)
+
+            if config.builder == 'records':
+                parse = builder.parse_example
+            else:
+                parse = builder.parse_decoded_example
+            records = _cached(records, num_samples)
+            latencies['parse'] = _time_per_element(records.map(parse),
+                                                   num_samples)
+            parsed = records.map(parse)
+
+        parsed = _cached(parsed, num_samples)
+        if parsed.element_spec[0].dtype == tf.string:
+            def decode(image_bytes, *inputs):
+                return (tf.io.decode_jpeg(image_bytes, channels=3),) + inputs
+
+            latencies['decode'] = _time_per_element(parsed.map(decode),
+                                                    num_samples)
+            images = parsed.map(decode)
+        else:
+            images = parsed
+        images = _cached(images, num_samples)
+
+    # `preprocess` crops decoded images without decoding them again
+    latencies['augment'] = _time_per_element(images.map(builder.preprocess),
+                                             num_samples)
+
+    preprocessed = _cached(images.map(builder.preprocess), num_samples)
+    batches = preprocessed.repeat().batch(builder.batch_size)
+    if builder.use_batched_augment:
+        batches = batches.map(builder.augment_batch)
+    num_batches = max(1, num_samples // builder.batch_size)
+    latencies['batch'] = (_time_per_element(batches, num_batches) /
+                          builder.batch_size)
+
+    return latencies
+
+
+def _cpu_seconds() -> float:
+    """Returns the user and system CPU time used by this process."""
+    times = os.times()
+    return times.user + times.system
+
+
+def _peak_rss_bytes() -> int:
+    """Returns the peak resident set size of this process."""
+    # `ru_maxrss` is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure_throughput(builder: dataset_factory.DatasetBuilder,
+                       num_steps: int,
+                       warmup_steps: int) -> Dict[str, float]:
+    """Runs the full input pipeline of `builder` for `num_steps` batches.
+
+    Args:
+      builder: The dataset builder.
+      num_steps: The number of batches to time.
+      warmup_steps: The number of batches read before timing.
+
+    Returns:
+      A mapping with the images/sec, the CPU utilization over all cores in
+      percent, and the peak RSS in bytes.
+    """
+    dataset = builder.build()
+    if not builder.is_training:
+        dataset = dataset.repeat()
+    iterator = iter(dataset)
+    for _ in range(warmup_steps):
+        next(iterator)
+
+    start_cpu = _cpu_seconds()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        next(iterator)
+    elapsed = time.perf_counter() - start
+    cpu_seconds = _cpu_seconds() - start_cpu
+
+    return {
+        'images_per_sec': num_steps * builder.global_batch_size / elapsed,
+        'cpu_utilization': 100. * cpu_seconds / elapsed / os.cpu_count(),
+        'peak_rss': _peak_rss_bytes(),
+    }
+
+
+def run_benchmark(config: dataset_factory.DatasetConfig,
+                  num_steps: int,
+                  warmup_steps: int,
+                  stage_samples: int,
+                  benchmark_log_dir: str) -> Dict[str, float]:
+    """Benchmarks the input pipeline of `config` and logs the results.
+
+    Args:
+      config: The dataset config.
+      num_steps: The number of batches to time.
+      warmup_steps: The number of batches read before timing.
+      stage_samples: The number of images timed for each stage.
+      benchmark_log_dir: The directory of the `BenchmarkFileLogger` logs.
+
+    Returns:
+      A mapping from metric name to value.
+    """
+    builder = dataset_factory.DatasetBuilder(config)
+
+    results = measure_throughput(builder, num_steps, warmup_steps)
+    latencies = measure_stage_latencies(builder, stage_samples)
+
+    benchmark_logger = logger.BenchmarkFileLogger(benchmark_log_dir)
+    benchmark_logger.log_run_info(
+        model_name='input_pipeline',
+        dataset_name=config.name or config.builder,
+        run_params=_run_params(config, num_steps, warmup_steps),
+        test_id='{}{}_{}'.format(config.builder,
+                                 '_indexed' if config.use_record_index else '',
+                                 config.augmenter.name or 'no_augmenter'))
+    benchmark_logger.log_metric('images_per_sec', results['images_per_sec'],
+                                unit='images/sec', global_step=num_steps)
+    benchmark_logger.log_metric('cpu_utilization', results['cpu_utilization'],
+                                unit='%', global_step=num_steps)
+    benchmark_logger.log_metric('peak_rss', results['peak_rss'],
+                                unit='bytes', global_step=num_steps)
+    for stage in STAGES:
+        if stage in latencies:
+            name = '{}_latency'.format(stage)
+            results[name] = latencies[stage]
+            benchmark_logger.log_metric(
+                name, latencies[stage] * 1000., unit='ms/image',
+                extras={'samples': str(stage_samples)})
+    benchmark_logger.on_finish(logger.RUN_STATUS_SUCCESS)
+
+    for name, value in sorted(results.items()):
+        logging.info('%s: %s', name, value)
+    return results
+
+
+def _run_params(config: dataset_factory.DatasetConfig,
+                num_steps: int,
+                warmup_steps: int) -> Mapping[str, Any]:
+    """Returns the benchmark parameters recorded in the run info."""
+    return {
+        'builder': config.builder,
+        'split': config.split,
+        'image_size': config.image_size,
+        'batch_size': config.batch_size,
+        'dtype': config.dtype,
+        'augmenter': config.augmenter.name or 'none',
+        'batched_augment': config.augmenter.batched,
+        'use_record_index': config.use_record_index,
+        'num_steps': num_steps,
+        'warmup_steps': warmup_steps,
+    }
+
+
+def main(_):
+    data_dir = FLAGS.data_dir
+    builder = FLAGS.builder
+    if data_dir is None and builder == 'decoded_records':
+        raise ValueError('decoded_records requires a data_dir, see '
+                         'imagenet/materialize_decoded_records.py')
+    if data_dir is None and builder == 'records':
+        data_dir = tempfile.mkdtemp(prefix='dataset_benchmark_')
+        logging.info('Writing a TFRecord fixture to %s', data_dir)
+        write_fixture(data_dir, num_classes=FLAGS.num_classes)
+
+    config = dataset_factory.DatasetConfig(
+        name=FLAGS.dataset_name if builder == 'tfds' else None,
+        data_dir=data_dir,
+        builder=builder,
+        split=FLAGS.split,
+        image_size=FLAGS.image_size,
+        num_classes=FLAGS.num_classes,
+        num_channels=3,
+        num_examples=FLAGS.batch_size * FLAGS.num_steps,
+        batch_size=FLAGS.batch_size,
+        use_per_replica_batch_size=False,
+        dtype=FLAGS.dtype,
+        one_hot=False,
+        use_record_index=FLAGS.use_record_index,
+        augmenter=dataset_factory.AugmentConfig(
+            name=FLAGS.augmenter, batched=FLAGS.batched_augment))
+
+    run_benchmark(config,
+                  num_steps=FLAGS.num_steps,
+                  warmup_steps=FLAGS.warmup_steps,
+                  stage_samples=FLAGS.stage_samples,
+                  benchmark_log_dir=FLAGS.benchmark_log_dir)
+
+
+if __name__ == '__main__':
+    logging.set_verbosity(logging.INFO)
+    app.run(main)
@@ -0,0 +1,91 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for dataset_benchmark."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+from absl.testing import parameterized
+import tensorflow as tf
+
+from utils.logs import logger
+from vision.image_classification import dataset_benchmark, dataset_factory
+
+
+class DatasetBenchmarkTest(parameterized.TestCase, tf.test.TestCase):
+
+    def _config(self, **kwargs) -> dataset_factory.DatasetConfig:
+        params = dict(image_size=32,
+                      num_classes=10,
+                      num_channels=3,
+                      num_examples=16,
+                      batch_size=4,
+                      use_per_replica_batch_size=False,
+                      one_hot=False)
+        params.update(kwargs)
+        return dataset_factory.DatasetConfig(**params)
+
+    def _read_metrics(self, log_dir):
+        with tf.io.gfile.GFile(
+                os.path.join(log_dir, logger.METRIC_LOG_FILE_NAME)) as f:
+            return {metric['name']: metric
+                    for metric in map(json.loads, f)}
+
+    @parameterized.named_parameters(
+        ('no_augmenter', None, False, False),
+        ('randaugment', 'randaugment', False, False),
+        ('batched_randaugment', 'randaugment', True, False),
+        ('record_index', None, False, True),
+    )
+    def test_records(self, augmenter, batched, use_record_index):
+        data_dir = os.path.join(self.get_temp_dir(), 'data')
+        dataset_benchmark.write_fixture(data_dir,
+                                        records_per_file=4,
+                                        image_height=40,
+                                        image_width=48,
+                                        num_classes=10)
+        log_dir = os.path.join(self.get_temp_dir(), 'logs')
+        config = self._config(
+            builder='records',
+            data_dir=data_dir,
+            use_record_index=use_record_index,
+            augmenter=dataset_factory.AugmentConfig(name=augmenter,
+                                                    batched=batched))
+
+        results = dataset_benchmark.run_benchmark(config,
+                                                  num_steps=2,
+                                                  warmup_steps=1,
+                                                  stage_samples=4,
+                                                  benchmark_log_dir=log_dir)
+
+        self.assertGreater(results['images_per_sec'], 0)
+        metrics = self._read_metrics(log_dir)
+        for stage in dataset_benchmark.STAGES:
+            self.assertIn('{}_latency'.format(stage), metrics)
+        self.assertEqual('images/sec', metrics['images_per_sec']['unit'])
+        self.assertIn('cpu_utilization', metrics)
+        self.assertIn('peak_rss', metrics)
+        self.assertTrue(tf.io.gfile.exists(
+            os.path.join(log_dir, logger.BENCHMARK_RUN_LOG_FILE_NAME)))
+
+    def test_synthetic(self):
+        log_dir = self.get_temp_dir()
+        config = self._config(builder='synthetic', data_dir='not_used')
+
+        results = dataset_benchmark.run_benchmark(config,
+                                                  num_steps=2,
+                                                  warmup_steps=1,
+                                                  stage_samples=4,
+                                                  benchmark_log_dir=log_dir)
+
+        self.assertIn('augment_latency', results)
+        self.assertIn('batch_latency', results)
+        self.assertNotIn('decode_latency', results)
+
+
+if __name__ == '__main__':
+    tf.test.main()
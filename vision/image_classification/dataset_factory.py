@@ -7,20 +7,27 @@ from __future__ import division
 from __future__ import print_function
 
 import os
-from typing import Any, List, Optional, Tuple, Mapping, Union
+from typing import Any, Callable, List, Optional, Tuple, Mapping, Union
 from absl import logging
 from dataclasses import dataclass
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
 from modeling.hyperparams import base_config
-from vision.image_classification import augment, preprocessing
+from vision.image_classification import augment, eval_cache, input_tuning, preprocessing, record_index, shared_cache
 
 AUGMENTERS = {
     'autoaugment': augment.AutoAugment,
     'randaugment': augment.RandAugment,
 }
 
+BBOX_KEYS = (
+    'image/object/bbox/ymin',
+    'image/object/bbox/xmin',
+    'image/object/bbox/ymax',
+    'image/object/bbox/xmax',
+)
+
 
 @dataclass
 class AugmentConfig(base_config.Config):
@@ -30,9 +37,13 @@ class AugmentConfig(base_config.Config):
       name: The name of the image augmentation to use. Possible options are
         None (default), 'autoaugment', or 'randaugment'.
       params: Any paramaters used to initialize the augmenter.
+      batched: Whether to apply the augmenter to whole batches after
+        `dataset.batch` instead of to each image inside the per-example map.
+        Images are augmented with the same distribution either way.
     """
     name: Optional[str] = None
     params: Optional[Mapping[str, Any]] = None
+    batched: bool = False
 
     def build(self) -> augment.ImageAugment:
         """Build the augmenter using this config."""
@@ -50,9 +61,14 @@ class DatasetConfig(base_config.Config):
       data_dir: The path where the dataset files are stored, if available.
       filenames: Optional list of strings representing the TFRecord names.
       builder: The builder type used to load the dataset. Value should be one of
-        'tfds' (load using TFDS), 'records' (load from TFRecords), or 'synthetic'
-        (generate dummy synthetic data without reading from files).
+        'tfds' (load using TFDS), 'records' (load from TFRecords),
+        'decoded_records' (load from TFRecords of already decoded and
+        downscaled images, see `imagenet/materialize_decoded_records.py`), or
+        'synthetic' (generate dummy synthetic data without reading from files).
       split: The split of the dataset. Usually 'train', 'validation', or 'test'.
+      is_training: Whether to shuffle, repeat and augment the dataset for
+        training. Defaults to whether `split` is 'train', set it to read the
+        train split with the evaluation preprocessing, or vice versa.
       image_size: The size of the image in the dataset. This assumes that
         `width` == `height`. Set to 'infer' to infer the image size from TFDS
         info. This requires `name` to be a registered dataset in TFDS.
@@ -88,14 +104,58 @@ class DatasetConfig(base_config.Config):
         CPU contention at the start of a training step.
       cache: whether to cache to dataset examples. Can be used to avoid re-reading
         from disk on the second epoch. Requires significant memory overhead.
+      shared_cache_dir: an optional host directory, e.g. under `/dev/shm`,
+        where the TFRecord files are copied to when first read (see
+        `shared_cache.py`). Unlike `cache`, it is shared by all the processes
+        of the host and survives restarts.
+      shared_cache_bytes: the maximum size of `shared_cache_dir`. The least
+        recently used files are evicted beyond it.
+      eval_cache_dir: an optional local directory where the preprocessed uint8
+        images of an evaluation dataset are written when it is first built
+        (see `eval_cache.py`). Later builds, e.g. by later runs, read them
+        back with no decoding. The cache is keyed by the source files, the
+        image size and the crop padding, and the images are normalized and
+        cast to `dtype` after reading. Ignored when training.
+      use_bounding_boxes: whether to parse the object bounding boxes of the
+        training records, so that the random crop overlaps with them. Only the
+        image and the label are parsed otherwise. Records without boxes, and
+        the TFDS and synthetic builders, crop the whole image.
+      use_record_index: whether to read TFRecords by offset using their index
+        files (see `record_index.py`). Shards the data at record granularity,
+        allows resuming in the middle of an epoch, and replaces the shuffle
+        buffer by a permutation of all training records per epoch.
+      shuffle_seed: the seed of the per epoch permutation of `use_record_index`.
+      fixed_crops: if positive, each training image is cropped and flipped
+        with one of `fixed_crops` random draws seeded by its record, the
+        `epoch % fixed_crops`-th one in each epoch, and the dataset outputs the
+        (record, crop) key of each image after its label. The crops are not
+        random across runs then, e.g. to cache per crop teacher outputs for
+        distillation. Requires `use_record_index`.
+      cycle_length: the number of TFRecord files read in parallel. Set to
+        'auto' to calibrate it for the host when the pipeline is built.
+      read_buffer_size: the read buffer size of each TFRecord file, in bytes.
+        Set to 'auto' to calibrate it for the host storage.
+      num_parallel_calls: the parallelism of the per example preprocessing.
+        Defaults to `tf.data.experimental.AUTOTUNE`. Set to 'auto' to calibrate
+        a fixed value for the host cores.
+      prefetch_buffer_size: the number of examples prefetched after reading.
+        Defaults to the global batch size.
+      interleave_parallel_reads: the number of files read in parallel by TFDS.
+      autotune_probe_seconds: the duration of each calibration probe of the
+        'auto' settings.
       mean_subtract: whether or not to apply mean subtraction to the dataset.
       standardize: whether or not to apply standardization to the dataset.
+      normalize_in_model: whether to output uint8 images and leave the mean
+        subtraction, standardization and cast to `dtype` to the first layer of
+        the model (see `preprocessing.NormalizeImages`). This sends 4x fewer
+        bytes to the devices than float32 batches.
     """
     name: Optional[str] = None
     data_dir: Optional[str] = None
     filenames: Optional[List[str]] = None
     builder: str = 'tfds'
     split: str = 'train'
+    is_training: Optional[bool] = None
     image_size: Union[int, str] = 'infer'
     num_classes: Union[int, str] = 'infer'
     num_channels: Union[int, str] = 'infer'
@@ -113,8 +173,22 @@ class DatasetConfig(base_config.Config):
     deterministic_train: bool = False
     use_slack: bool = True
     cache: bool = False
+    shared_cache_dir: Optional[str] = None
+    shared_cache_bytes: int = 32 * 1024 ** 3
+    eval_cache_dir: Optional[str] = None
+    use_bounding_boxes: bool = False
+    use_record_index: bool = False
+    shuffle_seed: int = 0
+    fixed_crops: int = 0
+    cycle_length: Union[int, str] = 16
+    read_buffer_size: Union[int, str] = 8 * 1024 * 1024  # 8 MiB per file
+    num_parallel_calls: Union[int, str] = tf.data.experimental.AUTOTUNE
+    prefetch_buffer_size: Optional[int] = None
+    interleave_parallel_reads: int = 64
+    autotune_probe_seconds: float = 1.0
     mean_subtract: bool = False
     standardize: bool = False
+    normalize_in_model: bool = False
 
     @property
     def has_data(self):
@@ -154,6 +228,7 @@ class DatasetBuilder:
         """Initialize the builder from the config."""
         self.config = config.replace(**overrides)
         self.builder_info = None
+        self._pipeline_settings = None
 
         if self.config.augmenter is not None:
             logging.info('Using augmentation: %s', self.config.augmenter.name)
@@ -164,8 +239,16 @@ class DatasetBuilder:
     @property
     def is_training(self) -> bool:
         """Whether this is the training set."""
+        if self.config.is_training is not None:
+            return self.config.is_training
         return self.config.split == 'train'
 
+    @property
+    def use_batched_augment(self) -> bool:
+        """Whether the augmenter is applied to batches instead of images."""
+        return (self.augmenter is not None and self.is_training and
+                self.config.augmenter.batched)
+
     @property
     def batch_size(self) -> int:
         """The batch size, multiplied by the number of replicas (if configured)."""
@@ -195,6 +278,8 @@ class DatasetBuilder:
         Raises:
           ValueError if the config's dtype is not supported.
 
+        Note that the images are output as uint8 if `normalize_in_model` is
+        set, this remains the dtype the model computes in.
         """
         dtype_map = {
             'float32': tf.float32,
@@ -249,22 +334,40 @@ class DatasetBuilder:
             self.builder_info = tfds.builder(self.config.name).info
         return self.builder_info
 
-    def build(self, input_context: tf.distribute.InputContext = None
-              ) -> tf.data.Dataset:
+    def build(self,
+              input_context: tf.distribute.InputContext = None,
+              start_offset: int = 0) -> tf.data.Dataset:
         """Construct a dataset end-to-end and return it.
 
         Args:
           input_context: An optional context provided by `tf.distribute` for
             cross-replica training. This isn't necessary if using Keras
             compile/fit.
+          start_offset: The number of examples already read across all input
+            pipelines, to resume in the middle of an epoch. Requires
+            `use_record_index`.
 
         Returns:
           A TensorFlow dataset outputting batched images and labels.
         """
+        cache = self.eval_tensor_cache
+        if cache:
+            return self.load_eval_cache(cache, input_context)
+
+        if self.config.use_record_index:
+            dataset = self.load_indexed_records(input_context, start_offset)
+            return self.pipeline(dataset, input_context)
+
+        if self.use_fixed_crops:
+            raise ValueError('fixed_crops requires use_record_index.')
+
+        if start_offset:
+            raise ValueError('Resuming from an offset requires use_record_index.')
 
         builders = {
             'tfds': self.load_tfds,
             'records': self.load_records,
+            'decoded_records': self.load_records,
             'synthetic': self.load_synthetic,
         }
 
@@ -295,7 +398,7 @@ class DatasetBuilder:
             decoders['image'] = tfds.decode.SkipDecoding()
 
         read_config = tfds.ReadConfig(
-            interleave_parallel_reads=64,
+            interleave_parallel_reads=self.config.interleave_parallel_reads,
             interleave_block_length=1)
 
         dataset = builder.as_dataset(
@@ -307,17 +410,24 @@ class DatasetBuilder:
 
         return dataset
 
+    def record_filenames(self) -> List[str]:
+        """The sorted list of TFRecord files of the split, without index files."""
+        if self.config.data_dir is None:
+            raise ValueError('Dataset must specify a path for the data files.')
+
+        file_pattern = os.path.join(self.config.data_dir,
+                                    '{}/*'.format(self.config.split))
+        filenames = tf.io.gfile.glob(file_pattern)
+        return sorted(f for f in filenames if not record_index.is_index_file(f))
+
     def load_records(self) -> tf.data.Dataset:
         """Return a dataset loading files with TFRecords."""
         logging.info('Using TFRecords to load data.')
 
         if self.config.filenames is None:
-            if self.config.data_dir is None:
-                raise ValueError('Dataset must specify a path for the data files.')
-
-            file_pattern = os.path.join(self.config.data_dir,
-                                        '{}/*'.format(self.config.split))
-            dataset = tf.data.Dataset.list_files(file_pattern, shuffle=True)
+            filenames = self.record_filenames()
+            dataset = tf.data.Dataset.from_tensor_slices(filenames)
+            dataset = dataset.shuffle(len(filenames))
         else:
             dataset = tf.data.Dataset.from_tensor_slices(self.config.filenames)
             if self.is_training:
@@ -326,13 +436,117 @@ class DatasetBuilder:
 
         return dataset
 
+    def load_indexed_records(self,
+                             input_context: tf.distribute.InputContext = None,
+                             start_offset: int = 0) -> tf.data.Dataset:
+        """Return a dataset reading TFRecords by offset with their index files.
+
+        The returned dataset is already sharded for `input_context`, and
+        shuffled and repeated for training.
+        """
+        logging.info('Using TFRecord index files to load data.')
+
+        if self.config.builder not in ('records', 'decoded_records'):
+            raise ValueError('use_record_index requires a TFRecord builder, got '
+                             '{}'.format(self.config.builder))
+        if self.config.cache:
+            raise ValueError('use_record_index can not be combined with cache.')
+
+        filenames = self.config.filenames or self.record_filenames()
+        index = record_index.RecordIndex(filenames)
+
+        num_shards, shard_index = 1, 0
+        if input_context:
+            num_shards = input_context.num_input_pipelines
+            shard_index = input_context.input_pipeline_id
+
+        cache = self.shared_cache
+        return index.dataset(num_shards=num_shards,
+                             shard_index=shard_index,
+                             shuffle=self.is_training,
+                             seed=self.config.shuffle_seed,
+                             start_offset=start_offset,
+                             repeat=self.is_training,
+                             path_fn=cache.fetch if cache else None,
+                             with_keys=self.use_fixed_crops)
+
+    @property
+    def use_fixed_crops(self) -> bool:
+        """Whether the training images are cropped from the keys of records."""
+        return self.config.fixed_crops > 0 and self.is_training
+
+    @property
+    def shared_cache(self) -> Optional[shared_cache.SharedFileCache]:
+        """The host cache of the TFRecord files, if configured."""
+        if self.config.shared_cache_dir is None:
+            return None
+        if self.config.builder not in ('records', 'decoded_records'):
+            raise ValueError('shared_cache_dir requires a TFRecord builder, got '
+                             '{}'.format(self.config.builder))
+        return shared_cache.SharedFileCache(self.config.shared_cache_dir,
+                                            self.config.shared_cache_bytes)
+
+    @property
+    def eval_tensor_cache(self) -> Optional[eval_cache.EvalTensorCache]:
+        """The cache of the preprocessed evaluation images, if configured."""
+        if self.config.eval_cache_dir is None or self.is_training:
+            return None
+        if self.config.builder == 'synthetic':
+            raise ValueError('eval_cache_dir requires a builder reading data.')
+        if self.config.builder == 'tfds':
+            source = {'data_dir': self.config.data_dir}
+        else:
+            source = {'filenames': list(self.config.filenames or
+                                        self.record_filenames())}
+        description = dict(source,
+                           builder=self.config.builder,
+                           name=self.config.name,
+                           split=self.config.split,
+                           image_size=self.image_size,
+                           crop_padding=preprocessing.CROP_PADDING)
+        return eval_cache.EvalTensorCache(
+            self.config.eval_cache_dir,
+            image_shape=(self.image_size, self.image_size, self.num_channels),
+            description=description)
+
+    def load_eval_cache(self,
+                        cache: eval_cache.EvalTensorCache,
+                        input_context: tf.distribute.InputContext = None
+                        ) -> tf.data.Dataset:
+        """Return the evaluation dataset read from its cache.
+
+        The cache is filled first if needed, by running the evaluation
+        preprocessing once on the whole dataset.
+        """
+        if not cache.is_filled:
+            # The uint8 images and sparse labels, before any normalization
+            fill_builder = DatasetBuilder(self.config,
+                                          eval_cache_dir=None,
+                                          is_training=False,
+                                          normalize_in_model=True,
+                                          one_hot=False)
+            cache.fill(fill_builder.build())
+        logging.info('Reading %d cached evaluation images from %s.',
+                     cache.num_examples, cache.path)
+
+        dataset = cache.dataset()
+        if input_context and input_context.num_input_pipelines > 1:
+            dataset = dataset.shard(input_context.num_input_pipelines,
+                                    input_context.input_pipeline_id)
+        dataset = dataset.batch(self.batch_size)
+        dataset = dataset.map(
+            lambda records: self.preprocess_cached(*cache.decode(records)),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        return dataset.prefetch(self.config.num_devices)
+
     def load_synthetic(self) -> tf.data.Dataset:
         """Return a dataset generating dummy synthetic data."""
         logging.info('Generating a synthetic dataset.')
 
         def generate_data(_):
+            dtype = tf.uint8 if self.config.normalize_in_model else self.dtype
             image = tf.zeros([self.image_size, self.image_size, self.num_channels],
-                             dtype=self.dtype)
+                             dtype=dtype)
             label = tf.zeros([1], dtype=tf.int32)
             return image, label
 
@@ -342,6 +556,89 @@ class DatasetBuilder:
                               num_parallel_calls=tf.data.experimental.AUTOTUNE)
         return dataset
 
+    @property
+    def pipeline_settings(self) -> Mapping[str, int]:
+        """The read and preprocessing parallelism of the pipeline.
+
+        Settings configured as 'auto' are calibrated once, by timing short
+        probes of the input pipeline on this host.
+
+        Returns:
+          A mapping with the `cycle_length`, `read_buffer_size` and
+          `num_parallel_calls` to use.
+        """
+        if self._pipeline_settings is None:
+            settings = {
+                'cycle_length': self.config.cycle_length,
+                'read_buffer_size': self.config.read_buffer_size,
+                'num_parallel_calls': self.config.num_parallel_calls,
+            }
+            if input_tuning.AUTO in settings.values():
+                settings.update(self._calibrate_pipeline(settings))
+            logging.info('Input pipeline settings for %s: %s',
+                         self.config.split, settings)
+            self._pipeline_settings = settings
+        return self._pipeline_settings
+
+    def _calibrate_pipeline(self, settings: Mapping[str, Union[int, str]]
+                            ) -> Mapping[str, int]:
+        """Calibrates the settings set to 'auto' for this host."""
+        default_config = DatasetConfig()
+        duration = self.config.autotune_probe_seconds
+        cores = input_tuning.num_cores()
+        calibrated = {}
+
+        filenames = None
+        if self.config.builder in ('records', 'decoded_records'):
+            filenames = self.config.filenames or self.record_filenames()
+
+        read_settings = ('cycle_length', 'read_buffer_size')
+        if any(settings[name] == input_tuning.AUTO for name in read_settings):
+            if filenames and not self.config.use_record_index:
+                cycle_lengths = [settings['cycle_length']]
+                if cycle_lengths[0] == input_tuning.AUTO:
+                    cycle_lengths = input_tuning.candidate_cycle_lengths(
+                        len(filenames), cores)
+                buffer_sizes = [settings['read_buffer_size']]
+                if buffer_sizes[0] == input_tuning.AUTO:
+                    buffer_sizes = input_tuning.BUFFER_SIZES
+                cycle_length, buffer_size = input_tuning.calibrate_reads(
+                    filenames, cycle_lengths, buffer_sizes, duration)
+            else:
+                # Only the interleave of TFRecord files uses these settings
+                cycle_length = default_config.cycle_length
+                buffer_size = default_config.read_buffer_size
+            calibrated['cycle_length'] = cycle_length
+            calibrated['read_buffer_size'] = buffer_size
+
+        if settings['num_parallel_calls'] == input_tuning.AUTO:
+            if filenames:
+                examples = tf.data.TFRecordDataset(filenames[:1])
+            elif self.config.builder == 'tfds':
+                examples = self.load_tfds()
+            else:
+                examples = self.load_synthetic()
+            # Cache the probe examples so that reading is not the bottleneck
+            examples = examples.take(self.global_batch_size).cache().repeat()
+            calibrated['num_parallel_calls'] = (
+                input_tuning.calibrate_parallelism(
+                    examples,
+                    self.preprocess_fn,
+                    input_tuning.candidate_parallelism(cores),
+                    duration))
+
+        return calibrated
+
+    @property
+    def preprocess_fn(self) -> Callable[..., Tuple[tf.Tensor, tf.Tensor]]:
+        """The function parsing and preprocessing a single example."""
+        if self.config.builder == 'records':
+            return self.parse_record
+        elif self.config.builder == 'decoded_records':
+            return self.parse_decoded_record
+        else:
+            return self.preprocess
+
     def pipeline(self,
                  dataset: tf.data.Dataset,
                  input_context: tf.distribute.InputContext = None
@@ -357,43 +654,75 @@ class DatasetBuilder:
         Returns:
           A TensorFlow dataset outputting batched images and labels.
         """
-        if input_context and input_context.num_input_pipelines > 1:
+        # The indexed reader already shards, shuffles and repeats the records
+        indexed = self.config.use_record_index
+
+        if (input_context and input_context.num_input_pipelines > 1 and
+                not indexed):
             dataset = dataset.shard(input_context.num_input_pipelines,
                                     input_context.input_pipeline_id)
 
-        if self.is_training and not self.config.cache:
+        if self.is_training and not self.config.cache and not indexed:
             dataset = dataset.repeat()
 
-        if self.config.builder == 'records':
+        settings = self.pipeline_settings
+
+        if (self.config.builder in ('records', 'decoded_records') and
+                not indexed):
+            cache = self.shared_cache
+            if cache:
+                # Read the files from their copy in the host cache
+                def fetch(name):
+                    path = tf.numpy_function(cache.fetch, [name], tf.string)
+                    path.set_shape([])
+                    return path
+
+                dataset = dataset.map(
+                    fetch, num_parallel_calls=settings['cycle_length'])
+
             # Read the data from disk in parallel
-            buffer_size = 8 * 1024 * 1024  # Use 8 MiB per file
+            buffer_size = settings['read_buffer_size']
             dataset = dataset.interleave(
                 lambda name: tf.data.TFRecordDataset(name, buffer_size=buffer_size),
-                cycle_length=16,
+                cycle_length=settings['cycle_length'],
                 num_parallel_calls=tf.data.experimental.AUTOTUNE)
 
-        dataset = dataset.prefetch(self.global_batch_size)
+        dataset = dataset.prefetch(self.config.prefetch_buffer_size or
+                                   self.global_batch_size)
 
         if self.config.cache:
             dataset = dataset.cache()
 
-        if self.is_training:
+        if self.is_training and not indexed:
             dataset = dataset.shuffle(self.config.shuffle_buffer_size)
             dataset = dataset.repeat()
 
         # Parse, pre-process, and batch the data in parallel
-        if self.config.builder == 'records':
-            preprocess = self.parse_record
+        if self.config.builder in ('records', 'decoded_records'):
+            # Parse batches of records at once, which is much cheaper
+            dataset = dataset.batch(self.batch_size)
+            if self.use_fixed_crops:
+                def parse(records, keys):
+                    return self.parse_examples(records), keys
+            else:
+                parse = self.parse_examples
+            dataset = dataset.map(parse,
+                                  num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            dataset = dataset.unbatch()
+            preprocess = self.preprocess_parsed
         else:
-            preprocess = self.preprocess
+            preprocess = self.preprocess_fn
         dataset = dataset.map(preprocess,
-                              num_parallel_calls=tf.data.experimental.AUTOTUNE)
+                              num_parallel_calls=settings['num_parallel_calls'])
 
         dataset = dataset.batch(self.batch_size, drop_remainder=self.is_training)
 
-        # Note: we could do image normalization here, but we defer it to the model
-        # which can perform it much faster on a GPU/TPU
-        # TODO(dankondratyuk): if we fix prefetching, we can do it here
+        if self.use_batched_augment:
+            dataset = dataset.map(self.augment_batch,
+                                  num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+        # Note: with `normalize_in_model`, image normalization is deferred to
+        # the model which can perform it much faster on a GPU/TPU
 
         if self.is_training and self.config.deterministic_train is not None:
             options = tf.data.Options()
@@ -412,69 +741,205 @@ class DatasetBuilder:
 
         return dataset
 
+    @property
+    def parse_bounding_boxes(self) -> bool:
+        """Whether the bounding boxes of the records are parsed."""
+        return (self.config.use_bounding_boxes and self.is_training and
+                self.config.builder in ('records', 'decoded_records'))
+
+    @property
+    def record_features(self) -> Mapping[str, Any]:
+        """The features parsed from the records of the builder.
+
+        Only the features used by the preprocessing are parsed. The bounding
+        boxes, the most costly ones, are parsed only if the crop uses them.
+        """
+        if self.config.builder == 'decoded_records':
+            keys_to_features = {
+                'image/decoded':
+                    tf.io.FixedLenFeature((), tf.string, ''),
+                'image/height':
+                    tf.io.FixedLenFeature([], tf.int64, 0),
+                'image/width':
+                    tf.io.FixedLenFeature([], tf.int64, 0),
+                'image/class/label':
+                    tf.io.FixedLenFeature([], tf.int64, -1),
+            }
+        else:
+            keys_to_features = {
+                'image/encoded':
+                    tf.io.FixedLenFeature((), tf.string, ''),
+                'image/class/label':
+                    tf.io.FixedLenFeature([], tf.int64, -1),
+            }
+        if self.parse_bounding_boxes:
+            for key in BBOX_KEYS:
+                keys_to_features[key] = tf.io.VarLenFeature(dtype=tf.float32)
+        return keys_to_features
+
     def parse_record(self, record: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
         """Parse an ImageNet record from a serialized string Tensor."""
-        keys_to_features = {
-            'image/encoded':
-                tf.io.FixedLenFeature((), tf.string, ''),
-            'image/format':
-                tf.io.FixedLenFeature((), tf.string, 'jpeg'),
-            'image/class/label':
-                tf.io.FixedLenFeature([], tf.int64, -1),
-            'image/class/text':
-                tf.io.FixedLenFeature([], tf.string, ''),
-            'image/object/bbox/xmin':
-                tf.io.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/ymin':
-                tf.io.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/xmax':
-                tf.io.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/ymax':
-                tf.io.VarLenFeature(dtype=tf.float32),
-            'image/object/class/label':
-                tf.io.VarLenFeature(dtype=tf.int64),
-        }
+        return self.preprocess(*self.parse_example(record))
+
+    def parse_example(self, record: tf.Tensor) -> Tuple[tf.Tensor, ...]:
+        """Parse the encoded image and the label of an ImageNet record.
+
+        The bounding boxes are also returned if `parse_bounding_boxes`.
+        """
+        parsed = tf.io.parse_single_example(record, self.record_features)
+        return self.record_inputs(parsed)
+
+    def parse_decoded_record(self, record: tf.Tensor
+                             ) -> Tuple[tf.Tensor, tf.Tensor]:
+        """Parse a record of raw uint8 pixels from a serialized string Tensor.
+
+        The records are written by `imagenet/materialize_decoded_records.py`, so
+        the image only needs to be cropped (and flipped when training).
+        """
+        return self.preprocess(*self.parse_decoded_example(record))
+
+    def parse_decoded_example(self, record: tf.Tensor
+                              ) -> Tuple[tf.Tensor, ...]:
+        """Parse the uint8 image and the label of a serialized decoded record.
 
-        parsed = tf.io.parse_single_example(record, keys_to_features)
+        The bounding boxes are also returned if `parse_bounding_boxes`.
+        """
+        parsed = tf.io.parse_single_example(record, self.record_features)
+        return self.record_inputs(parsed)
+
+    def parse_examples(self, records: tf.Tensor) -> Mapping[str, tf.Tensor]:
+        """Parse the features of a batch of serialized records at once.
+
+        This is much cheaper than parsing the records one by one. The features
+        of each example are then passed to `preprocess_parsed`.
+        """
+        return tf.io.parse_example(records, self.record_features)
+
+    def preprocess_parsed(self, parsed: Mapping[str, tf.Tensor],
+                          key: Optional[tf.Tensor] = None
+                          ) -> Tuple[tf.Tensor, ...]:
+        """Preprocess the parsed features of a single record."""
+        return self.preprocess(*self.record_inputs(parsed), key=key)
 
+    def record_inputs(self, parsed: Mapping[str, tf.Tensor]
+                      ) -> Tuple[tf.Tensor, ...]:
+        """Returns the inputs of `preprocess` from the features of a record."""
         label = tf.reshape(parsed['image/class/label'], shape=[1])
         label = tf.cast(label, dtype=tf.int32)
 
         # Subtract one so that labels are in [0, 1000)
         label -= 1
 
-        image_bytes = tf.reshape(parsed['image/encoded'], shape=[])
-        image, label = self.preprocess(image_bytes, label)
+        if self.config.builder == 'decoded_records':
+            height = tf.cast(parsed['image/height'], tf.int32)
+            width = tf.cast(parsed['image/width'], tf.int32)
+            image = tf.io.decode_raw(parsed['image/decoded'], tf.uint8)
+            image = tf.reshape(image, [height, width, 3])
+        else:
+            image = tf.reshape(parsed['image/encoded'], shape=[])
+        if not self.parse_bounding_boxes:
+            return image, label
 
-        return image, label
+        # Arrange the boxes as [1, num_boxes, (ymin, xmin, ymax, xmax)]
+        ymin, xmin, ymax, xmax = [parsed[key].values for key in BBOX_KEYS]
+        bbox = tf.expand_dims(tf.stack([ymin, xmin, ymax, xmax], axis=1), 0)
+        return image, label, bbox
+
+    def preprocess(self,
+                   image: tf.Tensor,
+                   label: tf.Tensor,
+                   bbox: Optional[tf.Tensor] = None,
+                   key: Optional[tf.Tensor] = None
+                   ) -> Tuple[tf.Tensor, ...]:
+        """Apply image preprocessing and augmentation to the image and label.
+
+        Args:
+          image: the encoded or decoded image.
+          label: the label of the image.
+          bbox: optional bounding boxes of the objects in the image, arranged
+            [1, num_boxes, (ymin, xmin, ymax, xmax)] in relative coordinates.
+            The random crop of training images overlaps with them.
+          key: the (record, epoch) key of the record with `fixed_crops`, whose
+            fixed crop is used instead of a random one.
+
+        Returns:
+          The preprocessed image and label, and the (record, crop) key if
+          `key` is given.
+        """
+        seed = None
+        if key is not None:
+            seed = tf.stack([key[0], key[1] % self.config.fixed_crops])
+        if self.config.normalize_in_model:
+            # The model normalizes and casts the uint8 images
+            mean_subtract, standardize, dtype = False, False, None
+        else:
+            mean_subtract = self.config.mean_subtract
+            standardize = self.config.standardize
+            dtype = self.dtype
 
-    def preprocess(self, image: tf.Tensor, label: tf.Tensor
-                   ) -> Tuple[tf.Tensor, tf.Tensor]:
-        """Apply image preprocessing and augmentation to the image and label."""
         if self.is_training:
+            if self.use_batched_augment:
+                # Augmentation and dtype conversion happen in `augment_batch`
+                augmenter, dtype = None, None
+            else:
+                augmenter = self.augmenter
             image = preprocessing.preprocess_for_train(
                 image,
                 image_size=self.image_size,
-                mean_subtract=self.config.mean_subtract,
-                standardize=self.config.standardize,
-                dtype=self.dtype,
-                augmenter=self.augmenter)
+                mean_subtract=mean_subtract,
+                standardize=standardize,
+                dtype=dtype,
+                augmenter=augmenter,
+                bbox=bbox,
+                seed=seed)
         else:
             image = preprocessing.preprocess_for_eval(
                 image,
                 image_size=self.image_size,
                 num_channels=self.num_channels,
-                mean_subtract=self.config.mean_subtract,
-                standardize=self.config.standardize,
-                dtype=self.dtype)
+                mean_subtract=mean_subtract,
+                standardize=standardize,
+                dtype=dtype)
+
+        if self.config.normalize_in_model:
+            image = preprocessing.to_uint8(image)
 
         label = tf.cast(label, tf.int32)
         if self.config.one_hot:
             label = tf.one_hot(label, self.num_classes)
             label = tf.reshape(label, [self.num_classes])
 
+        if seed is not None:
+            return image, label, seed
         return image, label
 
+    def preprocess_cached(self, images: tf.Tensor, labels: tf.Tensor
+                          ) -> Tuple[tf.Tensor, tf.Tensor]:
+        """Normalize a batch of cached evaluation images like `preprocess`."""
+        if not self.config.normalize_in_model:
+            images = preprocessing.normalize_images(
+                tf.cast(images, tf.float32),
+                mean_rgb=(preprocessing.MEAN_RGB
+                          if self.config.mean_subtract else None),
+                stddev_rgb=(preprocessing.STDDEV_RGB
+                            if self.config.standardize else None),
+                num_channels=self.num_channels,
+                dtype=None)
+            images = tf.image.convert_image_dtype(images, self.dtype)
+
+        if self.config.one_hot:
+            labels = tf.one_hot(labels, self.num_classes)
+            labels = tf.reshape(labels, [-1, self.num_classes])
+        return images, labels
+
+    def augment_batch(self, images: tf.Tensor, labels: tf.Tensor,
+                      *keys: tf.Tensor) -> Tuple[tf.Tensor, ...]:
+        """Apply the augmenter to a batch of preprocessed training images."""
+        images = self.augmenter.distort_batch(images)
+        if not self.config.normalize_in_model:
+            images = tf.image.convert_image_dtype(images, self.dtype)
+        return (images, labels) + keys
+
     @classmethod
     def from_params(cls, *args, **kwargs):
         """Construct a dataset builder from a default config and any overrides."""
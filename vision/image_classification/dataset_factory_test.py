@@ -0,0 +1,104 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for dataset_factory."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from vision.image_classification import dataset_factory, test_utils
+
+# The boxes of each record, as (ymin, xmin, ymax, xmax)
+_BOXES = [
+    [],
+    [(0.1, 0.2, 0.3, 0.4)],
+    [(0.5, 0.5, 0.9, 0.9), (0.0, 0.0, 1.0, 1.0), (0.2, 0.1, 0.6, 0.7)],
+    [(0.3, 0.3, 0.4, 0.4)],
+]
+
+
+class DatasetFactoryTest(tf.test.TestCase):
+
+    def _write_records(self):
+        """Writes records of JPEG images with a different number of boxes."""
+        return test_utils.write_jpeg_records(
+            os.path.join(self.get_temp_dir(), 'train-00000'),
+            num_records=len(_BOXES),
+            bboxes=_BOXES)
+
+    def _builder(self, filenames, **kwargs):
+        params = dict(builder='records',
+                      filenames=filenames,
+                      split='train',
+                      image_size=32,
+                      num_classes=4,
+                      num_channels=3,
+                      num_examples=len(_BOXES),
+                      batch_size=len(_BOXES),
+                      one_hot=False)
+        params.update(kwargs)
+        return dataset_factory.DatasetBuilder(
+            dataset_factory.DatasetConfig(**params))
+
+    def test_batched_parse_keeps_the_boxes_of_each_example(self):
+        filenames = self._write_records()
+        builder = self._builder(filenames, use_bounding_boxes=True)
+
+        # The parsing of the pipeline, batched records then split again
+        dataset = tf.data.TFRecordDataset(filenames).batch(3)
+        dataset = dataset.map(builder.parse_examples).unbatch()
+        dataset = dataset.map(builder.record_inputs)
+
+        examples = list(dataset)
+        self.assertLen(examples, len(_BOXES))
+        for i, (image, label, bbox) in enumerate(examples):
+            self.assertEqual(tf.string, image.dtype)
+            self.assertAllEqual([i], label)
+            self.assertAllClose(
+                tf.reshape(tf.constant(_BOXES[i], tf.float32), [1, -1, 4]),
+                bbox)
+            # The same boxes as when parsing the record alone
+            _, _, expected_bbox = builder.parse_example(
+                next(iter(tf.data.TFRecordDataset(filenames).skip(i))))
+            self.assertAllClose(expected_bbox, bbox)
+
+        images, labels = next(iter(builder.build()))
+        self.assertAllEqual([len(_BOXES), 32, 32, 3], images.shape)
+        self.assertAllEqual([len(_BOXES), 1], labels.shape)
+
+    def test_minimal_record_features(self):
+        builder = self._builder(['not_read'])
+
+        self.assertEqual({'image/encoded', 'image/class/label'},
+                         set(builder.record_features))
+        self.assertFalse(builder.parse_bounding_boxes)
+
+        # Boxes are only parsed for training
+        builder = self._builder(['not_read'], use_bounding_boxes=True)
+        self.assertEqual(
+            {'image/encoded', 'image/class/label'} |
+            set(dataset_factory.BBOX_KEYS),
+            set(builder.record_features))
+        builder = self._builder(['not_read'], use_bounding_boxes=True,
+                                split='validation')
+        self.assertEqual({'image/encoded', 'image/class/label'},
+                         set(builder.record_features))
+
+    def test_parsed_features_skip_text_and_boxes(self):
+        filenames = self._write_records()
+        builder = self._builder(filenames)
+
+        records = tf.data.TFRecordDataset(filenames).batch(len(_BOXES))
+        parsed = builder.parse_examples(next(iter(records)))
+
+        self.assertEqual({'image/encoded', 'image/class/label'}, set(parsed))
+        self.assertLen(builder.parse_example(next(iter(
+            tf.data.TFRecordDataset(filenames)))), 2)
+
+
+if __name__ == '__main__':
+    tf.test.main()
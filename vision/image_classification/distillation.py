@@ -0,0 +1,255 @@
+# Lint as: python3
+# ==============================================================================
+"""Knowledge distillation of a frozen teacher into a smaller classifier.
+
+The student is trained on the labels and on the soft targets of the teacher,
+its class probabilities at a high softmax temperature (Hinton et al. 2015):
+
+  loss = (1 - alpha) * label_loss + alpha * T^2 * KL(teacher_T || student_T)
+
+The classifiers output probabilities, so their log is used as logits: it only
+differs from the logits by a constant per image, which the softmax ignores.
+
+The teacher forward pass costs more than the student's. `TeacherCache` instead
+stores the teacher logits of a few fixed crops per training image (see
+`DatasetConfig.fixed_crops`), computed once, and the training dataset reads
+them from disk by (record, crop) key.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import json
+import os
+from typing import Any, Callable, List, Mapping, Optional
+
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+from vision.image_classification import dataset_factory, record_index
+
+# The clipping of probabilities before their log, as in the Keras losses
+EPSILON = 1e-7
+
+
+def log_probabilities(probabilities: tf.Tensor) -> tf.Tensor:
+    """Returns the log of class probabilities, usable as logits."""
+    return tf.math.log(tf.clip_by_value(probabilities, EPSILON, 1.))
+
+
+def soft_target_loss(teacher_logits: tf.Tensor,
+                     student_logits: tf.Tensor,
+                     temperature: float) -> tf.Tensor:
+    """Returns the distillation loss of a batch.
+
+    Args:
+      teacher_logits: the logits of the teacher, [batch_size, num_classes].
+      student_logits: the logits of the student, [batch_size, num_classes].
+      temperature: the softmax temperature of both distributions.
+
+    Returns:
+      The mean KL divergence from the teacher to the student distribution,
+      scaled by the squared temperature so that its gradients keep the scale
+      of the label loss.
+    """
+    teacher_log_probs = tf.nn.log_softmax(teacher_logits / temperature)
+    student_log_probs = tf.nn.log_softmax(student_logits / temperature)
+    divergence = tf.reduce_sum(
+        tf.exp(teacher_log_probs) * (teacher_log_probs - student_log_probs),
+        axis=-1)
+    return tf.reduce_mean(divergence) * temperature ** 2
+
+
+class DistillationModel(tf.keras.Model):
+    """A student classifier trained on the soft targets of a teacher.
+
+    The model has the layers, and so the checkpoints, of the student. It
+    trains on batches of images and labels, or of images, labels and teacher
+    logits (see `TeacherCache.attach`). Evaluation and prediction only run the
+    student, and the reported loss is the label loss.
+    """
+
+    def __init__(self,
+                 student: tf.keras.Model,
+                 teacher_fn: Optional[Callable[[tf.Tensor], tf.Tensor]] = None,
+                 temperature: float = 4.,
+                 alpha: float = 0.9):
+        """Initializes the model.
+
+        Args:
+          student: a functional Keras model outputting class probabilities.
+          teacher_fn: maps a batch of images to the teacher logits, for the
+            batches without them. A function rather than a model, so that the
+            teacher is not part of the student checkpoints.
+          temperature: the softmax temperature of the soft targets.
+          alpha: the weight of the soft target loss.
+        """
+        super(DistillationModel, self).__init__(student.inputs,
+                                                student.outputs,
+                                                name=student.name)
+        self.teacher_fn = teacher_fn
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def train_step(self, data):
+        if len(data) == 3:
+            images, labels, teacher_logits = data
+        else:
+            images, labels = data
+            teacher_logits = self.teacher_fn(images)
+        teacher_logits = tf.stop_gradient(tf.cast(teacher_logits, tf.float32))
+
+        optimizer = self.optimizer
+        scale_loss = isinstance(
+            optimizer, tf.keras.mixed_precision.experimental.LossScaleOptimizer)
+        num_replicas = self.distribute_strategy.num_replicas_in_sync
+        with tf.GradientTape() as tape:
+            probabilities = self(images, training=True)
+            # Already scaled by the number of replicas
+            label_loss = self.compiled_loss(labels, probabilities)
+            soft_loss = soft_target_loss(teacher_logits,
+                                         log_probabilities(probabilities),
+                                         self.temperature) / num_replicas
+            loss = (1. - self.alpha) * label_loss + self.alpha * soft_loss
+            if self.losses:
+                loss += tf.add_n(self.losses) / num_replicas
+            if scale_loss:
+                loss = optimizer.get_scaled_loss(loss)
+        gradients = tape.gradient(loss, self.trainable_variables)
+        if scale_loss:
+            gradients = optimizer.get_unscaled_gradients(gradients)
+        optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+
+        self.compiled_metrics.update_state(labels, probabilities)
+        return {metric.name: metric.result() for metric in self.metrics}
+
+
+class TeacherCache(object):
+    """The teacher logits of the fixed crops of the training images.
+
+    The logits of crop `c` of all the training records are stored as a float16
+    array of shape [num_records, num_classes] in `crop-<c>.npy`, written once
+    to a temporary file then renamed, and memory mapped when read. The cache
+    is keyed by a description of the teacher and the images, and refuses to
+    mix logits of different ones.
+    """
+
+    def __init__(self,
+                 cache_dir: str,
+                 num_records: int,
+                 num_classes: int,
+                 num_crops: int,
+                 description: Optional[Mapping[str, Any]] = None):
+        """Opens or creates the cache.
+
+        Args:
+          cache_dir: a local directory.
+          num_records: the number of training records.
+          num_classes: the number of classes.
+          num_crops: the number of fixed crops per record.
+          description: a JSON serializable description of the teacher and the
+            preprocessing, e.g. their checkpoint and image size.
+        """
+        self.cache_dir = cache_dir
+        self.num_records = num_records
+        self.num_classes = num_classes
+        self.num_crops = num_crops
+        self._logits = {}
+
+        metadata = {
+            'num_records': num_records,
+            'num_classes': num_classes,
+            'description': description or {},
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+        metadata_path = os.path.join(cache_dir, 'cache.json')
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                cached_metadata = json.load(f)
+            if cached_metadata != json.loads(json.dumps(metadata)):
+                raise ValueError(
+                    'The teacher cache {} holds the logits of {}, not {}. '
+                    'Delete it or use another directory.'.format(
+                        cache_dir, cached_metadata, metadata))
+        else:
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f)
+
+    def _path(self, crop: int) -> str:
+        return os.path.join(self.cache_dir, 'crop-{:04d}.npy'.format(crop))
+
+    def missing_crops(self) -> List[int]:
+        """The crops whose logits are not cached yet."""
+        return [crop for crop in range(self.num_crops)
+                if not os.path.exists(self._path(crop))]
+
+    def fill(self,
+             teacher_fn: Callable[[tf.Tensor], tf.Tensor],
+             builder: dataset_factory.DatasetBuilder):
+        """Computes and writes the logits of the missing crops.
+
+        Args:
+          teacher_fn: maps a batch of images to the teacher logits.
+          builder: the training dataset builder, with `use_record_index` and
+            `fixed_crops`. Its augmenter is not applied to the teacher images.
+        """
+        crops = self.missing_crops()
+        if not crops:
+            return
+        if not builder.use_fixed_crops or not builder.config.use_record_index:
+            raise ValueError('The teacher cache requires fixed_crops and '
+                             'use_record_index.')
+        builder = dataset_factory.DatasetBuilder(builder.config,
+                                                 augmenter={'name': None})
+        index = record_index.RecordIndex(builder.config.filenames or
+                                         builder.record_filenames())
+        if index.num_records != self.num_records:
+            raise ValueError('The cache has {} records, the dataset {}.'.format(
+                self.num_records, index.num_records))
+
+        predict_fn = tf.function(teacher_fn)
+        for crop in crops:
+            logging.info('Caching the teacher logits of crop %d of %d.',
+                         crop + 1, self.num_crops)
+            # The records of epoch `crop` in order, which all use that crop
+            dataset = index.dataset(start_offset=crop * self.num_records,
+                                    with_keys=True)
+            dataset = dataset.map(
+                lambda record, key: builder.preprocess(
+                    *builder.parse_example(record), key=key),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            dataset = dataset.batch(builder.batch_size)
+            dataset = dataset.prefetch(1)
+
+            path = self._path(crop)
+            temp_path = path + '.tmp.npy'
+            logits = np.lib.format.open_memmap(
+                temp_path, mode='w+', dtype=np.float16,
+                shape=(self.num_records, self.num_classes))
+            for images, _, keys in dataset:
+                logits[keys[:, 0].numpy()] = predict_fn(images).numpy()
+            logits.flush()
+            del logits
+            os.replace(temp_path, path)
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Returns the cached logits of a batch of (record, crop) keys."""
+        logits = np.empty((len(keys), self.num_classes), dtype=np.float16)
+        for i, (record, crop) in enumerate(keys):
+            if crop not in self._logits:
+                self._logits[crop] = np.load(self._path(crop), mmap_mode='r')
+            logits[i] = self._logits[crop][record]
+        return logits
+
+    def attach(self, dataset: tf.data.Dataset) -> tf.data.Dataset:
+        """Replaces the keys of a training dataset by the cached logits."""
+
+        def add_logits(images, labels, keys):
+            logits = tf.numpy_function(self.lookup, [keys], tf.float16)
+            logits.set_shape([keys.shape[0], self.num_classes])
+            return images, labels, logits
+
+        return dataset.map(add_logits,
+                           num_parallel_calls=tf.data.experimental.AUTOTUNE)
@@ -0,0 +1,105 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for distillation."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from vision.image_classification import dataset_factory, distillation, test_utils
+
+
+class DistillationTest(tf.test.TestCase):
+
+    def test_soft_target_loss(self):
+        logits = tf.random.normal((8, 10))
+
+        self.assertAllClose(0., distillation.soft_target_loss(
+            logits, logits, temperature=4.), atol=1e-6)
+        self.assertGreater(distillation.soft_target_loss(
+            logits, -logits, temperature=4.), 0.)
+
+    def test_distillation_model(self):
+        student = test_utils.small_classifier(num_classes=4,
+                                              image_size=32,
+                                              num_filters=4)
+        teacher = test_utils.small_classifier(num_classes=4,
+                                              image_size=32,
+                                              num_filters=4)
+        model = distillation.DistillationModel(
+            student,
+            teacher_fn=lambda images: distillation.log_probabilities(
+                teacher(images, training=False)),
+            temperature=2.,
+            alpha=0.5)
+        model.compile(optimizer='sgd',
+                      loss='sparse_categorical_crossentropy',
+                      metrics=['accuracy'])
+        images = tf.random.uniform((8, 32, 32, 3))
+        labels = tf.random.uniform((8, 1), maxval=4, dtype=tf.int32)
+        logits = tf.random.normal((8, 4))
+
+        history = model.fit(
+            tf.data.Dataset.from_tensors((images, labels)).repeat(2))
+        self.assertIn('accuracy', history.history)
+        history = model.fit(
+            tf.data.Dataset.from_tensors((images, labels, logits)).repeat(2))
+        self.assertIn('loss', history.history)
+
+        # The checkpoints are those of the student
+        checkpoint = os.path.join(self.get_temp_dir(), 'model.ckpt')
+        model.save_weights(checkpoint)
+        restored = test_utils.small_classifier(num_classes=4,
+                                               image_size=32,
+                                               num_filters=4)
+        restored.load_weights(checkpoint)
+        self.assertAllClose(student(images), restored(images))
+
+    def test_teacher_cache(self):
+        config = dataset_factory.DatasetConfig(
+            builder='records',
+            filenames=test_utils.write_jpeg_records(
+                os.path.join(self.get_temp_dir(), 'train-00000'),
+                num_records=6),
+            split='train',
+            image_size=32,
+            num_classes=4,
+            num_channels=3,
+            num_examples=6,
+            batch_size=2,
+            use_per_replica_batch_size=False,
+            one_hot=False,
+            use_record_index=True,
+            fixed_crops=2)
+        builder = dataset_factory.DatasetBuilder(config)
+        teacher = test_utils.small_classifier(num_classes=4,
+                                              image_size=32,
+                                              num_filters=4)
+
+        def teacher_fn(images):
+            return distillation.log_probabilities(
+                teacher(images, training=False))
+
+        cache = distillation.TeacherCache(
+            os.path.join(self.get_temp_dir(), 'cache'),
+            num_records=6, num_classes=4, num_crops=2)
+        cache.fill(teacher_fn, builder)
+        self.assertEmpty(cache.missing_crops())
+
+        # The crops are the same as when the cache was filled
+        for images, _, logits in cache.attach(builder.build()).take(6):
+            self.assertAllClose(teacher_fn(images), logits, atol=1e-2)
+
+        with self.assertRaises(ValueError):
+            distillation.TeacherCache(
+                os.path.join(self.get_temp_dir(), 'cache'),
+                num_records=6, num_classes=4, num_crops=2,
+                description={'teacher_checkpoint': 'other'})
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,123 @@
+# Lint as: python3
+# ==============================================================================
+"""A local cache of the preprocessed evaluation images.
+
+The evaluation preprocessing, decoding, center cropping and resizing, is
+deterministic, yet it is redone on every evaluation, which is then bound by
+the host CPUs. `EvalTensorCache` instead writes the preprocessed uint8 images
+and their labels to a local file once, and the next evaluations stream them
+with no decoding: each example is a fixed length record of the raw image
+bytes followed by the int32 label.
+
+The cache directory holds one file per description of the source data and of
+the preprocessing, e.g. the image size and the crop padding, so that the
+validation images of several image sizes can be cached side by side. A file is
+written under a temporary name then renamed, so a partially written file is
+never read.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+from typing import Any, Mapping, Optional, Tuple
+
+from absl import logging
+import tensorflow as tf
+
+_LABEL_BYTES = 4
+_READ_BUFFER_BYTES = 8 * 1024 * 1024
+
+
+class EvalTensorCache(object):
+    """The preprocessed uint8 images and labels of an evaluation dataset."""
+
+    def __init__(self,
+                 cache_dir: str,
+                 image_shape: Tuple[int, int, int],
+                 description: Optional[Mapping[str, Any]] = None):
+        """Opens the cache of the described images, which may not exist yet.
+
+        Args:
+          cache_dir: a local directory.
+          image_shape: the [height, width, channels] of the cached images.
+          description: a JSON serializable description of the source images
+            and of their preprocessing, e.g. their files and image size.
+        """
+        self.image_shape = tuple(int(size) for size in image_shape)
+        self.image_bytes = (self.image_shape[0] * self.image_shape[1] *
+                            self.image_shape[2])
+        self.record_bytes = self.image_bytes + _LABEL_BYTES
+        self.metadata = {
+            'image_shape': list(self.image_shape),
+            'description': description or {},
+        }
+        key = json.dumps(self.metadata, sort_keys=True)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, 'eval-{}.bin'.format(digest))
+        self.metadata_path = os.path.join(cache_dir,
+                                          'eval-{}.json'.format(digest))
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def is_filled(self) -> bool:
+        """Whether the images are cached."""
+        return (os.path.exists(self.path) and
+                os.path.exists(self.metadata_path))
+
+    @property
+    def num_examples(self) -> int:
+        """The number of cached examples."""
+        return os.path.getsize(self.path) // self.record_bytes
+
+    def fill(self, dataset: tf.data.Dataset):
+        """Writes the examples of a dataset to the cache.
+
+        Args:
+          dataset: a finite dataset of batches of uint8 images of
+            `image_shape` and their int32 labels, of shape [batch_size, 1].
+        """
+        logging.info('Caching the preprocessed evaluation images in %s.',
+                     self.path)
+        # Each process writes its own temporary file, the last rename wins
+        temp_path = '{}.tmp-{}'.format(self.path, os.getpid())
+        num_examples = 0
+        with open(temp_path, 'wb') as f:
+            for images, labels in dataset:
+                images = images.numpy()
+                labels = labels.numpy().astype('<i4')
+                if images.shape[1:] != self.image_shape:
+                    raise ValueError('Expected images of shape {}, got {}.'.format(
+                        self.image_shape, images.shape[1:]))
+                for image, label in zip(images, labels):
+                    f.write(image.tobytes())
+                    f.write(label.tobytes())
+                num_examples += len(images)
+        os.replace(temp_path, self.path)
+
+        metadata = dict(self.metadata, num_examples=num_examples)
+        with open(temp_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(temp_path, self.metadata_path)
+        logging.info('Cached %d evaluation images.', num_examples)
+
+    def dataset(self) -> tf.data.Dataset:
+        """Returns a dataset of the serialized cached examples."""
+        if not self.is_filled:
+            raise ValueError('The evaluation cache {} is not filled.'.format(
+                self.path))
+        return tf.data.FixedLengthRecordDataset(
+            self.path, self.record_bytes, buffer_size=_READ_BUFFER_BYTES)
+
+    def decode(self, records: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+        """Returns the uint8 images and int32 labels of a batch of records."""
+        images = tf.io.decode_raw(
+            tf.strings.substr(records, 0, self.image_bytes), tf.uint8)
+        images = tf.reshape(images, (-1,) + self.image_shape)
+        labels = tf.io.decode_raw(
+            tf.strings.substr(records, self.image_bytes, _LABEL_BYTES),
+            tf.int32, little_endian=True)
+        return images, labels
@@ -0,0 +1,99 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for eval_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from vision.image_classification import dataset_factory, eval_cache, test_utils
+
+
+class EvalTensorCacheTest(tf.test.TestCase):
+
+    def _config(self, filenames, **kwargs) -> dataset_factory.DatasetConfig:
+        params = dict(builder='records',
+                      filenames=filenames,
+                      split='validation',
+                      image_size=32,
+                      num_classes=4,
+                      num_channels=3,
+                      num_examples=10,
+                      batch_size=4,
+                      one_hot=False)
+        params.update(kwargs)
+        return dataset_factory.DatasetConfig(**params)
+
+    def test_cache_round_trip(self):
+        cache = eval_cache.EvalTensorCache(
+            os.path.join(self.get_temp_dir(), 'cache'), image_shape=(2, 2, 3))
+        images = tf.random.uniform((5, 2, 2, 3), maxval=256, dtype=tf.int32)
+        images = tf.cast(images, tf.uint8)
+        labels = tf.constant([[0], [1], [999], [3], [4]], dtype=tf.int32)
+
+        self.assertFalse(cache.is_filled)
+        cache.fill(tf.data.Dataset.from_tensor_slices(
+            (images, labels)).batch(2))
+        self.assertTrue(cache.is_filled)
+        self.assertEqual(5, cache.num_examples)
+
+        cached_images, cached_labels = cache.decode(
+            next(iter(cache.dataset().batch(5))))
+        self.assertAllEqual(images, cached_images)
+        self.assertAllEqual(labels, cached_labels)
+
+    def test_cached_dataset_matches_preprocessing(self):
+        filenames = test_utils.write_jpeg_records(
+            os.path.join(self.get_temp_dir(), 'validation-00000'),
+            num_records=10)
+        cache_dir = os.path.join(self.get_temp_dir(), 'cache')
+        config = self._config(filenames, normalize_in_model=True)
+        expected = list(dataset_factory.DatasetBuilder(config).build())
+
+        builder = dataset_factory.DatasetBuilder(config,
+                                                 eval_cache_dir=cache_dir)
+        self.assertFalse(builder.eval_tensor_cache.is_filled)
+        cached = list(builder.build())
+        self.assertTrue(builder.eval_tensor_cache.is_filled)
+
+        # Later builds read the cache only, not the records
+        os.remove(filenames[0])
+        reread = list(builder.build())
+        for batches in (cached, reread):
+            self.assertLen(batches, len(expected))
+            for (images, labels), (cached_images, cached_labels) in zip(
+                    expected, batches):
+                self.assertEqual(tf.uint8, cached_images.dtype)
+                self.assertAllEqual(images, cached_images)
+                self.assertAllEqual(labels, cached_labels)
+
+        # The float images are normalized after reading
+        builder = dataset_factory.DatasetBuilder(
+            config, eval_cache_dir=cache_dir, normalize_in_model=False,
+            mean_subtract=True, one_hot=True)
+        images, labels = next(iter(builder.build()))
+        self.assertEqual(tf.float32, images.dtype)
+        self.assertAllEqual([4, 32, 32, 3], images.shape)
+        self.assertAllEqual([4, 4], labels.shape)
+
+    def test_keyed_by_image_size(self):
+        filenames = ['validation-00000']
+        cache_dir = os.path.join(self.get_temp_dir(), 'cache')
+        small = dataset_factory.DatasetBuilder(
+            self._config(filenames, eval_cache_dir=cache_dir, image_size=32))
+        large = dataset_factory.DatasetBuilder(
+            self._config(filenames, eval_cache_dir=cache_dir, image_size=64))
+        train = dataset_factory.DatasetBuilder(
+            self._config(filenames, eval_cache_dir=cache_dir, split='train'))
+
+        self.assertNotEqual(small.eval_tensor_cache.path,
+                            large.eval_tensor_cache.path)
+        self.assertIsNone(train.eval_tensor_cache)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -25,6 +25,8 @@ import os
 from absl import logging
 import tensorflow as tf
 
+from vision.image_classification import preprocessing
+
 DEFAULT_IMAGE_SIZE = 224
 NUM_CHANNELS = 3
 NUM_CLASSES = 1001
@@ -269,7 +271,8 @@ def input_fn(is_training,
              drop_remainder=False,
              tf_data_experimental_slack=False,
              training_dataset_cache=False,
-             filenames=None):
+             filenames=None,
+             cycle_length=10):
     """Input function which provides batches for train or eval.
 
     Args:
@@ -289,6 +292,7 @@ def input_fn(is_training,
          Typically used to improve training performance when training data is in
          remote storage and can fit into worker memory.
       filenames: Optional field for providing the file names of the TFRecords.
+      cycle_length: The number of files read and deserialized in parallel.
 
     Returns:
       A dataset that can be used for iteration.
@@ -314,7 +318,7 @@ def input_fn(is_training,
     # CPU cores.
     dataset = dataset.interleave(
         tf.data.TFRecordDataset,
-        cycle_length=10,
+        cycle_length=cycle_length,
         num_parallel_calls=tf.data.experimental.AUTOTUNE)
 
     if is_training and training_dataset_cache:
@@ -354,34 +358,11 @@ def _decode_crop_and_flip(image_buffer, bbox, num_channels):
 
     """
     # A large fraction of image datasets contain a human-annotated bounding box
-    # delineating the region of the image containing the object of interest.  We
-    # choose to create a new bounding box for the object which is a randomly
-    # distorted version of the human-annotated bounding box that obeys an
-    # allowed range of aspect ratios, sizes and overlap with the human-annotated
-    # bounding box. If no box is supplied, then we assume the bounding box is
-    # the entire image.
-    sample_distorted_bounding_box = tf.image.sample_distorted_bounding_box(
-        tf.image.extract_jpeg_shape(image_buffer),
-        bounding_boxes=bbox,
-        min_object_covered=0.1,
-        aspect_ratio_range=[0.75, 1.33],
-        area_range=[0.05, 1.0],
-        max_attempts=100,
-        use_image_if_no_bounding_boxes=True)
-    bbox_begin, bbox_size, _ = sample_distorted_bounding_box
-
-    # Reassemble the bounding box in the format the crop op requires.
-    offset_y, offset_x, _ = tf.unstack(bbox_begin)
-    target_height, target_width, _ = tf.unstack(bbox_size)
-    crop_window = tf.stack([offset_y, offset_x, target_height, target_width])
-
-    # Use the fused decode and crop op here, which is faster than each in series.
-    cropped = tf.image.decode_and_crop_jpeg(
-        image_buffer, crop_window, channels=num_channels)
-
-    # Flip to add a little more random distortion in.
-    cropped = tf.image.random_flip_left_right(cropped)
-    return cropped
+    # delineating the region of the image containing the object of interest.
+    # The crop window is a randomly distorted version of it, see
+    # `preprocessing.distorted_crop`. If no box is supplied, then we assume the
+    # bounding box is the entire image.
+    return preprocessing.decode_crop_and_flip(image_buffer, bbox, num_channels)
 
 
 def _central_crop(image, crop_height, crop_width):
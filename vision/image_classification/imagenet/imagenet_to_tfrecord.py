@@ -16,26 +16,49 @@ run the following command:
 ```
 python imagenet_to_tfrecord.py \
   --raw_data_dir=/data/imagenet \
-  --local_scratch_dir=/data/imagenet/tfrecord
+  --local_scratch_dir=/data/imagenet/tfrecord \
+  --num_workers=32
 ```
 
+Finished shards are recorded in a manifest next to the split directories, e.g.
+/data/imagenet/tfrecord/train-manifest.json, with a hash of their input files.
+Shards that are listed there with the same input files and still match on disk
+are skipped when the script is run again.
+
 """
 
+import hashlib
+import json
 import math
+import multiprocessing
 import os
 import random
-from typing import Iterable, List, Mapping, Union, Tuple
+import struct
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union, Tuple
 from absl import app
 from absl import flags
 from absl import logging
 
 import tensorflow as tf
 
+from vision.image_classification import record_index
+
 flags.DEFINE_string(
     'raw_data_dir', '/data/imagenet', 'Directory path for raw Imagenet dataset.'
                                       'Should have train and validation subdirectories inside it.')
 flags.DEFINE_string(
     'local_scratch_dir', '/data/imagenet/tfrecord', 'Scratch directory path for temporary files.')
+flags.DEFINE_integer(
+    'num_workers', 1, 'Number of processes writing shards in parallel.')
+flags.DEFINE_string(
+    'bounding_box_file', None,
+    'Optional CSV file of the bounding boxes of the training images, with '
+    'lines `<image file name>,<xmin>,<ymin>,<xmax>,<ymax>` in relative '
+    'coordinates. The boxes are stored in the training records.')
+flags.DEFINE_bool(
+    'verify', False, 'Fully decode every image instead of only reading the '
+                     'dimensions from the JPEG header.')
 
 FLAGS = flags.FLAGS
 
@@ -47,6 +70,17 @@ VALIDATION_SHARDS = 128
 TRAINING_DIRECTORY = 'train'
 VALIDATION_DIRECTORY = 'validation'
 
+_JPEG_MAGIC = b'\xff\xd8'
+_PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+# Start of frame markers, which hold the image dimensions. 0xC4 (DHT), 0xC8
+# (JPG) and 0xCC (DAC) are in the same range but are not frame headers.
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length field.
+_STANDALONE_MARKERS = frozenset([0x01] + list(range(0xD0, 0xD8)))
+# Start of scan, followed by the compressed image data.
+_SOS_MARKER = 0xDA
+
 
 def _check_or_create_dir(directory: str):
     """Checks if directory exists otherwise creates it."""
@@ -61,6 +95,11 @@ def _int64_feature(value: Union[int, Iterable[int]]) -> tf.train.Feature:
     return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
 
 
+def _float_feature(value: Iterable[float]) -> tf.train.Feature:
+    """Inserts float features into Example proto."""
+    return tf.train.Feature(float_list=tf.train.FloatList(value=list(value)))
+
+
 def _bytes_feature(value: Union[bytes, str]) -> tf.train.Feature:
     """Inserts bytes features into Example proto."""
     if isinstance(value, str):
@@ -73,7 +112,9 @@ def _convert_to_example(filename: str,
                         label: int,
                         synset: str,
                         height: int,
-                        width: int) -> tf.train.Example:
+                        width: int,
+                        bboxes: Optional[List[List[float]]] = None
+                        ) -> tf.train.Example:
     """Builds an Example proto for an ImageNet example.
     Args:
       filename: string, path to an image file, e.g., '/path/to/example.JPG'
@@ -82,6 +123,8 @@ def _convert_to_example(filename: str,
       synset: string, unique WordNet ID specifying the label, e.g., 'n02323233'
       height: integer, image height in pixels
       width: integer, image width in pixels
+      bboxes: optional list of the bounding boxes of the image, each one a
+        list of [xmin, ymin, xmax, ymax] in relative coordinates.
     Returns:
       Example proto
     """
@@ -89,7 +132,7 @@ def _convert_to_example(filename: str,
     channels = 3
     image_format = 'JPEG'
 
-    example = tf.train.Example(features=tf.train.Features(feature={
+    feature = {
         'image/height': _int64_feature(height),
         'image/width': _int64_feature(width),
         'image/colorspace': _bytes_feature(colorspace),
@@ -98,10 +141,43 @@ def _convert_to_example(filename: str,
         'image/class/synset': _bytes_feature(synset),
         'image/format': _bytes_feature(image_format),
         'image/filename': _bytes_feature(os.path.basename(filename)),
-        'image/encoded': _bytes_feature(image_buffer)}))
+        'image/encoded': _bytes_feature(image_buffer)}
+    if bboxes:
+        xmin, ymin, xmax, ymax = zip(*bboxes)
+        feature.update({
+            'image/object/bbox/xmin': _float_feature(xmin),
+            'image/object/bbox/ymin': _float_feature(ymin),
+            'image/object/bbox/xmax': _float_feature(xmax),
+            'image/object/bbox/ymax': _float_feature(ymax),
+        })
+
+    example = tf.train.Example(features=tf.train.Features(feature=feature))
     return example
 
 
+def _load_bounding_boxes(bounding_box_file: str
+                         ) -> Dict[str, List[List[float]]]:
+    """Loads the bounding boxes of the training images.
+
+    Args:
+      bounding_box_file: string, path of a CSV file with lines
+        `<image file name>,<xmin>,<ymin>,<xmax>,<ymax>`, one per box.
+    Returns:
+      bboxes: map of image file name to the list of its boxes, each one a list
+        of [xmin, ymin, xmax, ymax].
+    """
+    bboxes = {}
+    with tf.io.gfile.GFile(bounding_box_file, 'r') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) != 5:
+                continue
+            bboxes.setdefault(parts[0], []).append(
+                [float(x) for x in parts[1:]])
+    logging.info('Loaded bounding boxes of %d images.', len(bboxes))
+    return bboxes
+
+
 def _is_png(filename: str) -> bool:
     """Determines if a file contains a PNG format image.
     Args:
@@ -136,22 +212,26 @@ class ImageCoder(object):
     """Helper class that provides TensorFlow image coding utilities."""
 
     def __init__(self):
-        # Create a single Session to run all image coding calls.
-        self._sess = tf.compat.v1.Session()
+        # Build the coding ops in a private graph, so that a coder can also be
+        # created in worker processes that run with eager execution.
+        graph = tf.Graph()
+        with graph.as_default():
+            # Initializes function that converts PNG to JPEG data.
+            self._png_data = tf.compat.v1.placeholder(dtype=tf.string)
+            image = tf.image.decode_png(self._png_data, channels=3)
+            self._png_to_jpeg = tf.image.encode_jpeg(image, format='rgb', quality=100)
+
+            # Initializes function that converts CMYK JPEG data to RGB JPEG data.
+            self._cmyk_data = tf.compat.v1.placeholder(dtype=tf.string)
+            image = tf.image.decode_jpeg(self._cmyk_data, channels=0)
+            self._cmyk_to_rgb = tf.image.encode_jpeg(image, format='rgb', quality=100)
+
+            # Initializes function that decodes RGB JPEG data.
+            self._decode_jpeg_data = tf.compat.v1.placeholder(dtype=tf.string)
+            self._decode_jpeg = tf.image.decode_jpeg(self._decode_jpeg_data, channels=3)
 
-        # Initializes function that converts PNG to JPEG data.
-        self._png_data = tf.compat.v1.placeholder(dtype=tf.string)
-        image = tf.image.decode_png(self._png_data, channels=3)
-        self._png_to_jpeg = tf.image.encode_jpeg(image, format='rgb', quality=100)
-
-        # Initializes function that converts CMYK JPEG data to RGB JPEG data.
-        self._cmyk_data = tf.compat.v1.placeholder(dtype=tf.string)
-        image = tf.image.decode_jpeg(self._cmyk_data, channels=0)
-        self._cmyk_to_rgb = tf.image.encode_jpeg(image, format='rgb', quality=100)
-
-        # Initializes function that decodes RGB JPEG data.
-        self._decode_jpeg_data = tf.compat.v1.placeholder(dtype=tf.string)
-        self._decode_jpeg = tf.image.decode_jpeg(self._decode_jpeg_data, channels=3)
+        # Create a single Session to run all image coding calls.
+        self._sess = tf.compat.v1.Session(graph=graph)
 
     def png_to_jpeg(self, image_data: bytes) -> tf.Tensor:
         """Converts a PNG compressed image to a JPEG Tensor."""
@@ -172,12 +252,63 @@ class ImageCoder(object):
         return image
 
 
+def _probe_jpeg(image_data: bytes) -> Optional[Tuple[int, int, int]]:
+    """Reads the image dimensions from the JPEG frame header.
+
+    Only the markers before the first scan are parsed, the compressed image
+    data is never decoded.
+
+    Args:
+      image_data: bytes, the contents of a JPEG file.
+    Returns:
+      height, width and number of color components of the image, or None if
+      `image_data` is not a JPEG with a readable frame header.
+    """
+    if not image_data.startswith(_JPEG_MAGIC):
+        return None
+
+    offset = len(_JPEG_MAGIC)
+    while offset + 4 <= len(image_data):
+        if image_data[offset] != 0xFF:
+            return None
+        marker = image_data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            offset += 1
+            continue
+        if marker in _STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in _SOF_MARKERS:
+            if offset + 10 > len(image_data):
+                return None
+            height, width = struct.unpack('>HH',
+                                          image_data[offset + 5:offset + 9])
+            components = image_data[offset + 9]
+            if height == 0 or width == 0:
+                return None
+            return height, width, components
+        if marker == _SOS_MARKER:
+            # Reached the image data without a frame header.
+            return None
+        segment_length = struct.unpack('>H', image_data[offset + 2:offset + 4])[0]
+        offset += 2 + segment_length
+    return None
+
+
 def _process_image(
-        filename: str, coder: ImageCoder) -> Tuple[str, int, int]:
+        filename: str,
+        coder: ImageCoder,
+        verify: bool = False) -> Tuple[str, int, int]:
     """Processes a single image file.
+
+    The image size is read from the JPEG header. Images are fully decoded only
+    if the header can not be read or if `verify` is set.
+
     Args:
       filename: string, path to an image file e.g., '/path/to/example.JPG'.
       coder: instance of ImageCoder to provide TensorFlow image coding utils.
+      verify: whether to decode every image to check that it is valid.
     Returns:
       image_buffer: string, JPEG encoding of RGB image.
       height: integer, image height in pixels.
@@ -188,23 +319,31 @@ def _process_image(
         image_data = f.read()
 
     # Clean the dirty data.
-    if _is_png(filename):
+    if _is_png(filename) or image_data.startswith(_PNG_MAGIC):
         # 1 image is a PNG.
         logging.info('Converting PNG to JPEG for %s', filename)
         image_data = coder.png_to_jpeg(image_data)
-    elif _is_cmyk(filename):
+
+    header = _probe_jpeg(image_data)
+    if _is_cmyk(filename) or (header is not None and header[2] == 4):
         # 22 JPEG images are in CMYK colorspace.
         logging.info('Converting CMYK to RGB for %s', filename)
         image_data = coder.cmyk_to_rgb(image_data)
+        header = _probe_jpeg(image_data)
 
-    # Decode the RGB JPEG.
-    image = coder.decode_jpeg(image_data)
+    if verify or header is None:
+        # Decode the RGB JPEG.
+        image = coder.decode_jpeg(image_data)
 
-    # Check that image converted to RGB
-    assert len(image.shape) == 3
-    height = image.shape[0]
-    width = image.shape[1]
-    assert image.shape[2] == 3
+        # Check that image converted to RGB
+        assert len(image.shape) == 3
+        height = image.shape[0]
+        width = image.shape[1]
+        assert image.shape[2] == 3
+    else:
+        height, width, components = header
+        # Grayscale images are converted to RGB when decoded with channels=3.
+        assert components in (1, 3)
 
     return image_data, height, width
 
@@ -214,7 +353,9 @@ def _process_image_files_batch(
         output_file: str,
         filenames: Iterable[str],
         synsets: Iterable[Union[str, bytes]],
-        labels: Mapping[str, int]):
+        labels: Mapping[str, int],
+        verify: bool = False,
+        bboxes: Optional[Iterable[List[List[float]]]] = None) -> List[int]:
     """Processes and saves a list of images as TFRecords.
     Args:
       coder: instance of ImageCoder to provide TensorFlow image coding utils.
@@ -222,17 +363,129 @@ def _process_image_files_batch(
       filenames: list of strings; each string is a path to an image file.
       synsets: list of strings; each string is a unique WordNet ID.
       labels: map of string to integer; id for all synset labels.
+      verify: whether to decode every image to check that it is valid.
+      bboxes: optional list of the bounding boxes of each image.
+    Returns:
+      offsets: list of the byte offsets of the records in the file.
     """
     writer = tf.io.TFRecordWriter(output_file)
+    offsets = []
+    offset = 0
+    if bboxes is None:
+        bboxes = [None] * len(filenames)
 
-    for filename, synset in zip(filenames, synsets):
-        image_buffer, height, width = _process_image(filename, coder)
+    for filename, synset, image_bboxes in zip(filenames, synsets, bboxes):
+        image_buffer, height, width = _process_image(filename, coder, verify)
         label = labels[synset]
         example = _convert_to_example(filename, image_buffer, label,
-                                      synset, height, width)
-        writer.write(example.SerializeToString())
+                                      synset, height, width, image_bboxes)
+        serialized = example.SerializeToString()
+        writer.write(serialized)
+        offsets.append(offset)
+        offset += record_index.record_size(len(serialized))
 
     writer.close()
+    return offsets
+
+
+# The ImageCoder of a worker process, created once by `_init_worker`.
+_worker_coder = None
+
+
+def _init_worker():
+    """Creates the ImageCoder shared by all shards of a worker process."""
+    global _worker_coder
+    _worker_coder = ImageCoder()
+
+
+def _process_shard(
+        shard: Tuple[str, List[str], List[Union[str, bytes]], Mapping[str, int],
+                     bool, Optional[List[List[List[float]]]]],
+        coder: ImageCoder = None) -> Tuple[str, int, int, float]:
+    """Writes a single shard of TFRecords.
+
+    The shard is written to a temporary file and renamed once complete, so an
+    interrupted run never leaves a truncated shard under the final name. The
+    record index file of the shard is written next to it.
+
+    Args:
+      shard: tuple of the output file, the image filenames, their synsets, the
+        map of synset labels, whether to verify the images and the optional
+        bounding boxes of the images.
+      coder: instance of ImageCoder. Defaults to the coder of the worker process.
+    Returns:
+      output_file: the path of the written shard.
+      num_records: number of records in the shard.
+      size: size of the shard in bytes.
+      elapsed: time in seconds spent writing the shard.
+    """
+    output_file, filenames, synsets, labels, verify, bboxes = shard
+    coder = coder or _worker_coder
+
+    start_time = time.time()
+    tmp_file = output_file + '.tmp'
+    offsets = _process_image_files_batch(coder, tmp_file, filenames, synsets,
+                                         labels, verify, bboxes)
+    tf.io.gfile.rename(tmp_file, output_file, overwrite=True)
+    record_index.write_index(output_file, offsets)
+    size = tf.io.gfile.stat(output_file).length
+
+    return output_file, len(filenames), size, time.time() - start_time
+
+
+def _load_manifest(manifest_file: str) -> Dict[str, Any]:
+    """Loads the manifest of completed shards, if it exists."""
+    if not tf.io.gfile.exists(manifest_file):
+        return {}
+    with tf.io.gfile.GFile(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest_file: str, manifest: Mapping[str, Any]):
+    """Atomically replaces the manifest of completed shards."""
+    tmp_file = manifest_file + '.tmp'
+    with tf.io.gfile.GFile(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    tf.io.gfile.rename(tmp_file, manifest_file, overwrite=True)
+
+
+def _inputs_hash(filenames: Iterable[str],
+                 synsets: Iterable[Union[str, bytes]],
+                 bboxes: Optional[Iterable[Optional[List[List[float]]]]] = None
+                 ) -> str:
+    """Hashes the ordered image file names, synsets and boxes of a shard.
+
+    Only the base names of the files are hashed, so that the raw data directory
+    can be moved without rewriting the shards. The boxes of an image are only
+    hashed when it has some, like they are only written then.
+    """
+    filenames = list(filenames)
+    if bboxes is None:
+        bboxes = [None] * len(filenames)
+    digest = hashlib.sha1()
+    for filename, synset, image_bboxes in zip(filenames, synsets, bboxes):
+        if isinstance(synset, bytes):
+            synset = synset.decode('utf-8')
+        line = '{}\t{}'.format(os.path.basename(filename), synset)
+        if image_bboxes:
+            line += '\t' + json.dumps(image_bboxes)
+        digest.update((line + '\n').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _is_shard_complete(output_file: str,
+                       num_records: int,
+                       inputs_hash: str,
+                       manifest: Mapping[str, Any]) -> bool:
+    """Checks a shard on disk against its manifest entry."""
+    entry = manifest.get(os.path.basename(output_file))
+    if entry is None or entry['num_records'] != num_records:
+        return False
+    if entry.get('inputs_hash') != inputs_hash:
+        return False
+    if not tf.io.gfile.exists(output_file):
+        return False
+    return tf.io.gfile.stat(output_file).length == entry['size']
 
 
 def _process_dataset(
@@ -241,7 +494,10 @@ def _process_dataset(
         labels: Mapping[str, int],
         output_directory: str,
         prefix: str,
-        num_shards: int) -> List[str]:
+        num_shards: int,
+        num_workers: int = 1,
+        verify: bool = False,
+        bboxes: Optional[Mapping[str, List[List[float]]]] = None) -> List[str]:
     """Processes and saves list of images as TFRecords.
     Args:
       filenames: iterable of strings; each string is a path to an image file.
@@ -250,30 +506,81 @@ def _process_dataset(
       output_directory: path where output files should be created.
       prefix: string; prefix for each file.
       num_shards: number of chunks to split the filenames into.
+      num_workers: number of processes writing shards in parallel.
+      verify: whether to decode every image to check that it is valid.
+      bboxes: optional map of image file name to its bounding boxes.
     Returns:
       files: list of tf-record filepaths created from processing the dataset.
     """
     _check_or_create_dir(output_directory)
     chunksize = int(math.ceil(len(filenames) / num_shards))
-    coder = ImageCoder()
+
+    # The manifest lives next to the output directory, so that it is not
+    # picked up as a TFRecord file of the split.
+    manifest_file = os.path.join(os.path.dirname(output_directory),
+                                 '%s-manifest.json' % prefix)
+    manifest = _load_manifest(manifest_file)
 
     files = []
+    pending_shards = []
+    inputs_hashes = {}
 
     for shard in range(num_shards):
         chunk_files = filenames[shard * chunksize: (shard + 1) * chunksize]
         chunk_synsets = synsets[shard * chunksize: (shard + 1) * chunksize]
         output_file = os.path.join(
             output_directory, '%s-%.5d-of-%.5d' % (prefix, shard, num_shards))
-        _process_image_files_batch(coder, output_file, chunk_files,
-                                   chunk_synsets, labels)
-        logging.info('Finished writing file: %s', output_file)
         files.append(output_file)
+        chunk_bboxes = None
+        if bboxes is not None:
+            chunk_bboxes = [bboxes.get(os.path.basename(f))
+                            for f in chunk_files]
+        inputs_hash = _inputs_hash(chunk_files, chunk_synsets, chunk_bboxes)
+        inputs_hashes[output_file] = inputs_hash
+        if _is_shard_complete(output_file, len(chunk_files), inputs_hash,
+                              manifest):
+            logging.info('Skipping completed file: %s', output_file)
+            if not tf.io.gfile.exists(record_index.index_path(output_file)):
+                record_index.write_index(output_file)
+            continue
+        pending_shards.append((output_file, chunk_files, chunk_synsets, labels,
+                               verify, chunk_bboxes))
+
+    logging.info('Writing %d of %d %s shards with %d workers.',
+                 len(pending_shards), num_shards, prefix, num_workers)
+
+    def record_shard(result):
+        output_file, num_records, size, elapsed = result
+        manifest[os.path.basename(output_file)] = {
+            'num_records': num_records,
+            'size': size,
+            'inputs_hash': inputs_hashes[output_file],
+        }
+        _write_manifest(manifest_file, manifest)
+        logging.info('Finished writing file: %s (%d images in %.1f sec, '
+                     '%.1f images/sec)', output_file, num_records, elapsed,
+                     num_records / max(elapsed, 1e-6))
+
+    if num_workers > 1:
+        # Spawn fresh processes, TensorFlow is not fork-safe.
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(num_workers, initializer=_init_worker) as pool:
+            for result in pool.imap_unordered(_process_shard, pending_shards):
+                record_shard(result)
+    elif pending_shards:
+        coder = ImageCoder()
+        for pending_shard in pending_shards:
+            record_shard(_process_shard(pending_shard, coder))
+
     return files
 
 
 def convert_to_tf_records(
         raw_data_dir: str,
-        local_scratch_dir: str) -> Tuple[List[str], List[str]]:
+        local_scratch_dir: str,
+        num_workers: int = 1,
+        verify: bool = False,
+        bounding_box_file: Optional[str] = None) -> Tuple[List[str], List[str]]:
     """Converts the Imagenet dataset into TF-Record dumps."""
 
     # Shuffle training records to ensure we are distributing classes
@@ -285,9 +592,10 @@ def convert_to_tf_records(
         random.shuffle(order)
         return order
 
-    # Glob all the training files
-    training_files = tf.io.gfile.glob(
-        os.path.join(raw_data_dir, TRAINING_DIRECTORY, '*', '*.JPEG'))
+    # Glob all the training files, sorted since the glob order is not defined
+    # and the shuffle below must assign the same images to each shard
+    training_files = sorted(tf.io.gfile.glob(
+        os.path.join(raw_data_dir, TRAINING_DIRECTORY, '*', '*.JPEG')))
 
     # Get training file synset labels from the directory name
     training_synsets = [
@@ -310,29 +618,40 @@ def convert_to_tf_records(
     labels = {v: k + 1 for k, v in enumerate(
         sorted(set(validation_synsets + training_synsets)))}
 
+    training_bboxes = None
+    if bounding_box_file:
+        training_bboxes = _load_bounding_boxes(bounding_box_file)
+
     # Create training data
     logging.info('Processing the training data.')
     training_records = _process_dataset(
         training_files, training_synsets, labels,
         os.path.join(local_scratch_dir, TRAINING_DIRECTORY),
-        TRAINING_DIRECTORY, TRAINING_SHARDS)
+        TRAINING_DIRECTORY, TRAINING_SHARDS, num_workers, verify,
+        training_bboxes)
 
     # Create validation data
     logging.info('Processing the validation data.')
     validation_records = _process_dataset(
         validation_files, validation_synsets, labels,
         os.path.join(local_scratch_dir, VALIDATION_DIRECTORY),
-        VALIDATION_DIRECTORY, VALIDATION_SHARDS)
+        VALIDATION_DIRECTORY, VALIDATION_SHARDS, num_workers, verify)
 
     return training_records, validation_records
 
 
 def run(raw_data_dir: str,
-        local_scratch_dir: str):
+        local_scratch_dir: str,
+        num_workers: int = 1,
+        verify: bool = False,
+        bounding_box_file: Optional[str] = None):
     """Runs the ImageNet preprocessing.
     Args:
       raw_data_dir: str, the path to the folder with raw ImageNet data.
       local_scratch_dir: str, the local directory path.
+      num_workers: int, the number of processes writing shards in parallel.
+      verify: bool, whether to decode every image to check that it is valid.
+      bounding_box_file: str, optional CSV file of the training bounding boxes.
     """
     if raw_data_dir is None:
         raise AssertionError(
@@ -342,12 +661,18 @@ def run(raw_data_dir: str,
     # Convert the raw data into tf-records
     training_records, validation_records = convert_to_tf_records(
         raw_data_dir=raw_data_dir,
-        local_scratch_dir=local_scratch_dir)
+        local_scratch_dir=local_scratch_dir,
+        num_workers=num_workers,
+        verify=verify,
+        bounding_box_file=bounding_box_file)
 
 
 def main(_):
     run(raw_data_dir=FLAGS.raw_data_dir,
-        local_scratch_dir=FLAGS.local_scratch_dir)
+        local_scratch_dir=FLAGS.local_scratch_dir,
+        num_workers=FLAGS.num_workers,
+        verify=FLAGS.verify,
+        bounding_box_file=FLAGS.bounding_box_file)
 
 
 if __name__ == '__main__':
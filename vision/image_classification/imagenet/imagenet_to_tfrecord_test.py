@@ -0,0 +1,301 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for imagenet_to_tfrecord."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import struct
+
+from absl.testing.absltest import mock
+from absl.testing import parameterized
+from PIL import Image
+import tensorflow as tf
+
+from vision.image_classification.imagenet import imagenet_to_tfrecord
+
+_SYNSETS = [b'n01440764', b'n01443537']
+_LABELS = {synset: i + 1 for i, synset in enumerate(_SYNSETS)}
+
+
+def _random_image(height: int, width: int, channels: int = 3) -> tf.Tensor:
+    image = tf.random.uniform((height, width, channels), maxval=256,
+                              dtype=tf.int32)
+    return tf.cast(image, tf.uint8)
+
+
+def _frame_header(height: int, width: int, components: int,
+                  marker: int = 0xC0) -> bytes:
+    """A start of frame segment of the given dimensions."""
+    component_specs = b''.join(bytes([i + 1, 0x11, 0])
+                               for i in range(components))
+    return (bytes([0xFF, marker]) +
+            struct.pack('>HBHHB', 8 + 3 * components, 8, height, width,
+                        components) +
+            component_specs)
+
+
+def _record_filenames(record_file: str):
+    """The base names of the images stored in a TFRecord file."""
+    filenames = []
+    for record in tf.data.TFRecordDataset(record_file):
+        parsed = tf.io.parse_single_example(record, {
+            'image/filename': tf.io.FixedLenFeature((), tf.string)})
+        filenames.append(parsed['image/filename'].numpy().decode('utf-8'))
+    return filenames
+
+
+class ImagenetToTfrecordTest(parameterized.TestCase, tf.test.TestCase):
+
+    def _write_images(self, num_images: int):
+        """Writes JPEG images of alternating synsets to the temp dir."""
+        filenames, synsets = [], []
+        for i in range(num_images):
+            synset = _SYNSETS[i % 2]
+            directory = os.path.join(self.get_temp_dir(), 'raw',
+                                     synset.decode('utf-8'))
+            tf.io.gfile.makedirs(directory)
+            filename = os.path.join(directory, 'image_%d.JPEG' % i)
+            image = tf.random.uniform((8, 12, 3), maxval=256, dtype=tf.int32)
+            tf.io.write_file(filename,
+                             tf.image.encode_jpeg(tf.cast(image, tf.uint8)))
+            filenames.append(filename)
+            synsets.append(synset)
+        return filenames, synsets
+
+    def test_manifest_round_trip(self):
+        manifest_file = os.path.join(self.get_temp_dir(), 'train-manifest.json')
+        self.assertEqual({}, imagenet_to_tfrecord._load_manifest(manifest_file))
+
+        manifest = {'train-00000-of-00002': {
+            'num_records': 3, 'size': 100, 'inputs_hash': 'abc'}}
+        imagenet_to_tfrecord._write_manifest(manifest_file, manifest)
+
+        self.assertEqual(manifest,
+                         imagenet_to_tfrecord._load_manifest(manifest_file))
+        self.assertFalse(tf.io.gfile.exists(manifest_file + '.tmp'))
+
+    def test_is_shard_complete(self):
+        output_file = os.path.join(self.get_temp_dir(), 'train-00000-of-00001')
+        with tf.io.gfile.GFile(output_file, 'wb') as f:
+            f.write(b'x' * 10)
+        entry = {'num_records': 2, 'size': 10, 'inputs_hash': 'abc'}
+        manifest = {'train-00000-of-00001': entry}
+
+        self.assertTrue(imagenet_to_tfrecord._is_shard_complete(
+            output_file, 2, 'abc', manifest))
+        # Another number of records or other input files
+        self.assertFalse(imagenet_to_tfrecord._is_shard_complete(
+            output_file, 3, 'abc', manifest))
+        self.assertFalse(imagenet_to_tfrecord._is_shard_complete(
+            output_file, 2, 'def', manifest))
+        # Entries of manifests without input hashes are not trusted
+        self.assertFalse(imagenet_to_tfrecord._is_shard_complete(
+            output_file, 2, 'abc',
+            {'train-00000-of-00001': {'num_records': 2, 'size': 10}}))
+        # A shard of another size, or missing from disk or from the manifest
+        self.assertFalse(imagenet_to_tfrecord._is_shard_complete(
+            output_file, 2, 'abc',
+            {'train-00000-of-00001': dict(entry, size=11)}))
+        self.assertFalse(imagenet_to_tfrecord._is_shard_complete(
+            output_file + '-missing', 2, 'abc', manifest))
+        self.assertFalse(imagenet_to_tfrecord._is_shard_complete(
+            output_file, 2, 'abc', {}))
+
+    def test_inputs_hash_depends_on_order_not_directory(self):
+        files = ['/a/n01/x.JPEG', '/a/n01/y.JPEG']
+        synsets = [b'n01', b'n01']
+
+        self.assertEqual(
+            imagenet_to_tfrecord._inputs_hash(files, synsets),
+            imagenet_to_tfrecord._inputs_hash(
+                ['/b/n01/x.JPEG', '/b/n01/y.JPEG'], synsets))
+        self.assertNotEqual(
+            imagenet_to_tfrecord._inputs_hash(files, synsets),
+            imagenet_to_tfrecord._inputs_hash(files[::-1], synsets))
+
+    def test_inputs_hash_depends_on_boxes(self):
+        files = ['/a/n01/x.JPEG', '/a/n01/y.JPEG']
+        synsets = [b'n01', b'n01']
+        inputs_hash = imagenet_to_tfrecord._inputs_hash(files, synsets)
+
+        # Images without boxes are written like without a box file
+        self.assertEqual(inputs_hash, imagenet_to_tfrecord._inputs_hash(
+            files, synsets, [None, []]))
+        boxes_hash = imagenet_to_tfrecord._inputs_hash(
+            files, synsets, [[[0.1, 0.2, 0.3, 0.4]], None])
+        self.assertNotEqual(inputs_hash, boxes_hash)
+        self.assertNotEqual(boxes_hash, imagenet_to_tfrecord._inputs_hash(
+            files, synsets, [[[0.1, 0.2, 0.3, 0.5]], None]))
+
+    def test_rewrites_shards_with_new_boxes(self):
+        filenames, synsets = self._write_images(num_images=4)
+        output_directory = os.path.join(self.get_temp_dir(), 'tfrecord',
+                                        'train')
+
+        def process(bboxes):
+            with mock.patch.object(
+                    imagenet_to_tfrecord, '_process_shard',
+                    wraps=imagenet_to_tfrecord._process_shard) as process_shard:
+                files = imagenet_to_tfrecord._process_dataset(
+                    filenames, synsets, _LABELS, output_directory, 'train',
+                    num_shards=2, bboxes=bboxes)
+            return files, process_shard.call_count
+
+        _, num_written = process(None)
+        self.assertEqual(2, num_written)
+
+        # Only the second shard has an image with boxes
+        files, num_written = process(
+            {'image_3.JPEG': [[0.1, 0.2, 0.3, 0.4]]})
+        self.assertEqual(1, num_written)
+        records = list(tf.data.TFRecordDataset(files[1]))
+        parsed = tf.io.parse_single_example(records[1], {
+            'image/object/bbox/xmin': tf.io.VarLenFeature(tf.float32)})
+        self.assertAllClose([0.1], parsed['image/object/bbox/xmin'].values)
+
+        _, num_written = process({'image_3.JPEG': [[0.1, 0.2, 0.3, 0.4]]})
+        self.assertEqual(0, num_written)
+
+    def test_skips_only_shards_with_the_same_inputs(self):
+        filenames, synsets = self._write_images(num_images=6)
+        output_directory = os.path.join(self.get_temp_dir(), 'tfrecord',
+                                        'train')
+
+        def process(filenames, synsets):
+            with mock.patch.object(
+                    imagenet_to_tfrecord, '_process_shard',
+                    wraps=imagenet_to_tfrecord._process_shard) as process_shard:
+                files = imagenet_to_tfrecord._process_dataset(
+                    filenames, synsets, _LABELS, output_directory, 'train',
+                    num_shards=2)
+            return files, process_shard.call_count
+
+        files, num_written = process(filenames, synsets)
+        self.assertEqual(2, num_written)
+        self.assertEqual(['image_0.JPEG', 'image_1.JPEG', 'image_2.JPEG'],
+                         _record_filenames(files[0]))
+        manifest = imagenet_to_tfrecord._load_manifest(
+            os.path.join(os.path.dirname(output_directory),
+                         'train-manifest.json'))
+        self.assertEqual(
+            imagenet_to_tfrecord._inputs_hash(filenames[:3], synsets[:3]),
+            manifest['train-00000-of-00002']['inputs_hash'])
+
+        # Nothing is rewritten with the same inputs
+        _, num_written = process(filenames, synsets)
+        self.assertEqual(0, num_written)
+
+        # The same number of images per shard, but other images in each
+        order = [3, 1, 2, 0, 4, 5]
+        files, num_written = process([filenames[i] for i in order],
+                                     [synsets[i] for i in order])
+        self.assertEqual(2, num_written)
+        self.assertEqual(['image_3.JPEG', 'image_1.JPEG', 'image_2.JPEG'],
+                         _record_filenames(files[0]))
+        self.assertEqual(['image_0.JPEG', 'image_4.JPEG', 'image_5.JPEG'],
+                         _record_filenames(files[1]))
+
+    @parameterized.named_parameters(
+        ('baseline', {}, 3),
+        ('progressive', {'progressive': True}, 3),
+        ('grayscale', {}, 1),
+        ('optimized_with_metadata',
+         {'optimize_size': True, 'xmp_metadata': 'metadata'}, 3),
+    )
+    def test_probe_jpeg_matches_decode(self, options, channels):
+        image_data = tf.image.encode_jpeg(
+            _random_image(37, 53, channels), **options).numpy()
+
+        header = imagenet_to_tfrecord._probe_jpeg(image_data)
+
+        decoded = tf.image.decode_jpeg(image_data)
+        self.assertEqual((37, 53, channels), header)
+        self.assertEqual(tuple(decoded.shape), header)
+
+    def test_probe_jpeg_components_of_cmyk(self):
+        image_data = (b'\xff\xd8' + _frame_header(20, 30, 4, marker=0xC2) +
+                      b'\xff\xda')
+        self.assertEqual((20, 30, 4),
+                         imagenet_to_tfrecord._probe_jpeg(image_data))
+
+    @parameterized.named_parameters(
+        ('empty', b''),
+        ('not_a_jpeg', b'GIF89a\x00\x00\x00\x00'),
+        ('png', b'\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR'),
+        ('only_soi', b'\xff\xd8'),
+        ('garbage_marker', b'\xff\xd8\x12\x34\x00\x10'),
+        ('truncated_segment', b'\xff\xd8\xff\xe0\x00\x10JFIF'),
+        ('truncated_frame', b'\xff\xd8' + _frame_header(20, 30, 3)[:7]),
+        ('zero_height', b'\xff\xd8' + _frame_header(0, 30, 3)),
+        ('scan_before_frame', b'\xff\xd8\xff\xda\x00\x08' + b'\x00' * 8),
+    )
+    def test_probe_jpeg_unreadable_header(self, image_data):
+        self.assertIsNone(imagenet_to_tfrecord._probe_jpeg(image_data))
+
+    def _process(self, image_data: bytes, name: str = 'image.JPEG'):
+        """Processes an image file, counting the full decodes."""
+        filename = os.path.join(self.get_temp_dir(), name)
+        with tf.io.gfile.GFile(filename, 'wb') as f:
+            f.write(image_data)
+        coder = imagenet_to_tfrecord.ImageCoder()
+        with mock.patch.object(coder, 'decode_jpeg',
+                               wraps=coder.decode_jpeg) as decode_jpeg:
+            result = imagenet_to_tfrecord._process_image(filename, coder)
+        return result, decode_jpeg.call_count
+
+    def test_process_image_reads_header_only(self):
+        image_data = tf.image.encode_jpeg(_random_image(37, 53)).numpy()
+
+        (image_buffer, height, width), num_decodes = self._process(image_data)
+
+        self.assertEqual(image_data, image_buffer)
+        self.assertEqual((37, 53), (height, width))
+        self.assertEqual(0, num_decodes)
+
+    def test_process_image_converts_png(self):
+        image_data = tf.image.encode_png(_random_image(37, 53)).numpy()
+
+        (image_buffer, height, width), _ = self._process(image_data)
+
+        self.assertEqual((37, 53, 3),
+                         imagenet_to_tfrecord._probe_jpeg(image_buffer))
+        self.assertEqual((37, 53), (height, width))
+
+    def test_process_image_converts_cmyk(self):
+        output = io.BytesIO()
+        Image.new('CMYK', (53, 37), (10, 20, 30, 40)).save(output, 'JPEG')
+        image_data = output.getvalue()
+        self.assertEqual((37, 53, 4),
+                         imagenet_to_tfrecord._probe_jpeg(image_data))
+
+        (image_buffer, height, width), _ = self._process(image_data)
+
+        self.assertEqual((37, 53, 3),
+                         imagenet_to_tfrecord._probe_jpeg(image_buffer))
+        self.assertEqual((37, 53), (height, width))
+
+    def test_process_image_decodes_unreadable_header(self):
+        # The header can not be probed, so the image is fully decoded
+        image_data = b'\xff\xd8\x12\x34' + b'\x00' * 16
+        with self.assertRaises(tf.errors.InvalidArgumentError):
+            self._process(image_data)
+
+        coder = imagenet_to_tfrecord.ImageCoder()
+        filename = os.path.join(self.get_temp_dir(), 'garbage.JPEG')
+        with tf.io.gfile.GFile(filename, 'wb') as f:
+            f.write(image_data)
+        with mock.patch.object(coder, 'decode_jpeg',
+                               return_value=_random_image(7, 9).numpy()
+                               ) as decode_jpeg:
+            _, height, width = imagenet_to_tfrecord._process_image(filename,
+                                                                   coder)
+        decode_jpeg.assert_called_once_with(image_data)
+        self.assertEqual((7, 9), (height, width))
+
+
+if __name__ == '__main__':
+    tf.test.main()
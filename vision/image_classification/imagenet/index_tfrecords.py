@@ -0,0 +1,56 @@
+r"""Script to write record index files for existing TFRecord shards.
+
+The index files store the byte offset of every record and are used by
+`use_record_index` in `dataset_factory.DatasetConfig`. `imagenet_to_tfrecord.py`
+already writes them for new shards.
+
+To run the script, run the following command:
+
+```
+python index_tfrecords.py \
+  --file_pattern='/data/imagenet/tfrecord/*/*-of-*'
+```
+
+"""
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import tensorflow as tf
+
+from vision.image_classification import record_index
+
+flags.DEFINE_string(
+    'file_pattern', '/data/imagenet/tfrecord/*/*-of-*',
+    'Glob pattern of the TFRecord files to index.')
+flags.DEFINE_bool(
+    'overwrite', False, 'Whether to rewrite existing index files.')
+
+FLAGS = flags.FLAGS
+
+
+def run(file_pattern: str, overwrite: bool = False):
+    """Writes the index files of all TFRecord files matching `file_pattern`.
+    Args:
+      file_pattern: str, glob pattern of the TFRecord files.
+      overwrite: bool, whether to rewrite existing index files.
+    """
+    filenames = sorted(f for f in tf.io.gfile.glob(file_pattern)
+                       if not record_index.is_index_file(f))
+    for filename in filenames:
+        if (not overwrite and
+                tf.io.gfile.exists(record_index.index_path(filename))):
+            continue
+        record_index.write_index(filename)
+        logging.info('Finished writing index: %s',
+                     record_index.index_path(filename))
+
+
+def main(_):
+    run(file_pattern=FLAGS.file_pattern, overwrite=FLAGS.overwrite)
+
+
+if __name__ == '__main__':
+    logging.set_verbosity(logging.INFO)
+    app.run(main)
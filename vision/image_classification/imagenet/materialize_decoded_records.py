@@ -0,0 +1,204 @@
+r"""Script to materialize decoded, downscaled ImageNet TFRecords.
+
+Reads the TFRecords written by `imagenet_to_tfrecord.py`, decodes every JPEG
+once, resizes it so that its shortest side is at most `resize_min` (keeping the
+aspect ratio) and stores the raw uint8 RGB pixels. Training on these records
+with `builder: 'decoded_records'` skips JPEG decoding entirely and only does the
+random crop and flip, trading disk space for input pipeline CPU.
+
+The records are not of a fixed size: the images keep their aspect ratio, with
+their height and width stored next to the pixels, so that the training random
+crop still samples from the whole image as with the encoded records. Cropping
+them to a fixed shape here would fix the crop of every image.
+
+- tfrecord train: /data/imagenet/tfrecord/train/train-00001-of-01024
+- decoded train: /data/imagenet/decoded/train/train-00001-of-01024
+
+To run the script, run the following command:
+
+```
+python materialize_decoded_records.py \
+  --tfrecord_dir=/data/imagenet/tfrecord \
+  --decoded_dir=/data/imagenet/decoded
+```
+
+"""
+
+import os
+from typing import Dict, List, Tuple
+from absl import app
+from absl import flags
+from absl import logging
+
+import tensorflow as tf
+
+from vision.image_classification import preprocessing, record_index
+
+flags.DEFINE_string(
+    'tfrecord_dir', '/data/imagenet/tfrecord',
+    'Directory path of the ImageNet TFRecords. Should have train and '
+    'validation subdirectories inside it.')
+flags.DEFINE_string(
+    'decoded_dir', '/data/imagenet/decoded',
+    'Output directory path for the decoded TFRecords.')
+flags.DEFINE_integer(
+    'resize_min', preprocessing.RESIZE_MIN,
+    'Images whose shortest side is larger than this are downscaled to it.')
+
+FLAGS = flags.FLAGS
+
+SPLITS = ('train', 'validation')
+
+# The bounding boxes are relative to the image size, so resizing keeps them.
+BBOX_KEYS = (
+    'image/object/bbox/xmin',
+    'image/object/bbox/ymin',
+    'image/object/bbox/xmax',
+    'image/object/bbox/ymax',
+)
+
+
+def _int64_feature(value: int) -> tf.train.Feature:
+    """Inserts an int64 feature into Example proto."""
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def _float_feature(value: List[float]) -> tf.train.Feature:
+    """Inserts float features into Example proto."""
+    return tf.train.Feature(float_list=tf.train.FloatList(value=value))
+
+
+def _bytes_feature(value: bytes) -> tf.train.Feature:
+    """Inserts a bytes feature into Example proto."""
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _decode_and_resize(record: tf.Tensor,
+                       resize_min: int
+                       ) -> Tuple[tf.Tensor, tf.Tensor, Dict[str, tf.Tensor]]:
+    """Decodes an encoded ImageNet record and downscales the image.
+
+    Args:
+      record: a serialized Example written by `imagenet_to_tfrecord.py`.
+      resize_min: the maximum size of the shortest side of the output image.
+
+    Returns:
+      image: a uint8 `Tensor` of shape [height, width, 3].
+      label: an int64 scalar `Tensor`, as stored in the input record.
+      bboxes: a map of the bounding box feature keys to their float `Tensor`
+        of relative coordinates, as stored in the input record.
+    """
+    keys_to_features = {
+        'image/encoded': tf.io.FixedLenFeature((), tf.string, ''),
+        'image/class/label': tf.io.FixedLenFeature([], tf.int64, -1),
+    }
+    for key in BBOX_KEYS:
+        keys_to_features[key] = tf.io.VarLenFeature(tf.float32)
+    parsed = tf.io.parse_single_example(record, keys_to_features)
+    bboxes = {key: parsed[key].values for key in BBOX_KEYS}
+    image = tf.image.decode_jpeg(parsed['image/encoded'], channels=3)
+
+    shape = tf.shape(image)
+    should_resize = tf.minimum(shape[0], shape[1]) > resize_min
+
+    def resize():
+        resized = preprocessing.aspect_preserving_resize(image, resize_min)
+        resized = tf.clip_by_value(tf.round(resized), 0.0, 255.0)
+        return tf.cast(resized, tf.uint8)
+
+    image = tf.cond(should_resize, resize, lambda: image)
+    return image, parsed['image/class/label'], bboxes
+
+
+def _convert_to_example(image: tf.Tensor,
+                        label: tf.Tensor,
+                        bboxes: Dict[str, tf.Tensor]) -> tf.train.Example:
+    """Builds an Example proto holding a decoded image.
+
+    Args:
+      image: uint8 `Tensor` of shape [height, width, 3].
+      label: integer, identifier for the ground truth for the network.
+      bboxes: map of the bounding box feature keys to their coordinates.
+
+    Returns:
+      Example proto
+    """
+    height, width, _ = image.shape
+    feature = {
+        'image/height': _int64_feature(height),
+        'image/width': _int64_feature(width),
+        'image/class/label': _int64_feature(int(label)),
+        'image/decoded': _bytes_feature(image.numpy().tobytes())}
+    for key, value in bboxes.items():
+        if len(value):
+            feature[key] = _float_feature(value.numpy().tolist())
+    example = tf.train.Example(features=tf.train.Features(feature=feature))
+    return example
+
+
+def _process_file(input_file: str, output_file: str, resize_min: int):
+    """Decodes all records of `input_file` and writes them to `output_file`.
+
+    The record index file of `output_file` is written next to it.
+    """
+    dataset = tf.data.TFRecordDataset(input_file)
+    dataset = dataset.map(
+        lambda record: _decode_and_resize(record, resize_min),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+    offsets = []
+    offset = 0
+    with tf.io.TFRecordWriter(output_file) as writer:
+        for image, label, bboxes in dataset:
+            serialized = _convert_to_example(image, label,
+                                             bboxes).SerializeToString()
+            writer.write(serialized)
+            offsets.append(offset)
+            offset += record_index.record_size(len(serialized))
+    record_index.write_index(output_file, offsets)
+
+
+def materialize(tfrecord_dir: str,
+                decoded_dir: str,
+                resize_min: int) -> List[str]:
+    """Writes decoded copies of all shards found under `tfrecord_dir`.
+
+    Args:
+      tfrecord_dir: str, the directory with the encoded ImageNet TFRecords.
+      decoded_dir: str, the output directory. Shards keep their names.
+      resize_min: int, the maximum size of the shortest side of the images.
+
+    Returns:
+      files: list of decoded TFRecord file paths created.
+    """
+    files = []
+    for split in SPLITS:
+        input_files = sorted(
+            f for f in tf.io.gfile.glob(os.path.join(tfrecord_dir, split, '*'))
+            if not record_index.is_index_file(f))
+        if not input_files:
+            logging.warning('No TFRecords found for split %s', split)
+            continue
+
+        output_directory = os.path.join(decoded_dir, split)
+        tf.io.gfile.makedirs(output_directory)
+
+        logging.info('Processing the %s data.', split)
+        for input_file in input_files:
+            output_file = os.path.join(output_directory,
+                                       os.path.basename(input_file))
+            _process_file(input_file, output_file, resize_min)
+            logging.info('Finished writing file: %s', output_file)
+            files.append(output_file)
+    return files
+
+
+def main(_):
+    materialize(tfrecord_dir=FLAGS.tfrecord_dir,
+                decoded_dir=FLAGS.decoded_dir,
+                resize_min=FLAGS.resize_min)
+
+
+if __name__ == '__main__':
+    logging.set_verbosity(logging.INFO)
+    app.run(main)
@@ -0,0 +1,96 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for materialize_decoded_records."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from vision.image_classification import dataset_factory, record_index
+from vision.image_classification.imagenet import materialize_decoded_records
+
+# The (height, width) of the encoded images, and of their decoded copies
+_SHAPES = [((40, 60), (16, 24)), ((12, 20), (12, 20)), ((50, 20), (40, 16))]
+_RESIZE_MIN = 16
+
+
+class MaterializeDecodedRecordsTest(tf.test.TestCase):
+
+    def _write_shard(self, tfrecord_dir: str) -> str:
+        """Writes a validation shard of JPEG images with labels 1, 2, ..."""
+        directory = os.path.join(tfrecord_dir, 'validation')
+        tf.io.gfile.makedirs(directory)
+        filename = os.path.join(directory, 'validation-00000-of-00001')
+        with tf.io.TFRecordWriter(filename) as writer:
+            for i, (shape, _) in enumerate(_SHAPES):
+                image = tf.random.uniform(shape + (3,), maxval=256,
+                                          dtype=tf.int32)
+                encoded = tf.image.encode_jpeg(tf.cast(image, tf.uint8))
+                example = tf.train.Example(features=tf.train.Features(feature={
+                    'image/encoded': tf.train.Feature(
+                        bytes_list=tf.train.BytesList(
+                            value=[encoded.numpy()])),
+                    'image/class/label': tf.train.Feature(
+                        int64_list=tf.train.Int64List(value=[i + 1])),
+                    'image/object/bbox/xmin': tf.train.Feature(
+                        float_list=tf.train.FloatList(value=[0.25])),
+                    'image/object/bbox/ymin': tf.train.Feature(
+                        float_list=tf.train.FloatList(value=[0.5])),
+                    'image/object/bbox/xmax': tf.train.Feature(
+                        float_list=tf.train.FloatList(value=[0.75])),
+                    'image/object/bbox/ymax': tf.train.Feature(
+                        float_list=tf.train.FloatList(value=[1.])),
+                }))
+                writer.write(example.SerializeToString())
+        return filename
+
+    def test_round_trip(self):
+        tfrecord_dir = os.path.join(self.get_temp_dir(), 'tfrecord')
+        decoded_dir = os.path.join(self.get_temp_dir(), 'decoded')
+        self._write_shard(tfrecord_dir)
+
+        files = materialize_decoded_records.materialize(
+            tfrecord_dir, decoded_dir, resize_min=_RESIZE_MIN)
+
+        self.assertEqual(
+            [os.path.join(decoded_dir, 'validation',
+                          'validation-00000-of-00001')], files)
+        self.assertTrue(tf.io.gfile.exists(record_index.index_path(files[0])))
+
+        config = dataset_factory.DatasetConfig(
+            builder='decoded_records',
+            data_dir=decoded_dir,
+            split='validation',
+            image_size=8,
+            num_classes=4,
+            num_channels=3,
+            num_examples=len(_SHAPES),
+            batch_size=len(_SHAPES),
+            one_hot=False)
+        builder = dataset_factory.DatasetBuilder(config)
+        records = list(tf.data.TFRecordDataset(files))
+        self.assertLen(records, len(_SHAPES))
+        for i, record in enumerate(records):
+            image, label = builder.parse_decoded_example(record)
+            self.assertEqual(tf.uint8, image.dtype)
+            self.assertAllEqual(_SHAPES[i][1] + (3,), image.shape)
+            self.assertLessEqual(min(image.shape[:2]), _RESIZE_MIN)
+            # The labels are shifted to start at 0 when parsed
+            self.assertAllEqual([i], label)
+
+        parsed = tf.io.parse_single_example(records[0], {
+            'image/object/bbox/xmin': tf.io.VarLenFeature(tf.float32)})
+        self.assertAllEqual([0.25], parsed['image/object/bbox/xmin'].values)
+
+        images, labels = next(iter(builder.build()))
+        self.assertAllEqual([len(_SHAPES), 8, 8, 3], images.shape)
+        self.assertAllEqual(sorted(range(len(_SHAPES))),
+                            sorted(labels.numpy()[:, 0]))
+
+
+if __name__ == '__main__':
+    tf.test.main()
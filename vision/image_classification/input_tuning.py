@@ -0,0 +1,151 @@
+# Lint as: python3
+# ==============================================================================
+"""Calibration of the input pipeline parallelism for the host.
+
+The number of files read in parallel, the read buffer size and the map
+parallelism that saturate the storage and the CPU cores depend on the machine.
+These functions time short probes of the input pipeline with a few candidate
+values and pick the fastest one, preferring the smallest value when the
+throughputs are within a tolerance, which uses less memory and fewer threads.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import os
+import time
+from typing import Callable, List, Mapping, Sequence, Tuple
+
+from absl import logging
+import tensorflow as tf
+
+AUTO = 'auto'
+
+BUFFER_SIZES = (256 * 1024, 1024 * 1024, 8 * 1024 * 1024, 32 * 1024 * 1024)
+
+
+def num_cores() -> int:
+    """The number of CPU cores this process can run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def candidate_cycle_lengths(num_files: int, cores: int) -> List[int]:
+    """Returns the cycle lengths worth probing for `num_files` files."""
+    candidates = {min(num_files, c)
+                  for c in (4, 8, 16, 32, 64) if c <= 2 * cores}
+    return sorted(candidates or {min(num_files, 4)})
+
+
+def candidate_parallelism(cores: int) -> List[int]:
+    """Returns the map parallelism worth probing on `cores` cores."""
+    candidates = {cores}
+    parallelism = 1
+    while parallelism < cores:
+        if parallelism * 4 >= cores:
+            candidates.add(parallelism)
+        parallelism *= 2
+    return sorted(candidates)
+
+
+def measure_throughput(dataset: tf.data.Dataset, duration: float) -> float:
+    """Returns the elements per second produced by `dataset` for `duration`.
+
+    The first element is read before timing, to exclude start up. Stops early
+    if the dataset is exhausted.
+    """
+    iterator = iter(dataset)
+    try:
+        next(iterator)
+    except StopIteration:
+        return 0.
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.
+    for _ in iterator:
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+    return count / elapsed if elapsed else 0.
+
+
+def pick_fastest(throughputs: Mapping[int, float],
+                 tolerance: float = 0.05) -> int:
+    """Returns the smallest candidate within `tolerance` of the best one."""
+    best = max(throughputs.values())
+    return min(candidate for candidate, throughput in throughputs.items()
+               if throughput >= (1. - tolerance) * best)
+
+
+def calibrate_reads(filenames: Sequence[str],
+                    cycle_lengths: Sequence[int],
+                    buffer_sizes: Sequence[int],
+                    duration: float) -> Tuple[int, int]:
+    """Picks the interleave cycle length and read buffer size of TFRecords.
+
+    The cycle length is probed first with the median buffer size, then the
+    buffer size with the chosen cycle length. Each probe starts reading at
+    different files where possible, so that the OS page cache filled by a
+    probe does not speed up the next ones.
+
+    Args:
+      filenames: The TFRecord files of the dataset.
+      cycle_lengths: The candidate numbers of files read in parallel.
+      buffer_sizes: The candidate read buffer sizes, in bytes.
+      duration: The seconds each probe reads for.
+
+    Returns:
+      The chosen cycle length and buffer size.
+    """
+    filenames = list(filenames)
+    probes = [0]
+
+    def probe(cycle_length, buffer_size):
+        start = (probes[0] * max(cycle_lengths)) % len(filenames)
+        probes[0] += 1
+        files = filenames[start:] + filenames[:start]
+        dataset = tf.data.Dataset.from_tensor_slices(files)
+        dataset = dataset.interleave(
+            lambda name: tf.data.TFRecordDataset(name, buffer_size=buffer_size),
+            cycle_length=cycle_length,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        throughput = measure_throughput(dataset, duration)
+        logging.info('Probed cycle_length=%d read_buffer_size=%d: %.1f '
+                     'records/sec', cycle_length, buffer_size, throughput)
+        return throughput
+
+    buffer_sizes = sorted(buffer_sizes)
+    buffer_size = buffer_sizes[len(buffer_sizes) // 2]
+    cycle_length = pick_fastest(
+        {c: probe(c, buffer_size) for c in cycle_lengths})
+    buffer_size = pick_fastest(
+        {b: probe(cycle_length, b) for b in buffer_sizes})
+    return cycle_length, buffer_size
+
+
+def calibrate_parallelism(dataset: tf.data.Dataset,
+                          map_fn: Callable[..., Tuple[tf.Tensor, ...]],
+                          candidates: Sequence[int],
+                          duration: float) -> int:
+    """Picks the `num_parallel_calls` of mapping `map_fn` over `dataset`.
+
+    Args:
+      dataset: The probe inputs of `map_fn`, preferably cached in memory and
+        repeated so that reading them is not the bottleneck.
+      map_fn: The per example preprocessing function.
+      candidates: The candidate parallelism values.
+      duration: The seconds each probe runs for.
+
+    Returns:
+      The chosen parallelism.
+    """
+    throughputs = {}
+    for parallelism in candidates:
+        mapped = dataset.map(map_fn, num_parallel_calls=parallelism)
+        throughputs[parallelism] = measure_throughput(mapped, duration)
+        logging.info('Probed num_parallel_calls=%d: %.1f examples/sec',
+                     parallelism, throughputs[parallelism])
+    return pick_fastest(throughputs)
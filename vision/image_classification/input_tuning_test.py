@@ -0,0 +1,58 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for input_tuning."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from vision.image_classification import input_tuning
+
+
+class InputTuningTest(tf.test.TestCase):
+
+    def test_pick_fastest_prefers_smallest_within_tolerance(self):
+        throughputs = {4: 90., 8: 99., 16: 100., 32: 60.}
+
+        self.assertEqual(8, input_tuning.pick_fastest(throughputs))
+        self.assertEqual(4, input_tuning.pick_fastest(throughputs,
+                                                      tolerance=0.2))
+
+    def test_candidates(self):
+        self.assertEqual([4, 8, 16, 32],
+                         input_tuning.candidate_cycle_lengths(100, cores=16))
+        self.assertEqual([3], input_tuning.candidate_cycle_lengths(3, cores=16))
+        self.assertEqual([4, 8, 16], input_tuning.candidate_parallelism(16))
+        self.assertEqual([1], input_tuning.candidate_parallelism(1))
+
+    def test_calibrate_reads(self):
+        filenames = []
+        for i in range(4):
+            filename = os.path.join(self.get_temp_dir(), 'data-%d' % i)
+            with tf.io.TFRecordWriter(filename) as writer:
+                for _ in range(100):
+                    writer.write(b'x' * 1000)
+            filenames.append(filename)
+
+        cycle_length, buffer_size = input_tuning.calibrate_reads(
+            filenames, cycle_lengths=[1, 2], buffer_sizes=[1024, 4096],
+            duration=0.01)
+
+        self.assertIn(cycle_length, [1, 2])
+        self.assertIn(buffer_size, [1024, 4096])
+
+    def test_calibrate_parallelism(self):
+        dataset = tf.data.Dataset.range(10).repeat()
+
+        parallelism = input_tuning.calibrate_parallelism(
+            dataset, lambda x: x * 2, candidates=[1, 2], duration=0.01)
+
+        self.assertIn(parallelism, [1, 2])
+
+
+if __name__ == '__main__':
+    tf.test.main()
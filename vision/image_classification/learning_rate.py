@@ -107,3 +107,75 @@ class PiecewiseConstantDecayWithWarmup(tf.keras.optimizers.schedules.LearningRat
             "lr_values": self._lr_values,
             "warmup_steps": self._warmup_steps,
         }
+
+
+class PhasedBatchSizeSchedule(tf.keras.optimizers.schedules.LearningRateSchedule):
+    """A wrapper following a schedule by epoch through varying batch sizes.
+
+    The wrapped schedule is defined in the steps of a reference batch size.
+    In a phase with another batch size, an epoch takes a different number of
+    steps, so each step is mapped to the reference step at the same point of
+    training, and the learning rate is scaled linearly with the batch size.
+    """
+
+    def __init__(
+            self,
+            lr_schedule: tf.keras.optimizers.schedules.LearningRateSchedule,
+            steps_per_epoch: int,
+            phase_epochs: List[int],
+            phase_steps: List[int],
+            phase_steps_per_epoch: List[int],
+            phase_multipliers: List[float]):
+        """Follows `lr_schedule` through phases of different batch sizes.
+
+        Args:
+          lr_schedule: base learning rate scheduler, for the reference batch
+            size.
+          steps_per_epoch: the number of steps per epoch of the reference
+            batch size.
+          phase_epochs: the first epoch of each phase, starting with 0.
+          phase_steps: the first step of each phase, starting with 0.
+          phase_steps_per_epoch: the number of steps per epoch of each phase.
+          phase_multipliers: the ratio of the batch size of each phase to the
+            reference one.
+
+        """
+        super(PhasedBatchSizeSchedule, self).__init__()
+        lengths = {len(phase_epochs), len(phase_steps),
+                   len(phase_steps_per_epoch), len(phase_multipliers)}
+        if len(lengths) != 1:
+            raise ValueError("All the phase lists must have the same length")
+        if phase_steps[0] != 0 or phase_epochs[0] != 0:
+            raise ValueError("The first phase must start at step 0")
+
+        self._lr_schedule = lr_schedule
+        self._steps_per_epoch = steps_per_epoch
+        self._phase_epochs = phase_epochs
+        self._phase_steps = phase_steps
+        self._phase_steps_per_epoch = phase_steps_per_epoch
+        self._phase_multipliers = phase_multipliers
+
+    def __call__(self, step: int):
+        step = tf.cast(step, tf.float32)
+        phase_steps = tf.constant(self._phase_steps, tf.float32)
+        phase = tf.reduce_sum(tf.cast(step >= phase_steps[1:], tf.int32))
+
+        def gather(values):
+            return tf.gather(tf.constant(values, tf.float32), phase)
+
+        epoch = (gather(self._phase_epochs) +
+                 (step - gather(self._phase_steps)) /
+                 gather(self._phase_steps_per_epoch))
+        lr = self._lr_schedule(epoch * self._steps_per_epoch)
+        return lr * tf.cast(gather(self._phase_multipliers), lr.dtype)
+
+    def get_config(self) -> Mapping[str, Any]:
+        config = self._lr_schedule.get_config()
+        config.update({
+            "steps_per_epoch": self._steps_per_epoch,
+            "phase_epochs": self._phase_epochs,
+            "phase_steps": self._phase_steps,
+            "phase_steps_per_epoch": self._phase_steps_per_epoch,
+            "phase_multipliers": self._phase_multipliers,
+        })
+        return config
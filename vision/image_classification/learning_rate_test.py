@@ -84,6 +84,27 @@ class LearningRateTests(tf.test.TestCase):
           boundaries=[1, 2],
           multipliers=[1, 2])
 
+  def test_phased_batch_size(self):
+    """Tests that phases follow the reference schedule by epoch."""
+    base_lr = tf.keras.optimizers.schedules.PolynomialDecay(
+        initial_learning_rate=1.0,
+        decay_steps=40,
+        end_learning_rate=0.0)
+    # 2 epochs at 4x the batch size, then 2 epochs at the reference one.
+    lr = learning_rate.PhasedBatchSizeSchedule(
+        lr_schedule=base_lr,
+        steps_per_epoch=10,
+        phase_epochs=[0, 2],
+        phase_steps=[0, 6],
+        phase_steps_per_epoch=[3, 10],
+        phase_multipliers=[4.0, 1.0])
+
+    self.assertAllClose(self.evaluate(lr(0)), 4.0)
+    self.assertAllClose(self.evaluate(lr(3)), 4.0 * 0.75)
+    self.assertAllClose(self.evaluate(lr(6)), 0.5)
+    self.assertAllClose(self.evaluate(lr(16)), 0.25)
+    self.assertEqual(lr.get_config()['phase_steps'], [0, 6])
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,153 @@
+# Lint as: python3
+# ==============================================================================
+"""Batched offline prediction with a trained image classifier.
+
+Image files are read and preprocessed in parallel by a `tf.data` pipeline, and
+the model runs on their batches with a dynamic batch dimension, so the last
+partial batch does not trace the model again. The top-k classes and scores of
+every image are written to a columnar `.npz` file, holding one array per
+column: `filename`, `classes` and `scores`.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import os
+import time
+from typing import Any, Callable, List, Mapping, Sequence
+
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+# The eval preprocessing decodes JPEG images only
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def list_images(input_path: str) -> List[str]:
+    """Lists the images to predict.
+
+    Args:
+      input_path: a directory, whose JPEG files are listed recursively, a glob
+        pattern, or a text file with one image path per line.
+
+    Returns:
+      The sorted image paths.
+    """
+    if tf.io.gfile.isdir(input_path):
+        filenames = []
+        for directory, _, names in tf.io.gfile.walk(input_path):
+            filenames.extend(
+                os.path.join(directory, name) for name in names
+                if name.lower().endswith(IMAGE_EXTENSIONS))
+    elif input_path.lower().endswith(IMAGE_EXTENSIONS) or '*' in input_path:
+        filenames = tf.io.gfile.glob(input_path)
+    else:
+        with tf.io.gfile.GFile(input_path, 'r') as f:
+            filenames = [line.strip() for line in f if line.strip()]
+    if not filenames:
+        raise ValueError('No images found in {}.'.format(input_path))
+    return sorted(filenames)
+
+
+def build_dataset(filenames: Sequence[str],
+                  preprocess_fn: Callable[[tf.Tensor], tf.Tensor],
+                  batch_size: int,
+                  num_parallel_calls: int = tf.data.experimental.AUTOTUNE
+                  ) -> tf.data.Dataset:
+    """Builds a dataset of batched filenames and preprocessed images.
+
+    Args:
+      filenames: the paths of the images.
+      preprocess_fn: maps an encoded image to the model input.
+      batch_size: the maximum number of images per batch. The last batch has
+        the remaining images.
+      num_parallel_calls: the number of images read and preprocessed in
+        parallel.
+
+    Returns:
+      A dataset of (filenames, images) batches, in the order of `filenames`.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices(list(filenames))
+    dataset = dataset.map(
+        lambda filename: (filename, preprocess_fn(tf.io.read_file(filename))),
+        num_parallel_calls=num_parallel_calls)
+    dataset = dataset.batch(batch_size)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def write_predictions(output_path: str,
+                      filenames: np.ndarray,
+                      classes: np.ndarray,
+                      scores: np.ndarray):
+    """Writes the top-k predictions as the columns of a `.npz` file."""
+    tf.io.gfile.makedirs(os.path.dirname(output_path) or '.')
+    with tf.io.gfile.GFile(output_path, 'wb') as f:
+        np.savez(f, filename=filenames, classes=classes, scores=scores)
+
+
+def read_predictions(path: str) -> Mapping[str, np.ndarray]:
+    """Reads the columns written by `write_predictions`."""
+    with tf.io.gfile.GFile(path, 'rb') as f:
+        with np.load(f) as columns:
+            return {name: columns[name] for name in columns.files}
+
+
+def predict(model: tf.keras.Model,
+            dataset: tf.data.Dataset,
+            top_k: int,
+            output_path: str) -> Mapping[str, Any]:
+    """Predicts the top-k classes of the images of `dataset`.
+
+    Args:
+      model: a Keras model outputting class probabilities.
+      dataset: a dataset of (filenames, images) batches, see `build_dataset`.
+      top_k: the number of classes to keep per image.
+      output_path: the `.npz` file the predictions are written to.
+
+    Returns:
+      A dictionary with the number of images, the throughput in images per
+      second, and percentiles of the latency of a batch in milliseconds.
+    """
+    _, image_spec = dataset.element_spec
+
+    @tf.function(input_signature=[
+        tf.TensorSpec([None] + image_spec.shape[1:].as_list(),
+                      image_spec.dtype)])
+    def predict_fn(images):
+        return tf.math.top_k(model(images, training=False), k=top_k)
+
+    # Trace before timing, the batch dimension is dynamic
+    predict_fn.get_concrete_function()
+
+    filenames, classes, scores, latencies = [], [], [], []
+    start = time.perf_counter()
+    for batch_filenames, images in dataset:
+        batch_start = time.perf_counter()
+        batch_scores, batch_classes = predict_fn(images)
+        scores.append(batch_scores.numpy())
+        classes.append(batch_classes.numpy())
+        latencies.append(time.perf_counter() - batch_start)
+        filenames.append(batch_filenames.numpy())
+    elapsed = time.perf_counter() - start
+
+    filenames = np.concatenate(filenames).astype(str)
+    write_predictions(output_path,
+                      filenames=filenames,
+                      classes=np.concatenate(classes),
+                      scores=np.concatenate(scores))
+
+    stats = {
+        'num_images': len(filenames),
+        'images_per_sec': len(filenames) / elapsed,
+    }
+    for percentile, latency in zip(
+            LATENCY_PERCENTILES,
+            np.percentile(latencies, LATENCY_PERCENTILES)):
+        stats['latency_p{}_ms'.format(percentile)] = float(latency * 1000.)
+    logging.info('Wrote the top-%d predictions of %d images to %s.', top_k,
+                 len(filenames), output_path)
+    return stats
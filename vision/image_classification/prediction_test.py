@@ -0,0 +1,64 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for prediction."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from vision.image_classification import prediction, preprocessing, test_utils
+
+
+class PredictionTest(tf.test.TestCase):
+
+    def _write_images(self, image_dir, num_images):
+        tf.io.gfile.makedirs(image_dir)
+        filenames = []
+        for i in range(num_images):
+            image = tf.random.uniform((40, 48, 3), maxval=256, dtype=tf.int32)
+            filename = os.path.join(image_dir, 'image_{}.jpg'.format(i))
+            tf.io.write_file(filename,
+                             tf.image.encode_jpeg(tf.cast(image, tf.uint8)))
+            filenames.append(filename)
+        return filenames
+
+    def test_list_images(self):
+        image_dir = os.path.join(self.get_temp_dir(), 'images')
+        filenames = self._write_images(image_dir, num_images=3)
+        self.assertEqual(filenames, prediction.list_images(image_dir))
+
+        list_file = os.path.join(self.get_temp_dir(), 'images.txt')
+        with tf.io.gfile.GFile(list_file, 'w') as f:
+            f.write('\n'.join(reversed(filenames)) + '\n')
+        self.assertEqual(filenames, prediction.list_images(list_file))
+
+    def test_predict(self):
+        filenames = self._write_images(
+            os.path.join(self.get_temp_dir(), 'images'), num_images=5)
+        output_path = os.path.join(self.get_temp_dir(), 'predictions.npz')
+        dataset = prediction.build_dataset(
+            filenames,
+            preprocess_fn=lambda image: preprocessing.preprocess_for_eval(
+                image, image_size=32),
+            batch_size=2)
+
+        stats = prediction.predict(test_utils.small_classifier(num_classes=10),
+                                   dataset,
+                                   top_k=3,
+                                   output_path=output_path)
+
+        self.assertEqual(5, stats['num_images'])
+        self.assertGreater(stats['images_per_sec'], 0)
+        self.assertLessEqual(stats['latency_p50_ms'], stats['latency_p99_ms'])
+        columns = prediction.read_predictions(output_path)
+        self.assertAllEqual(filenames, columns['filename'])
+        self.assertEqual((5, 3), columns['classes'].shape)
+        self.assertEqual((5, 3), columns['scores'].shape)
+
+
+if __name__ == '__main__':
+    tf.test.main()
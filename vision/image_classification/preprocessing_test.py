@@ -0,0 +1,86 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for preprocessing."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl.testing import parameterized
+import tensorflow as tf
+
+from vision.image_classification import preprocessing
+
+# A white 16x16 square at rows [8, 24) and columns [32, 48) of a black image
+_HEIGHT, _WIDTH = 64, 80
+_BOX = [8. / _HEIGHT, 32. / _WIDTH, 24. / _HEIGHT, 48. / _WIDTH]
+_BOX_AREA = 16 * 16
+
+
+def _image_with_square() -> tf.Tensor:
+    image = tf.pad(tf.fill([16, 16, 3], tf.constant(255, tf.uint8)),
+                   [[8, _HEIGHT - 24], [32, _WIDTH - 48], [0, 0]])
+    return image
+
+
+def _inputs(encoded: bool) -> tf.Tensor:
+    image = _image_with_square()
+    if encoded:
+        return tf.image.encode_jpeg(image, quality=100)
+    return image
+
+
+class DistortedCropTest(parameterized.TestCase, tf.test.TestCase):
+
+    @parameterized.named_parameters(('encoded', True), ('decoded', False))
+    def test_crop_covers_the_box(self, encoded):
+        bbox = tf.constant([[_BOX]], tf.float32)
+        for _ in range(10):
+            crop = preprocessing.distorted_crop(_inputs(encoded),
+                                                bbox,
+                                                min_object_covered=1.0,
+                                                area_range=(0.01, 1.0))
+
+            self.assertEqual(tf.uint8, crop.dtype)
+            self.assertEqual(3, crop.shape[-1])
+            self.assertLessEqual(crop.shape[0], _HEIGHT)
+            self.assertLessEqual(crop.shape[1], _WIDTH)
+            # The whole white square is in the crop
+            white = tf.reduce_sum(tf.cast(crop[..., 0] > 128, tf.int32))
+            if encoded:
+                self.assertNear(_BOX_AREA, int(white), _BOX_AREA * 0.1)
+            else:
+                self.assertEqual(_BOX_AREA, int(white))
+
+    @parameterized.named_parameters(('encoded', True), ('decoded', False))
+    def test_empty_boxes_use_the_whole_image(self, encoded):
+        for bbox in [tf.zeros([1, 0, 4], tf.float32), None]:
+            crop = preprocessing.distorted_crop(_inputs(encoded),
+                                                bbox,
+                                                min_object_covered=1.0)
+
+            self.assertAllEqual([_HEIGHT, _WIDTH, 3], crop.shape)
+
+    def test_encoded_and_decoded_crops_match(self):
+        # The whole image is the only window covering all of it
+        bbox = tf.constant([[[0., 0., 1., 1.]]], tf.float32)
+        encoded_crop = preprocessing.distorted_crop(
+            _inputs(encoded=True), bbox, min_object_covered=1.0)
+        decoded_crop = preprocessing.distorted_crop(
+            tf.image.decode_jpeg(_inputs(encoded=True)), bbox,
+            min_object_covered=1.0)
+
+        self.assertAllEqual(decoded_crop, encoded_crop)
+
+    def test_preprocess_for_train_with_decoded_boxes(self):
+        image = preprocessing.preprocess_for_train(
+            _image_with_square(),
+            image_size=32,
+            bbox=tf.constant([[_BOX]], tf.float32))
+
+        self.assertAllEqual([32, 32, 3], image.shape)
+        self.assertEqual(tf.float32, image.dtype)
+
+
+if __name__ == '__main__':
+    tf.test.main()
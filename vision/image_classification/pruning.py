@@ -0,0 +1,361 @@
+# Lint as: python3
+# ==============================================================================
+"""Structured channel pruning of Keras functional models.
+
+Whole filters of convolutions are removed, and the model is rebuilt with
+fewer filters, so that the pruned model is physically smaller and faster,
+unlike the masks of `tfmot.sparsity`. The channels removed from a convolution
+are also removed from the layers consuming them: batch normalizations,
+depthwise convolutions, concatenations, and the input channels of the next
+convolution or dense layer.
+
+A convolution is only pruned if its channels reach no layer combining them
+elementwise with other channels (e.g. the `Add` of residual blocks), or
+reshaping them (e.g. `Flatten`), since its channels could not be removed
+independently there. The filters of a convolution are ranked by the L1 norm
+of their weights, or by the absolute scale of the batch normalization
+following it (as in Network Slimming, Liu et al. 2017).
+
+`prune_to_budget` removes the same fraction of the filters of every prunable
+convolution, searching the largest model within a FLOP or CPU latency budget.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import math
+import time
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+CRITERIA = ('l1', 'bn_gamma')
+BUDGETS = ('flops', 'latency')
+
+# Layers keeping the channels of their input
+_CHANNELWISE_LAYERS = (
+    tf.keras.layers.Activation,
+    tf.keras.layers.AveragePooling2D,
+    tf.keras.layers.BatchNormalization,
+    tf.keras.layers.DepthwiseConv2D,
+    tf.keras.layers.Dropout,
+    tf.keras.layers.GlobalAveragePooling2D,
+    tf.keras.layers.GlobalMaxPooling2D,
+    tf.keras.layers.MaxPooling2D,
+    tf.keras.layers.ReLU,
+    tf.keras.layers.ZeroPadding2D,
+)
+
+
+def _is_conv(layer: tf.keras.layers.Layer) -> bool:
+    """Whether `layer` is a regular convolution, whose filters are pruned."""
+    return (isinstance(layer, tf.keras.layers.Conv2D) and
+            not isinstance(layer, tf.keras.layers.DepthwiseConv2D))
+
+
+def _channel_axis() -> int:
+    data_format = tf.keras.backend.image_data_format()
+    return 1 if data_format == 'channels_first' else 3
+
+
+def _inputs(layer: tf.keras.layers.Layer) -> List[tf.Tensor]:
+    return tf.nest.flatten(layer.input)
+
+
+def analyze(model: tf.keras.Model
+            ) -> Tuple[List[str], Mapping[str, tf.keras.layers.Layer]]:
+    """Finds the convolutions of `model` whose filters can be pruned.
+
+    Args:
+      model: a Keras functional model, calling each of its layers once.
+
+    Returns:
+      The names of the prunable convolutions, in the order of the model, and
+      the batch normalization directly following each of them, if any.
+    """
+    # The convolutions defining the channels of each tensor
+    owners = {}
+    blocked = set()
+    convs = []
+    batch_norms = {}
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            owners[id(layer.output)] = frozenset()
+            continue
+        input_owners = [owners[id(tensor)] for tensor in _inputs(layer)]
+        if _is_conv(layer):
+            output_owners = frozenset([layer.name])
+            convs.append(layer.name)
+        elif isinstance(layer, tf.keras.layers.Dense):
+            if len(layer.input_shape) != 2:
+                blocked.update(input_owners[0])
+            output_owners = frozenset()
+        elif isinstance(layer, _CHANNELWISE_LAYERS):
+            if (isinstance(layer, tf.keras.layers.DepthwiseConv2D) and
+                    layer.depth_multiplier != 1):
+                blocked.update(input_owners[0])
+            if (isinstance(layer, tf.keras.layers.BatchNormalization) and
+                    len(input_owners[0]) == 1):
+                owner, = input_owners[0]
+                if model.get_layer(owner).output is layer.input:
+                    batch_norms[owner] = layer
+            output_owners = input_owners[0]
+        elif (isinstance(layer, tf.keras.layers.Concatenate) and
+              layer.axis % 4 == _channel_axis()):
+            output_owners = frozenset().union(*input_owners)
+        else:
+            blocked.update(frozenset().union(*input_owners))
+            output_owners = frozenset()
+        owners[id(layer.output)] = output_owners
+
+    for tensor in model.outputs:
+        blocked.update(owners[id(tensor)])
+    return [name for name in convs if name not in blocked], batch_norms
+
+
+def _take(array: np.ndarray, kept: Optional[np.ndarray], axis: int
+          ) -> np.ndarray:
+    return array if kept is None else np.take(array, kept, axis=axis)
+
+
+def prune_channels(model: tf.keras.Model,
+                   num_channels: Mapping[str, int],
+                   criterion: str = 'l1') -> tf.keras.Model:
+    """Rebuilds `model` with fewer filters in some convolutions.
+
+    Args:
+      model: a Keras functional model, calling each of its layers once.
+      num_channels: the number of filters to keep by convolution name. The
+        convolutions must be prunable, see `analyze`.
+      criterion: one of `CRITERIA`, the ranking of the filters to keep.
+
+    Returns:
+      A new model with the kept filters and the weights of `model`.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError('Unknown pruning criterion {}, expected one of '
+                         '{}.'.format(criterion, CRITERIA))
+    prunable, batch_norms = analyze(model)
+    unknown = set(num_channels) - set(prunable)
+    if unknown:
+        raise ValueError('Layers {} can not be pruned.'.format(sorted(unknown)))
+
+    plan = {}
+    for name, count in num_channels.items():
+        layer = model.get_layer(name)
+        if count >= layer.filters:
+            continue
+        if criterion == 'bn_gamma' and name in batch_norms:
+            scores = np.abs(batch_norms[name].gamma.numpy())
+        else:
+            kernel = layer.kernel.numpy()
+            scores = np.abs(kernel).reshape(-1, kernel.shape[-1]).sum(axis=0)
+        plan[name] = np.sort(np.argsort(-scores, kind='stable')[:count])
+
+    # The indices of the original channels kept in each tensor, None for all
+    kept = {}
+    weights = {}
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            kept[id(layer.output)] = None
+            continue
+        inputs = _inputs(layer)
+        input_kept = kept[id(inputs[0])]
+        layer_weights = layer.get_weights()
+        output_kept = input_kept
+        if _is_conv(layer):
+            output_kept = plan.get(layer.name)
+            kernel = _take(layer_weights[0], input_kept, axis=2)
+            layer_weights = ([_take(kernel, output_kept, axis=3)] +
+                             [_take(w, output_kept, axis=0)
+                              for w in layer_weights[1:]])
+        elif isinstance(layer, tf.keras.layers.DepthwiseConv2D):
+            layer_weights = ([_take(layer_weights[0], input_kept, axis=2)] +
+                             [_take(w, input_kept, axis=0)
+                              for w in layer_weights[1:]])
+        elif isinstance(layer, tf.keras.layers.BatchNormalization):
+            layer_weights = [_take(w, input_kept, axis=0)
+                             for w in layer_weights]
+        elif isinstance(layer, tf.keras.layers.Dense):
+            layer_weights = ([_take(layer_weights[0], input_kept, axis=0)] +
+                             layer_weights[1:])
+            output_kept = None
+        elif isinstance(layer, tf.keras.layers.Concatenate):
+            inputs_kept = [kept[id(tensor)] for tensor in inputs]
+            if all(k is None for k in inputs_kept):
+                output_kept = None
+            else:
+                offset = 0
+                output_kept = []
+                for tensor, k in zip(inputs, inputs_kept):
+                    size = tensor.shape[layer.axis]
+                    output_kept.append(
+                        (np.arange(size) if k is None else k) + offset)
+                    offset += size
+                output_kept = np.concatenate(output_kept)
+        weights[layer.name] = layer_weights
+        kept[id(layer.output)] = output_kept
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        if layer.name in plan:
+            config['filters'] = len(plan[layer.name])
+        return layer.__class__.from_config(config)
+
+    pruned_model = tf.keras.models.clone_model(model,
+                                               clone_function=clone_layer)
+    for layer in pruned_model.layers:
+        if layer.name in weights:
+            layer.set_weights(weights[layer.name])
+    return pruned_model
+
+
+def _with_image_size(model: tf.keras.Model,
+                     image_size: Optional[int]) -> tf.keras.Model:
+    """Returns `model`, or a clone of it taking images of `image_size`."""
+    _, height, width, num_channels = model.inputs[0].shape.as_list()
+    if height and width:
+        return model
+    if not image_size:
+        raise ValueError('The image size of model {} is unknown.'.format(
+            model.name))
+    inputs = tf.keras.layers.Input(
+        batch_shape=(1, image_size, image_size, num_channels),
+        dtype=model.inputs[0].dtype)
+    return tf.keras.models.clone_model(model, input_tensors=inputs)
+
+
+def count_flops(model: tf.keras.Model,
+                image_size: Optional[int] = None) -> int:
+    """Counts the floating point operations of `model` on one image.
+
+    Only the convolutions and dense layers are counted, as 2 operations per
+    multiply-add, which dominate the other layers of image classifiers.
+
+    Args:
+      model: a Keras functional model.
+      image_size: the input image size, if unknown to `model`.
+
+    Returns:
+      The number of operations.
+    """
+    model = _with_image_size(model, image_size)
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            flops += count_flops(layer, image_size)
+        elif isinstance(layer, tf.keras.layers.Conv2D):
+            kernel = (layer.depthwise_kernel
+                      if isinstance(layer, tf.keras.layers.DepthwiseConv2D)
+                      else layer.kernel)
+            output_shape = layer.output_shape
+            if layer.data_format == 'channels_first':
+                height, width = output_shape[2:4]
+            else:
+                height, width = output_shape[1:3]
+            flops += 2 * height * width * int(np.prod(kernel.shape))
+        elif isinstance(layer, tf.keras.layers.Dense):
+            flops += 2 * int(np.prod(layer.kernel.shape))
+    return flops
+
+
+def measure_cpu_latency(model: tf.keras.Model,
+                        image_size: Optional[int] = None,
+                        num_runs: int = 20,
+                        warmup_runs: int = 3) -> float:
+    """Returns the median CPU latency of `model` on one image, in ms."""
+    _, height, width, num_channels = model.inputs[0].shape.as_list()
+    shape = (1, height or image_size, width or image_size, num_channels)
+    with tf.device('/CPU:0'):
+        images = tf.zeros(shape, dtype=model.inputs[0].dtype)
+        predict_fn = tf.function(lambda x: model(x, training=False))
+        latencies = []
+        for run in range(warmup_runs + num_runs):
+            start = time.perf_counter()
+            predict_fn(images).numpy()
+            if run >= warmup_runs:
+                latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000.)
+
+
+def model_costs(model: tf.keras.Model,
+                image_size: Optional[int] = None) -> Dict[str, float]:
+    """Returns the FLOPs, parameters and CPU latency in ms of `model`."""
+    return {
+        'flops': count_flops(model, image_size),
+        'params': model.count_params(),
+        'latency_ms': measure_cpu_latency(model, image_size),
+    }
+
+
+def prune_to_budget(model: tf.keras.Model,
+                    target_ratio: float,
+                    budget: str = 'flops',
+                    criterion: str = 'l1',
+                    image_size: Optional[int] = None,
+                    channel_multiple: int = 8,
+                    num_iterations: int = 8) -> tf.keras.Model:
+    """Prunes `model` to a fraction of its FLOPs or CPU latency.
+
+    The same fraction of the filters of every prunable convolution is
+    removed, found by bisection as the smallest one meeting the budget.
+
+    Args:
+      model: a trained Keras functional model.
+      target_ratio: the fraction of the cost of `model` to keep, in (0, 1].
+      budget: one of `BUDGETS`, the cost to reduce.
+      criterion: one of `CRITERIA`, the ranking of the filters to keep.
+      image_size: the input image size, if unknown to `model`.
+      channel_multiple: the kept filters are rounded up to a multiple of
+        this, for efficient kernels.
+      num_iterations: the number of bisection steps.
+
+    Returns:
+      The pruned model, with the weights of `model`.
+    """
+    if budget not in BUDGETS:
+        raise ValueError('Unknown pruning budget {}, expected one of '
+                         '{}.'.format(budget, BUDGETS))
+    if not 0. < target_ratio <= 1.:
+        raise ValueError('The target ratio must be in (0, 1], got '
+                         '{}.'.format(target_ratio))
+    cost_fn: Callable[[tf.keras.Model], float] = (
+        (lambda m: count_flops(m, image_size)) if budget == 'flops' else
+        (lambda m: measure_cpu_latency(m, image_size)))
+
+    prunable, _ = analyze(model)
+    if not prunable:
+        logging.warning('Model %s has no prunable convolution.', model.name)
+        return model
+    filters = {name: model.get_layer(name).filters for name in prunable}
+    target = target_ratio * cost_fn(model)
+
+    def num_channels(fraction):
+        return {name: min(count, max(
+            channel_multiple,
+            int(math.ceil(count * (1. - fraction) / channel_multiple)) *
+            channel_multiple)) for name, count in filters.items()}
+
+    best, best_fraction = None, 1.
+    low, high = 0., 1.
+    for _ in range(num_iterations):
+        fraction = (low + high) / 2.
+        candidate = prune_channels(model, num_channels(fraction), criterion)
+        cost = cost_fn(candidate)
+        logging.info('Pruning %.1f%% of the filters: %s %.4g (target %.4g).',
+                     fraction * 100., budget, cost, target)
+        if cost <= target:
+            best, best_fraction = candidate, fraction
+            high = fraction
+        else:
+            low = fraction
+    if best is None:
+        logging.warning('The %s budget of %.4g is not reachable by pruning '
+                        'the filters of %s.', budget, target, model.name)
+        best = prune_channels(model, num_channels(1.), criterion)
+    logging.info('Pruned %.1f%% of the filters of %d convolutions.',
+                 best_fraction * 100., len(prunable))
+    return best
@@ -0,0 +1,93 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for pruning."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from vision.image_classification import pruning
+
+
+def _classifier() -> tf.keras.Model:
+    """A small classifier with residual, depthwise and concatenated layers."""
+    layers = tf.keras.layers
+    inputs = layers.Input(shape=(16, 16, 3), batch_size=2)
+    x = layers.Conv2D(16, 3, padding='same', name='stem')(inputs)
+    x = layers.BatchNormalization(name='stem_bn')(x)
+    x = layers.ReLU()(x)
+    shortcut = x
+    x = layers.Conv2D(16, 1, name='expand')(x)
+    x = layers.DepthwiseConv2D(3, padding='same', name='depthwise')(x)
+    x = layers.ReLU()(x)
+    x = layers.Conv2D(16, 1, name='project')(x)
+    x = layers.Add()([x, shortcut])
+    left = layers.Conv2D(8, 1, name='left')(x)
+    right = layers.Conv2D(8, 3, padding='same', name='right')(x)
+    x = layers.Concatenate()([left, right])
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dense(10, activation='softmax', name='logits')(x)
+    return tf.keras.Model(inputs, x)
+
+
+class PruningTest(tf.test.TestCase):
+
+    def test_analyze(self):
+        prunable, batch_norms = pruning.analyze(_classifier())
+        # The convolutions feeding the residual addition are kept whole
+        self.assertEqual(['expand', 'left', 'right'], prunable)
+        self.assertEqual('stem_bn', batch_norms['stem'].name)
+
+    def test_prune_channels_removes_weakest_filters(self):
+        model = _classifier()
+        kernel, bias = model.get_layer('expand').get_weights()
+        kernel[..., ::2] = 0.
+        bias[::2] = 0.
+        model.get_layer('expand').set_weights([kernel, bias])
+        images = tf.random.uniform((2, 16, 16, 3))
+
+        pruned_model = pruning.prune_channels(
+            model, {'expand': 8, 'left': 4}, criterion='l1')
+
+        self.assertEqual(8, pruned_model.get_layer('expand').filters)
+        self.assertEqual(4, pruned_model.get_layer('left').filters)
+        self.assertEqual((12, 10),
+                         pruned_model.get_layer('logits').kernel.shape)
+        self.assertLess(pruned_model.count_params(), model.count_params())
+        self.assertLess(pruning.count_flops(pruned_model),
+                        pruning.count_flops(model))
+
+        # Only the zero filters of 'expand' are removed
+        pruned_model = pruning.prune_channels(model, {'expand': 8})
+        self.assertAllClose(model(images), pruned_model(images), atol=1e-5)
+
+    def test_count_flops(self):
+        inputs = tf.keras.layers.Input(shape=(None, None, 3))
+        x = tf.keras.layers.Conv2D(4, 3, padding='same')(inputs)
+        x = tf.keras.layers.GlobalAveragePooling2D()(x)
+        x = tf.keras.layers.Dense(2)(x)
+        model = tf.keras.Model(inputs, x)
+
+        self.assertEqual(2 * (8 * 8 * 3 * 3 * 3 * 4 + 4 * 2),
+                         pruning.count_flops(model, image_size=8))
+
+    def test_prune_to_budget(self):
+        model = _classifier()
+        pruned_model = pruning.prune_to_budget(model,
+                                               target_ratio=0.8,
+                                               budget='flops',
+                                               criterion='bn_gamma',
+                                               channel_multiple=2)
+
+        self.assertLessEqual(pruning.count_flops(pruned_model),
+                             0.8 * pruning.count_flops(model))
+        self.assertEqual(16, pruned_model.get_layer('stem').filters)
+        self.assertEqual(np.float32, pruned_model.predict(
+            tf.zeros((2, 16, 16, 3)), batch_size=2).dtype)
+
+
+if __name__ == '__main__':
+    tf.test.main()
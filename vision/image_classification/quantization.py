@@ -0,0 +1,184 @@
+# Lint as: python3
+# ==============================================================================
+"""Post-training quantization of classifiers to TFLite models.
+
+Two modes are supported:
+
+  'dynamic_range': the weights are stored in int8 and the activations are
+    quantized on the fly, no calibration data is needed.
+  'full_integer': the weights and activations are int8, with the activation
+    ranges calibrated on a few batches of representative images. The model
+    inputs and outputs stay float32.
+
+`quantize_and_compare` also converts the float model, and reports the top-1
+accuracy on evaluation batches, the file size and the single image CPU
+latency of both, so that the accuracy cost of the speed up can be checked
+before serving the quantized model. The evaluation batches follow the
+calibration batches, so the quantized model is not scored on the images its
+activation ranges were fitted to.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import time
+from typing import Any, Iterator, Mapping, Optional, Tuple
+
+from absl import logging
+import numpy as np
+import tensorflow as tf
+
+QUANTIZATION_MODES = ('dynamic_range', 'full_integer')
+
+
+def _images_and_labels(dataset: tf.data.Dataset,
+                       steps: int) -> Iterator[Tuple[tf.Tensor, tf.Tensor]]:
+    """Yields the images and sparse labels of `steps` batches of `dataset`."""
+    for images, labels in dataset.take(steps):
+        if labels.shape.rank > 1:
+            labels = tf.argmax(labels, axis=-1)
+        yield images, labels
+
+
+def convert(model: tf.keras.Model,
+            mode: Optional[str] = None,
+            calibration_dataset: Optional[tf.data.Dataset] = None,
+            calibration_steps: int = 0,
+            image_size: Optional[int] = None) -> bytes:
+    """Converts `model` to a TFLite model taking one image.
+
+    Args:
+      model: a Keras model.
+      mode: one of `QUANTIZATION_MODES`, or None for a float model.
+      calibration_dataset: a dataset of batched images and labels, whose
+        images are representative of the inputs. Required by 'full_integer'.
+      calibration_steps: the number of batches to calibrate on.
+      image_size: the input image size, if unknown to `model`.
+
+    Returns:
+      The serialized TFLite model.
+    """
+    if mode is not None and mode not in QUANTIZATION_MODES:
+        raise ValueError('Unknown quantization mode {}, expected one of '
+                         '{}.'.format(mode, QUANTIZATION_MODES))
+    _, height, width, num_channels = model.inputs[0].shape.as_list()
+    input_spec = tf.TensorSpec(
+        [1, height or image_size, width or image_size, num_channels],
+        model.inputs[0].dtype)
+    if not input_spec.shape.is_fully_defined():
+        raise ValueError('The input shape {} of model {} must be known.'.format(
+            model.inputs[0].shape, model.name))
+    function = tf.function(lambda images: model(images, training=False))
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [function.get_concrete_function(input_spec)])
+
+    if mode is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'full_integer':
+        if calibration_dataset is None or not calibration_steps:
+            raise ValueError('full_integer quantization requires calibration '
+                             'images.')
+
+        def representative_dataset():
+            for images, _ in _images_and_labels(calibration_dataset,
+                                                calibration_steps):
+                for image in tf.cast(images, input_spec.dtype):
+                    yield [image[tf.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def evaluate_top_1(tflite_model: bytes,
+                   dataset: tf.data.Dataset,
+                   steps: int) -> float:
+    """Returns the top-1 accuracy of a TFLite model on `steps` batches."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_index = interpreter.get_output_details()[0]['index']
+
+    correct, total = 0, 0
+    for images, labels in _images_and_labels(dataset, steps):
+        images = tf.cast(images, input_details['dtype']).numpy()
+        for image, label in zip(images, labels.numpy()):
+            interpreter.set_tensor(input_details['index'], image[np.newaxis])
+            interpreter.invoke()
+            prediction = np.argmax(interpreter.get_tensor(output_index))
+            correct += int(prediction == label)
+            total += 1
+    return correct / total if total else 0.
+
+
+def measure_latency(tflite_model: bytes,
+                    num_runs: int = 50,
+                    warmup_runs: int = 5) -> float:
+    """Returns the median CPU latency of one image, in milliseconds."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    image = np.zeros(input_details['shape'], dtype=input_details['dtype'])
+
+    latencies = []
+    for run in range(warmup_runs + num_runs):
+        interpreter.set_tensor(input_details['index'], image)
+        start = time.perf_counter()
+        interpreter.invoke()
+        if run >= warmup_runs:
+            latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000.)
+
+
+def quantize_and_compare(model: tf.keras.Model,
+                         mode: str,
+                         destination: str,
+                         dataset: tf.data.Dataset,
+                         calibration_steps: int,
+                         eval_steps: int,
+                         image_size: Optional[int] = None
+                         ) -> Mapping[str, Any]:
+    """Writes the quantized TFLite model and compares it to the float one.
+
+    Args:
+      model: a trained Keras model.
+      mode: one of `QUANTIZATION_MODES`.
+      destination: the path of the quantized TFLite model file.
+      dataset: a dataset of batched images and labels in a fixed order, e.g.
+        the validation dataset. The first `calibration_steps` batches
+        calibrate the activation ranges, and the next `eval_steps` evaluate
+        both models.
+      calibration_steps: the number of batches to calibrate on.
+      eval_steps: the number of batches to evaluate on.
+      image_size: the input image size, if unknown to `model`.
+
+    Returns:
+      A dictionary with the top-1 accuracy, size in bytes and CPU latency in
+      milliseconds of the float and quantized models.
+    """
+    models = {
+        'float': convert(model, image_size=image_size),
+        mode: convert(model,
+                      mode=mode,
+                      calibration_dataset=dataset,
+                      calibration_steps=calibration_steps,
+                      image_size=image_size),
+    }
+    with tf.io.gfile.GFile(destination, 'wb') as f:
+        f.write(models[mode])
+    logging.info('Wrote the %s quantized model to %s.', mode, destination)
+
+    # Both models are evaluated on the same batches, none of them calibrated on
+    eval_dataset = dataset.skip(calibration_steps)
+    stats = {}
+    for name, tflite_model in models.items():
+        stats[name + '_top_1'] = evaluate_top_1(tflite_model, eval_dataset,
+                                                eval_steps)
+        stats[name + '_size_bytes'] = len(tflite_model)
+        stats[name + '_latency_ms'] = measure_latency(tflite_model)
+        logging.info('%s model: top-1 %.4f, %d bytes, %.2f ms per image.',
+                     name, stats[name + '_top_1'], stats[name + '_size_bytes'],
+                     stats[name + '_latency_ms'])
+    return stats
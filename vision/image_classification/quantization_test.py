@@ -0,0 +1,88 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for quantization."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from absl.testing import parameterized
+from absl.testing.absltest import mock
+import tensorflow as tf
+
+from vision.image_classification import quantization, test_utils
+
+
+def _dataset(num_classes: int) -> tf.data.Dataset:
+    images = tf.random.uniform((16, 32, 32, 3))
+    labels = tf.random.uniform((16,), maxval=num_classes, dtype=tf.int32)
+    return tf.data.Dataset.from_tensor_slices((images, labels)).batch(4)
+
+
+class QuantizationTest(parameterized.TestCase, tf.test.TestCase):
+
+    @parameterized.named_parameters(
+        ('dynamic_range', 'dynamic_range'),
+        ('full_integer', 'full_integer'),
+    )
+    def test_quantize_and_compare(self, mode):
+        destination = os.path.join(self.get_temp_dir(), mode + '.tflite')
+        model = test_utils.small_classifier(num_classes=10, num_filters=64)
+        stats = quantization.quantize_and_compare(model,
+                                                  mode=mode,
+                                                  destination=destination,
+                                                  dataset=_dataset(10),
+                                                  calibration_steps=2,
+                                                  eval_steps=2,
+                                                  image_size=32)
+
+        self.assertTrue(tf.io.gfile.exists(destination))
+        self.assertEqual(stats[mode + '_size_bytes'],
+                         tf.io.gfile.stat(destination).length)
+        self.assertLess(stats[mode + '_size_bytes'], stats['float_size_bytes'])
+        for name in ('float', mode):
+            self.assertBetween(stats[name + '_top_1'], 0., 1.)
+            self.assertGreater(stats[name + '_latency_ms'], 0.)
+
+    def test_evaluates_after_the_calibration_batches(self):
+        images = tf.random.uniform((16, 32, 32, 3))
+        labels = tf.range(16)
+        dataset = tf.data.Dataset.from_tensor_slices((images, labels)).batch(4)
+        destination = os.path.join(self.get_temp_dir(), 'model.tflite')
+
+        with mock.patch.object(quantization, 'evaluate_top_1',
+                               return_value=1.) as evaluate_top_1:
+            quantization.quantize_and_compare(
+                test_utils.small_classifier(num_classes=16, num_filters=64),
+                mode='full_integer',
+                destination=destination,
+                dataset=dataset,
+                calibration_steps=2,
+                eval_steps=2,
+                image_size=32)
+
+        self.assertEqual(2, evaluate_top_1.call_count)
+        for call in evaluate_top_1.call_args_list:
+            _, eval_dataset, eval_steps = call[0]
+            eval_labels = [int(label) for _, batch_labels
+                           in eval_dataset.take(eval_steps)
+                           for label in batch_labels]
+            self.assertEqual(list(range(8, 16)), eval_labels)
+
+    def test_unknown_image_size(self):
+        with self.assertRaises(ValueError):
+            quantization.convert(
+                test_utils.small_classifier(num_classes=10, num_filters=64))
+
+    def test_full_integer_requires_calibration(self):
+        with self.assertRaises(ValueError):
+            quantization.convert(
+                test_utils.small_classifier(num_classes=10, num_filters=64),
+                mode='full_integer',
+                image_size=32)
+
+
+if __name__ == '__main__':
+    tf.test.main()
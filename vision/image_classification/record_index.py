@@ -0,0 +1,326 @@
+# Lint as: python3
+# ==============================================================================
+"""Record-level index files for TFRecord shards.
+
+An index file stores the byte offset of every record of a TFRecord file, so
+records can be read in any order without scanning the file. It is written next
+to the TFRecord file with the `INDEX_SUFFIX` appended to its name.
+
+Records are read by offset in batches, one Python call per batch of records,
+with the random access TFRecord reader of TensorFlow where available. It reads
+and checks the CRCs of each record in C++, like `tf.data.TFRecordDataset`.
+TensorFlow 2.2, the version of `environment.yml`, has no such reader: records
+are then read with a `GFile` and only their headers are checked, against the
+length in the index and the CRC of that length. The data CRC is not checked.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import collections
+import struct
+import threading
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.python.lib.io import tf_record  # pylint: disable=g-direct-tensorflow-import
+
+INDEX_SUFFIX = '.index'
+
+# Each TFRecord is stored as
+#   uint64 length, uint32 masked crc32 of length,
+#   byte data[length], uint32 masked crc32 of data
+_HEADER_BYTES = 12
+_FOOTER_BYTES = 4
+
+# The number of records read by each call of the reader
+READ_BATCH_SIZE = 64
+
+# The number of files each reader thread keeps open
+_MAX_OPEN_FILES = 8
+
+_CRC32C_POLY = 0x82F63B78
+
+
+def _crc32c_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ (_CRC32C_POLY if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def masked_crc32c(data: bytes) -> int:
+    """Returns the masked CRC32C of `data`, as stored in TFRecord files."""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    crc ^= 0xFFFFFFFF
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def index_path(record_file: str) -> str:
+    """Returns the path of the index file of `record_file`."""
+    return record_file + INDEX_SUFFIX
+
+
+def is_index_file(filename: str) -> bool:
+    """Whether `filename` is an index file."""
+    return filename.endswith(INDEX_SUFFIX)
+
+
+def record_size(data_length: int) -> int:
+    """Returns the number of bytes used in a TFRecord file by a record."""
+    return _HEADER_BYTES + data_length + _FOOTER_BYTES
+
+
+def build_index(record_file: str) -> np.ndarray:
+    """Computes the offsets of all records by scanning the record headers.
+
+    Only the length field of every record is read.
+
+    Args:
+      record_file: The path of a TFRecord file.
+
+    Returns:
+      An int64 array with the byte offset of each record in the file.
+
+    Raises:
+      ValueError if the file ends in the middle of a record.
+    """
+    file_size = tf.io.gfile.stat(record_file).length
+    offsets = []
+    offset = 0
+    with tf.io.gfile.GFile(record_file, 'rb') as f:
+        while offset < file_size:
+            f.seek(offset)
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError('Truncated record at offset {} of {}'.format(
+                    offset, record_file))
+            data_length, = struct.unpack('<Q', header)
+            offsets.append(offset)
+            offset += record_size(data_length)
+    if offset != file_size:
+        raise ValueError('Truncated record at offset {} of {}'.format(
+            offsets[-1], record_file))
+    return np.array(offsets, dtype=np.int64)
+
+
+def write_index(record_file: str, offsets: Sequence[int] = None):
+    """Writes the index file of `record_file`.
+
+    Args:
+      record_file: The path of a TFRecord file.
+      offsets: The byte offset of each record in the file, if already known,
+        e.g. when the file was just written. Computed with `build_index`
+        otherwise.
+    """
+    if offsets is None:
+        offsets = build_index(record_file)
+    offsets = np.asarray(offsets, dtype='<i8')
+    with tf.io.gfile.GFile(index_path(record_file), 'wb') as f:
+        f.write(offsets.tobytes())
+
+
+def read_index(record_file: str) -> np.ndarray:
+    """Returns the record offsets stored in the index file of `record_file`."""
+    with tf.io.gfile.GFile(index_path(record_file), 'rb') as f:
+        return np.frombuffer(f.read(), dtype='<i8').astype(np.int64)
+
+
+class _RecordReader(object):
+    """Reads batches of records by offset, keeping files open per thread.
+
+    Each thread keeps the `max_open_files` files it read last open, and closes
+    the least recently read one to open another.
+
+    The records are checked against their CRCs by the random access reader of
+    TensorFlow. Older versions without it, like TensorFlow 2.2, read the
+    records with a plain `GFile` and only check their headers.
+    """
+
+    def __init__(self,
+                 path_fn: Optional[Callable[[bytes], bytes]] = None,
+                 max_open_files: int = _MAX_OPEN_FILES):
+        self._local = threading.local()
+        self._path_fn = path_fn
+        self._max_open_files = max_open_files
+        self._checked = hasattr(tf_record, 'tf_record_random_reader')
+
+    def _reader(self, filename: bytes):
+        readers = getattr(self._local, 'readers', None)
+        if readers is None:
+            readers = self._local.readers = collections.OrderedDict()
+        reader = readers.pop(filename, None)
+        if reader is None:
+            if len(readers) >= self._max_open_files:
+                _, evicted = readers.popitem(last=False)
+                evicted.close()
+            path = self._path_fn(filename) if self._path_fn else filename
+            if self._checked:
+                reader = tf_record.tf_record_random_reader(path.decode())
+            else:
+                reader = tf.io.gfile.GFile(path.decode(), 'rb')
+        # The most recently read file is last
+        readers[filename] = reader
+        return reader
+
+    def _read(self, filename: bytes, offset: int, length: int) -> bytes:
+        reader = self._reader(filename)
+        if self._checked:
+            record, _ = reader.read(offset - _HEADER_BYTES)
+            return record
+        reader.seek(offset - _HEADER_BYTES)
+        header = reader.read(_HEADER_BYTES)
+        if (len(header) < _HEADER_BYTES or
+                struct.unpack('<QI', header) !=
+                (length, masked_crc32c(header[:8]))):
+            raise ValueError('Corrupted record header at offset {} of {}'.format(
+                offset - _HEADER_BYTES, filename.decode()))
+        return reader.read(length)
+
+    def __call__(self,
+                 filenames: np.ndarray,
+                 offsets: np.ndarray,
+                 lengths: np.ndarray) -> np.ndarray:
+        """Returns the records at `offsets` of `filenames`, in that order."""
+        records = np.empty(len(offsets), dtype=object)
+        # Read each file front to back, the batch is usually spread over files
+        order = sorted(range(len(offsets)),
+                       key=lambda i: (filenames[i], offsets[i]))
+        for i in order:
+            records[i] = self._read(filenames[i], int(offsets[i]),
+                                    int(lengths[i]))
+        return records
+
+
+class RecordIndex(object):
+    """The location of every record of a list of TFRecord files.
+
+    The records are numbered in the order of `filenames`, which must be the
+    same on all workers for sharding and resuming to line up.
+    """
+
+    def __init__(self, filenames: List[str]):
+        """Loads the index files of `filenames`.
+
+        Args:
+          filenames: The TFRecord files. Each one must have an index file.
+        """
+        self.filenames = list(filenames)
+
+        file_ids, offsets, lengths = [], [], []
+        for file_id, filename in enumerate(self.filenames):
+            record_offsets = read_index(filename)
+            record_ends = np.append(record_offsets[1:],
+                                    tf.io.gfile.stat(filename).length)
+            file_ids.append(np.full(len(record_offsets), file_id, np.int32))
+            offsets.append(record_offsets + _HEADER_BYTES)
+            lengths.append(record_ends - record_offsets - record_size(0))
+
+        self.file_ids = np.concatenate(file_ids or [np.zeros([0], np.int32)])
+        self.offsets = np.concatenate(offsets or [np.zeros([0], np.int64)])
+        self.lengths = np.concatenate(lengths or [np.zeros([0], np.int64)])
+
+    @property
+    def num_records(self) -> int:
+        """The total number of records in all files."""
+        return len(self.offsets)
+
+    def dataset(self,
+                num_shards: int = 1,
+                shard_index: int = 0,
+                shuffle: bool = False,
+                seed: int = 0,
+                start_offset: int = 0,
+                repeat: bool = False,
+                path_fn: Optional[Callable[[bytes], bytes]] = None,
+                with_keys: bool = False,
+                read_batch_size: int = READ_BATCH_SIZE) -> tf.data.Dataset:
+        """Returns a dataset of serialized records read by offset.
+
+        Every epoch visits the records in a global order, a permutation drawn
+        from `seed` and the epoch number if `shuffle` is set, and shard
+        `shard_index` reads every `num_shards`-th record of that order. This
+        samples uniformly without a shuffle buffer, and shards never differ by
+        more than one record.
+
+        Args:
+          num_shards: The number of input pipelines reading the records.
+          shard_index: The index of this input pipeline.
+          shuffle: Whether to visit the records in a random order.
+          seed: The seed of the random order, the same for every shard.
+          start_offset: The number of records of the global order that were
+            already read by all shards, possibly spanning several epochs.
+          repeat: Whether to repeat indefinitely, with a new order per epoch.
+          path_fn: An optional function mapping a file name to the path to read
+            it from, e.g. `shared_cache.SharedFileCache.fetch`.
+          with_keys: Whether to also output the key of each record, its
+            position in the index and the epoch it is read in, as an int64
+            vector of size 2.
+          read_batch_size: The number of records read by each Python call of
+            the reader. The records are output in the same order regardless.
+
+        Returns:
+          A `tf.data.Dataset` of serialized records, or of records and keys.
+        """
+        if not self.num_records:
+            raise ValueError('The record index is empty.')
+
+        num_records = self.num_records
+        start_epoch, start_position = divmod(start_offset, num_records)
+
+        filenames = tf.constant(self.filenames)
+        file_ids = tf.constant(self.file_ids)
+        offsets = tf.constant(self.offsets)
+        lengths = tf.constant(self.lengths)
+
+        def epoch_records(epoch):
+            """Returns the records of this shard for `epoch`."""
+            begin = tf.where(tf.equal(epoch, start_epoch),
+                             tf.constant(start_position, tf.int64),
+                             tf.constant(0, tf.int64))
+            # The first position at or after `begin` that belongs to this shard
+            begin += (shard_index - begin) % num_shards
+            records = tf.range(begin, num_records, num_shards, dtype=tf.int64)
+            if shuffle:
+                order = tf.argsort(tf.random.stateless_uniform(
+                    [num_records], seed=tf.stack([tf.cast(seed, tf.int64), epoch])))
+                records = tf.gather(order, records)
+            epochs = tf.fill(tf.shape(records), epoch)
+            return tf.data.Dataset.from_tensor_slices((records, epochs))
+
+        def locate(record, epoch):
+            filename = tf.gather(filenames, tf.gather(file_ids, record))
+            return (filename, tf.gather(offsets, record),
+                    tf.gather(lengths, record), tf.stack([record, epoch]))
+
+        reader = _RecordReader(path_fn)
+
+        def read(filenames, offsets, lengths, keys):
+            records = tf.numpy_function(reader, [filenames, offsets, lengths],
+                                        tf.string)
+            records.set_shape(offsets.shape)
+            if with_keys:
+                return records, keys
+            return records
+
+        end_epoch = np.iinfo(np.int64).max if repeat else start_epoch + 1
+        dataset = tf.data.Dataset.range(start_epoch, end_epoch)
+        dataset = dataset.flat_map(epoch_records)
+        dataset = dataset.map(locate)
+        # One Python call reads a whole batch, which amortizes taking the GIL
+        dataset = dataset.batch(read_batch_size)
+        dataset = dataset.map(read,
+                              num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        dataset = dataset.unbatch()
+        return dataset
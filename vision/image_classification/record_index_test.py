@@ -0,0 +1,204 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for record_index."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import struct
+
+from absl.testing.absltest import mock
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.python.lib.io import tf_record  # pylint: disable=g-direct-tensorflow-import
+from vision.image_classification import record_index
+
+
+class RecordIndexTest(tf.test.TestCase):
+
+    def _write_records(self, num_files: int, records_per_file: int):
+        """Writes TFRecord files holding the record numbers as strings."""
+        filenames = []
+        record = 0
+        for i in range(num_files):
+            filename = os.path.join(self.get_temp_dir(), 'data-%d' % i)
+            with tf.io.TFRecordWriter(filename) as writer:
+                for _ in range(records_per_file):
+                    writer.write(b'%d' % record + b'x' * (record % 7))
+                    record += 1
+            filenames.append(filename)
+        return filenames
+
+    def _read_all(self, dataset):
+        return [int(record.numpy().rstrip(b'x')) for record in dataset]
+
+    def test_build_index(self):
+        filename, = self._write_records(num_files=1, records_per_file=3)
+
+        offsets = record_index.build_index(filename)
+
+        expected = [0]
+        for data in [b'0', b'1x']:
+            expected.append(expected[-1] + record_index.record_size(len(data)))
+        self.assertAllEqual(expected, offsets)
+
+    def test_write_and_read_index(self):
+        filename, = self._write_records(num_files=1, records_per_file=5)
+
+        record_index.write_index(filename)
+
+        self.assertAllEqual(record_index.build_index(filename),
+                            record_index.read_index(filename))
+        self.assertTrue(record_index.is_index_file(
+            record_index.index_path(filename)))
+
+    def test_sequential_dataset(self):
+        filenames = self._write_records(num_files=3, records_per_file=4)
+        for filename in filenames:
+            record_index.write_index(filename)
+
+        index = record_index.RecordIndex(filenames)
+
+        self.assertEqual(12, index.num_records)
+        self.assertEqual(list(range(12)), self._read_all(index.dataset()))
+
+    def test_shards_cover_all_records(self):
+        filenames = self._write_records(num_files=3, records_per_file=5)
+        for filename in filenames:
+            record_index.write_index(filename)
+        index = record_index.RecordIndex(filenames)
+
+        records = []
+        for shard_index in range(4):
+            shard = self._read_all(index.dataset(num_shards=4,
+                                                 shard_index=shard_index,
+                                                 shuffle=True,
+                                                 seed=1))
+            self.assertIn(len(shard), [3, 4])
+            records.extend(shard)
+
+        self.assertEqual(list(range(15)), sorted(records))
+
+    def test_resume_from_offset(self):
+        filenames = self._write_records(num_files=2, records_per_file=5)
+        for filename in filenames:
+            record_index.write_index(filename)
+        index = record_index.RecordIndex(filenames)
+
+        full = self._read_all(
+            index.dataset(shuffle=True, seed=3, repeat=True).take(25))
+        resumed = self._read_all(
+            index.dataset(shuffle=True, seed=3, repeat=True,
+                          start_offset=13).take(12))
+
+        self.assertEqual(full[13:], resumed)
+        self.assertNotEqual(full[:10], full[10:20])
+
+    def test_dataset_with_keys(self):
+        filenames = self._write_records(num_files=2, records_per_file=3)
+        for filename in filenames:
+            record_index.write_index(filename)
+        index = record_index.RecordIndex(filenames)
+
+        dataset = index.dataset(shuffle=True, seed=2, repeat=True,
+                                with_keys=True).take(12)
+        for position, (record, key) in enumerate(dataset):
+            self.assertEqual(int(record.numpy().rstrip(b'x')), key[0])
+            self.assertEqual(position // 6, key[1])
+
+    def test_read_batch_size_keeps_the_order(self):
+        filenames = self._write_records(num_files=3, records_per_file=5)
+        for filename in filenames:
+            record_index.write_index(filename)
+        index = record_index.RecordIndex(filenames)
+
+        expected = self._read_all(index.dataset(shuffle=True, seed=4,
+                                                read_batch_size=1))
+        for read_batch_size in [4, 64]:
+            self.assertEqual(expected, self._read_all(
+                index.dataset(shuffle=True, seed=4,
+                              read_batch_size=read_batch_size)))
+        self.assertEqual(list(range(15)), sorted(expected))
+
+    def test_corrupt_record_fails_the_crc_check(self):
+        if not hasattr(tf_record, 'tf_record_random_reader'):
+            self.skipTest('The records are not checked without the random '
+                          'access reader.')
+        filename, = self._write_records(num_files=1, records_per_file=3)
+        record_index.write_index(filename)
+        with open(filename, 'rb') as f:
+            data = bytearray(f.read())
+        # The data of the second record, b'1x'
+        offset = record_index.record_size(1) + 12
+        data[offset] = ord('7')
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+        index = record_index.RecordIndex([filename])
+        with self.assertRaises(tf.errors.OpError):
+            self._read_all(index.dataset())
+
+    def test_masked_crc32c_matches_the_record_headers(self):
+        filename, = self._write_records(num_files=1, records_per_file=3)
+        with open(filename, 'rb') as f:
+            data = f.read()
+        for offset in record_index.build_index(filename):
+            header = data[offset:offset + 12]
+            self.assertEqual(struct.unpack('<I', header[8:])[0],
+                             record_index.masked_crc32c(header[:8]))
+
+    def _unchecked_reader(self, **kwargs):
+        """A reader using the `GFile` fallback of TensorFlow 2.2."""
+        reader = record_index._RecordReader(**kwargs)
+        reader._checked = False
+        return reader
+
+    def test_fallback_reads_and_checks_the_headers(self):
+        filenames = self._write_records(num_files=3, records_per_file=4)
+        for filename in filenames:
+            record_index.write_index(filename)
+        index = record_index.RecordIndex(filenames)
+        reader = self._unchecked_reader(max_open_files=2)
+
+        records = reader(
+            np.array([f.encode() for f in index.filenames])[index.file_ids],
+            index.offsets, index.lengths)
+        self.assertEqual(list(range(12)),
+                         [int(r.rstrip(b'x')) for r in records])
+        # Only the last files read stay open
+        self.assertEqual([filenames[1].encode(), filenames[2].encode()],
+                         list(reader._local.readers))
+
+        # A stale index pointing into the middle of a record
+        with self.assertRaisesRegex(ValueError, 'Corrupted record header'):
+            reader(np.array([filenames[0].encode()]), index.offsets[1:2] + 1,
+                   index.lengths[1:2])
+
+    def test_evicted_files_are_closed(self):
+        filenames = self._write_records(num_files=3, records_per_file=1)
+        for filename in filenames:
+            record_index.write_index(filename)
+        index = record_index.RecordIndex(filenames)
+        reader = self._unchecked_reader(max_open_files=2)
+        opened = []
+
+        def open_file(path, mode, gfile=tf.io.gfile.GFile):
+            opened.append(mock.Mock(wraps=gfile(path, mode)))
+            return opened[-1]
+
+        with mock.patch.object(tf.io.gfile, 'GFile', side_effect=open_file):
+            for i in [0, 1, 2, 0]:
+                reader(np.array([filenames[i].encode()]),
+                       index.offsets[i:i + 1], index.lengths[i:i + 1])
+
+        # The first file is closed to open the third, then reopened
+        self.assertLen(opened, 4)
+        self.assertEqual([True, True, False, False],
+                         [f.close.called for f in opened])
+
+
+if __name__ == '__main__':
+    tf.test.main()
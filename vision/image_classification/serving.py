@@ -0,0 +1,365 @@
+# Lint as: python3
+# ==============================================================================
+"""A local micro-batching inference server for exported classifiers.
+
+Calling `model.predict` per image leaves the accelerator and most of the CPU
+cores idle. `MicroBatchingPredictor` instead preprocesses the images of
+concurrent requests in a thread pool, and groups them into batches of up to
+`max_batch_size` images, waiting at most `max_batch_delay` seconds for a batch
+to fill. The server exposes it over HTTP, on a TCP port or a Unix socket:
+
+  POST /predict   with the JPEG bytes as body, returns the top-k classes and
+                  scores as JSON.
+  GET  /metrics   returns the queue depth, batch fill ratio and latency
+                  percentiles as JSON.
+
+Example:
+
+  python serving.py --model_path=$EXPORT_DIR --port=8080
+  curl --data-binary @image.jpg localhost:8080/predict
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import collections
+import concurrent.futures
+import http.server
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from typing import Any, Callable, List, Mapping, Optional, Tuple
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import tensorflow as tf
+import tensorflow_model_optimization as tfmot
+
+from vision.image_classification import preprocessing
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('model_path', None,
+                    'The SavedModel written by `classifier_trainer` export.')
+flags.DEFINE_integer('port', 8080, 'The TCP port to listen on.')
+flags.DEFINE_string('unix_socket', None,
+                    'A Unix socket path to listen on instead of `port`.')
+flags.DEFINE_integer('image_size', preprocessing.IMAGE_SIZE,
+                     'The size of the model input images.')
+flags.DEFINE_bool('mean_subtract', True,
+                  'Whether the model expects mean subtracted images.')
+flags.DEFINE_bool('standardize', True,
+                  'Whether the model expects standardized images.')
+flags.DEFINE_integer('top_k', 5, 'The number of classes returned per image.')
+flags.DEFINE_integer('max_batch_size', 32,
+                     'The maximum number of images per batch.')
+flags.DEFINE_float('max_batch_delay_ms', 5.,
+                   'The maximum time to wait for a batch to fill.')
+flags.DEFINE_integer('num_preprocess_threads', None,
+                     'The number of threads preprocessing images. Defaults '
+                     'to the number of CPU cores.')
+
+# The number of recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+
+
+def build_preprocess_fn(model: tf.keras.Model,
+                        image_size: int,
+                        mean_subtract: bool,
+                        standardize: bool) -> Callable[[tf.Tensor], tf.Tensor]:
+    """Returns the eval preprocessing of an encoded image for `model`.
+
+    Models exported with `normalize_in_model` take uint8 images and normalize
+    them themselves.
+    """
+    if model.inputs[0].dtype == tf.uint8:
+        def preprocess(image_bytes):
+            image = preprocessing.preprocess_for_eval(image_bytes,
+                                                      image_size=image_size,
+                                                      dtype=None)
+            return preprocessing.to_uint8(image)
+    else:
+        def preprocess(image_bytes):
+            return preprocessing.preprocess_for_eval(
+                image_bytes,
+                image_size=image_size,
+                mean_subtract=mean_subtract,
+                standardize=standardize,
+                dtype=model.inputs[0].dtype)
+    return preprocess
+
+
+class _Request(object):
+    """An image waiting in the batching queue."""
+
+    def __init__(self, image: np.ndarray,
+                 future: concurrent.futures.Future,
+                 start: float):
+        self.image = image
+        self.future = future
+        self.start = start
+
+
+class MicroBatchingPredictor(object):
+    """Batches the predictions of concurrent requests.
+
+    Requests are preprocessed in a thread pool, then queued. A single thread
+    takes the queued images, up to `max_batch_size` of them, and waits up to
+    `max_batch_delay` seconds after the first one for more to arrive before
+    running the model on the batch.
+    """
+
+    def __init__(self,
+                 model: tf.keras.Model,
+                 preprocess_fn: Callable[[tf.Tensor], tf.Tensor],
+                 top_k: int = 5,
+                 max_batch_size: int = 32,
+                 max_batch_delay: float = 0.005,
+                 num_preprocess_threads: Optional[int] = None):
+        """Initializes the predictor, call `start` to serve requests.
+
+        Args:
+          model: a Keras model outputting class probabilities.
+          preprocess_fn: maps an encoded image to the model input.
+          top_k: the number of classes returned per image.
+          max_batch_size: the maximum number of images per batch.
+          max_batch_delay: the maximum seconds waited for a batch to fill.
+          num_preprocess_threads: the size of the preprocessing thread pool.
+            Defaults to the number of CPU cores.
+        """
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue = queue.Queue()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            num_preprocess_threads or os.cpu_count())
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+        self._preprocess = tf.function(
+            preprocess_fn,
+            input_signature=[tf.TensorSpec([], tf.string)])
+        input_shape = model.inputs[0].shape[1:].as_list()
+
+        @tf.function(input_signature=[
+            tf.TensorSpec([None] + input_shape, model.inputs[0].dtype)])
+        def predict_fn(images):
+            return tf.math.top_k(model(images, training=False), k=top_k)
+
+        self._predict = predict_fn
+
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._num_requests = 0
+        self._num_batches = 0
+        self._num_batched_images = 0
+
+    def start(self):
+        """Starts the batching thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stops the batching thread once the queued requests are done."""
+        self._pool.shutdown(wait=True)
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, image_bytes: bytes) -> concurrent.futures.Future:
+        """Queues an encoded image.
+
+        Returns:
+          A future of the top-k classes and scores of the image.
+        """
+        future = concurrent.futures.Future()
+        request_start = time.perf_counter()
+
+        def preprocess():
+            try:
+                image = self._preprocess(tf.constant(image_bytes)).numpy()
+            except Exception as e:  # pylint: disable=broad-except
+                future.set_exception(e)
+            else:
+                self._queue.put(_Request(image, future, request_start))
+
+        self._pool.submit(preprocess)
+        return future
+
+    def predict(self, image_bytes: bytes,
+                timeout: Optional[float] = None
+                ) -> Tuple[List[int], List[float]]:
+        """Returns the top-k classes and scores of an encoded image."""
+        return self.submit(image_bytes).result(timeout)
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        """Waits for the next batch of requests, or None when stopped."""
+        request = self._queue.get()
+        if request is None:
+            return None
+        batch = [request]
+        deadline = time.perf_counter() + self.max_batch_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Serve the batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        """Runs the model on batches of queued requests until stopped."""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            images = np.stack([request.image for request in batch])
+            try:
+                scores, classes = self._predict(images)
+                scores, classes = scores.numpy(), classes.numpy()
+            except Exception as e:  # pylint: disable=broad-except
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            end = time.perf_counter()
+            for i, request in enumerate(batch):
+                request.future.set_result(
+                    (classes[i].tolist(), scores[i].tolist()))
+            with self._lock:
+                self._latencies.extend(end - request.start
+                                       for request in batch)
+                self._num_requests += len(batch)
+                self._num_batches += 1
+                self._num_batched_images += len(batch)
+
+    def stats(self) -> Mapping[str, Any]:
+        """Returns the serving counters.
+
+        Returns:
+          A dictionary with the number of requests waiting for a batch, the
+          numbers of requests and batches served, the average ratio of the
+          batch size to `max_batch_size`, and the p50 and p99 latencies of the
+          recent requests in milliseconds.
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                'queue_depth': self._queue.qsize(),
+                'num_requests': self._num_requests,
+                'num_batches': self._num_batches,
+                'batch_fill_ratio': (
+                    self._num_batched_images /
+                    (self._num_batches * self.max_batch_size)
+                    if self._num_batches else 0.),
+            }
+        p50, p99 = (np.percentile(latencies, (50, 99)) if latencies
+                    else (0., 0.))
+        stats['latency_p50_ms'] = float(p50 * 1000.)
+        stats['latency_p99_ms'] = float(p99 * 1000.)
+        return stats
+
+
+def _make_handler(predictor: MicroBatchingPredictor):
+    """Returns the HTTP request handler class serving `predictor`."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        """Serves predictions and metrics as JSON."""
+
+        def _reply(self, status: int, body: Mapping[str, Any]):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path != '/metrics':
+                self._reply(404, {'error': 'Unknown path ' + self.path})
+                return
+            self._reply(200, predictor.stats())
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            if self.path != '/predict':
+                self._reply(404, {'error': 'Unknown path ' + self.path})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                classes, scores = predictor.predict(self.rfile.read(length))
+            except (tf.errors.InvalidArgumentError, ValueError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            self._reply(200, {'classes': classes, 'scores': scores})
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            # Unix socket clients have no address to log
+            logging.debug(format, *args)
+
+    return Handler
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                               socketserver.UnixStreamServer):
+    """An HTTP server on a Unix socket, handling requests in threads."""
+    daemon_threads = True
+
+
+def build_server(predictor: MicroBatchingPredictor,
+                 port: int = 8080,
+                 unix_socket: Optional[str] = None
+                 ) -> socketserver.BaseServer:
+    """Builds an HTTP server of `predictor` on `unix_socket` or `port`."""
+    handler = _make_handler(predictor)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return _ThreadingUnixHTTPServer(unix_socket, handler)
+    server = http.server.ThreadingHTTPServer(('', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(_):
+    # Models of quantization aware training have fake quantization layers
+    with tfmot.quantization.keras.quantize_scope():
+        model = tf.keras.models.load_model(
+            FLAGS.model_path,
+            custom_objects={'NormalizeImages': preprocessing.NormalizeImages},
+            compile=False)
+    predictor = MicroBatchingPredictor(
+        model,
+        build_preprocess_fn(model,
+                            image_size=FLAGS.image_size,
+                            mean_subtract=FLAGS.mean_subtract,
+                            standardize=FLAGS.standardize),
+        top_k=FLAGS.top_k,
+        max_batch_size=FLAGS.max_batch_size,
+        max_batch_delay=FLAGS.max_batch_delay_ms / 1000.,
+        num_preprocess_threads=FLAGS.num_preprocess_threads)
+    predictor.start()
+    server = build_server(predictor,
+                          port=FLAGS.port,
+                          unix_socket=FLAGS.unix_socket)
+    logging.info('Serving %s on %s.', FLAGS.model_path,
+                 FLAGS.unix_socket or 'port {}'.format(FLAGS.port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        predictor.stop()
+
+
+if __name__ == '__main__':
+    logging.set_verbosity(logging.INFO)
+    flags.mark_flag_as_required('model_path')
+    app.run(main)
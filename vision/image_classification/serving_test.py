@@ -0,0 +1,83 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for serving."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import tensorflow as tf
+
+from vision.image_classification import serving, test_utils
+
+
+def _encoded_image() -> bytes:
+    image = tf.random.uniform((40, 48, 3), maxval=256, dtype=tf.int32)
+    return tf.image.encode_jpeg(tf.cast(image, tf.uint8)).numpy()
+
+
+class ServingTest(tf.test.TestCase):
+
+    def setUp(self):
+        super(ServingTest, self).setUp()
+        model = test_utils.small_classifier(num_classes=10, image_size=32)
+        self.predictor = serving.MicroBatchingPredictor(
+            model,
+            serving.build_preprocess_fn(model,
+                                        image_size=32,
+                                        mean_subtract=True,
+                                        standardize=True),
+            top_k=3,
+            max_batch_size=4,
+            max_batch_delay=0.05,
+            num_preprocess_threads=4)
+        self.predictor.start()
+
+    def tearDown(self):
+        self.predictor.stop()
+        super(ServingTest, self).tearDown()
+
+    def test_batches_concurrent_requests(self):
+        image = _encoded_image()
+        futures = [self.predictor.submit(image) for _ in range(8)]
+        for future in futures:
+            classes, scores = future.result(timeout=60)
+            self.assertLen(classes, 3)
+            self.assertLen(scores, 3)
+
+        stats = self.predictor.stats()
+        self.assertEqual(8, stats['num_requests'])
+        self.assertLess(stats['num_batches'], 8)
+        self.assertGreater(stats['batch_fill_ratio'], 0.25)
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertLessEqual(stats['latency_p50_ms'], stats['latency_p99_ms'])
+
+    def test_http_server(self):
+        server = serving.build_server(self.predictor, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://localhost:{}'.format(server.server_address[1])
+        try:
+            response = urllib.request.urlopen(
+                url + '/predict', data=_encoded_image(), timeout=60)
+            self.assertLen(json.load(response)['classes'], 3)
+
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + '/predict', data=b'not a jpeg',
+                                       timeout=60)
+            self.assertEqual(400, error.exception.code)
+
+            metrics = json.load(urllib.request.urlopen(url + '/metrics'))
+            self.assertEqual(1, metrics['num_requests'])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    tf.test.main()
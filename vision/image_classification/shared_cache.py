@@ -0,0 +1,167 @@
+# Lint as: python3
+# ==============================================================================
+"""A cache of TFRecord files in host memory shared by processes.
+
+`tf.data.Dataset.cache` keeps the examples in the memory of one process and is
+lost when the process exits. `SharedFileCache` instead copies whole TFRecord
+files to a directory of the host, usually on a shared memory filesystem like
+`/dev/shm`, where all the training processes of the host read them from. The
+files stay there across restarts, so the data is only read from the remote
+storage once per host. The cache is bounded by a size in bytes, and evicts the
+least recently used files once full.
+
+Processes coordinate with file locks, so the cache can only be used on hosts
+with POSIX `fcntl` locks.
+"""
+from __future__ import absolute_import
+from __future__ import division
+# from __future__ import google_type_annotations
+from __future__ import print_function
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import time
+from typing import Iterator, List, Tuple, Union
+
+from absl import logging
+import tensorflow as tf
+
+_LOCK_FILE = '.lock'
+_TMP_SUFFIX = '.tmp'
+
+
+@contextlib.contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Holds an exclusive lock on `path` across processes."""
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedFileCache(object):
+    """Caches files in a directory shared by the processes of a host.
+
+    A cached file is a plain copy, named after the hash of the source path, so
+    every process maps a source file to the same copy. Its modification time is
+    updated on every fetch and used as its last access time for eviction.
+    """
+
+    def __init__(self,
+                 cache_dir: str,
+                 capacity_bytes: int,
+                 min_age_secs: float = 60.):
+        """Attaches to the cache in `cache_dir`, creating it if needed.
+
+        Args:
+          cache_dir: A local directory, e.g. on `/dev/shm` to keep the files in
+            memory. All processes using the same directory share the cache.
+          capacity_bytes: The maximum total size of the cached files.
+          min_age_secs: Files accessed more recently than this are not evicted,
+            as other processes may be about to open them.
+        """
+        self.cache_dir = cache_dir
+        self.capacity_bytes = capacity_bytes
+        self.min_age_secs = min_age_secs
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cached_path(self, filename: str) -> str:
+        """Returns the path of the copy of `filename` in the cache."""
+        digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir,
+                            '{}-{}'.format(digest, os.path.basename(filename)))
+
+    def fetch(self, filename: Union[str, bytes]) -> bytes:
+        """Returns the path to read `filename` from, caching it if possible.
+
+        Args:
+          filename: The path of the source file. Bytes are accepted so that
+            this can be called from `tf.numpy_function`.
+
+        Returns:
+          The path of the cached copy, or `filename` itself if it does not fit
+          in the cache, encoded as bytes.
+        """
+        if isinstance(filename, bytes):
+            filename = filename.decode('utf-8')
+        path = self.cached_path(filename)
+
+        if not os.path.exists(path):
+            # Only one process copies a given file, the others wait for it
+            with _file_lock(path + '.lock'):
+                if not os.path.exists(path) and not self._add(filename, path):
+                    return filename.encode('utf-8')
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted in the meantime by another process
+            return filename.encode('utf-8')
+        return path.encode('utf-8')
+
+    def _add(self, filename: str, path: str) -> bool:
+        """Copies `filename` to `path` if room can be made for it."""
+        size = tf.io.gfile.stat(filename).length
+        with _file_lock(os.path.join(self.cache_dir, _LOCK_FILE)):
+            if not self._make_room(size):
+                logging.warning('Not caching %s, the shared cache %s is full.',
+                                filename, self.cache_dir)
+                return False
+            # Reserve the space while copying, so that concurrent copies do
+            # not overflow the capacity
+            tmp_path = path + _TMP_SUFFIX
+            with open(tmp_path, 'wb') as f:
+                f.truncate(size)
+
+        start = time.time()
+        tf.io.gfile.copy(filename, tmp_path, overwrite=True)
+        os.rename(tmp_path, path)
+        logging.info('Cached %s in %s (%d bytes, %.1f s).',
+                     filename, path, size, time.time() - start)
+        return True
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """Returns the (access time, size, path) of every file in the cache."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.lock'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @property
+    def size_bytes(self) -> int:
+        """The total size of the files in the cache."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _make_room(self, size: int) -> bool:
+        """Evicts least recently used files until `size` more bytes fit.
+
+        Must be called with the cache lock held.
+        """
+        if size > self.capacity_bytes:
+            return False
+        entries = sorted(self._entries())
+        total = sum(entry_size for _, entry_size, _ in entries)
+        now = time.time()
+        for access_time, entry_size, path in entries:
+            if total + size <= self.capacity_bytes:
+                break
+            # Copies in progress keep being written to, so only the partial
+            # copies of crashed processes are old enough to be removed
+            if now - access_time < self.min_age_secs:
+                continue
+            # Processes reading the file keep it open until they are done
+            os.remove(path)
+            total -= entry_size
+            logging.info('Evicted %s from the shared cache.', path)
+        return total + size <= self.capacity_bytes
@@ -0,0 +1,69 @@
+# Lint as: python3
+# ==============================================================================
+"""Tests for shared_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from vision.image_classification import shared_cache
+
+
+class SharedFileCacheTest(tf.test.TestCase):
+
+    def _write_file(self, name: str, size: int) -> str:
+        filename = os.path.join(self.get_temp_dir(), 'data', name)
+        tf.io.gfile.makedirs(os.path.dirname(filename))
+        with tf.io.gfile.GFile(filename, 'wb') as f:
+            f.write(b'x' * size)
+        return filename
+
+    def test_fetch_copies_once(self):
+        filename = self._write_file('a', 100)
+        cache_dir = os.path.join(self.get_temp_dir(), 'cache')
+        cache = shared_cache.SharedFileCache(cache_dir, capacity_bytes=1000)
+
+        path = cache.fetch(filename).decode()
+        self.assertEqual(cache.cached_path(filename), path)
+        self.assertEqual(b'x' * 100, open(path, 'rb').read())
+
+        # Another process attaching to the cache reuses the copy
+        inode = os.stat(path).st_ino
+        other = shared_cache.SharedFileCache(cache_dir, capacity_bytes=1000)
+        self.assertEqual(path, other.fetch(filename.encode()).decode())
+        self.assertEqual(inode, os.stat(path).st_ino)
+        self.assertEqual(100, other.size_bytes)
+
+    def test_evicts_least_recently_used(self):
+        filenames = [self._write_file(name, 100) for name in 'abc']
+        cache = shared_cache.SharedFileCache(
+            os.path.join(self.get_temp_dir(), 'cache'),
+            capacity_bytes=250,
+            min_age_secs=0.)
+
+        first, second, third = [cache.cached_path(f) for f in filenames]
+        cache.fetch(filenames[0])
+        cache.fetch(filenames[1])
+        os.utime(first, (0, 0))
+        cache.fetch(filenames[2])
+
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+        self.assertLessEqual(cache.size_bytes, 250)
+
+    def test_file_larger_than_capacity_is_not_cached(self):
+        filename = self._write_file('large', 100)
+        cache = shared_cache.SharedFileCache(
+            os.path.join(self.get_temp_dir(), 'cache'), capacity_bytes=50)
+
+        self.assertEqual(filename, cache.fetch(filename).decode())
+        self.assertEqual(0, cache.size_bytes)
+
+
+if __name__ == '__main__':
+    tf.test.main()
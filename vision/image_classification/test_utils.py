@@ -4,9 +4,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from typing import List, Optional, Sequence, Tuple
+
+import tensorflow as tf
+
 from tensorflow.python.keras import backend
 from tensorflow.python.keras import layers
 from tensorflow.python.keras import models
+from vision.image_classification import dataset_factory, record_index
 
 
 def trivial_model(num_classes):
@@ -22,3 +27,81 @@ def trivial_model(num_classes):
     x = layers.Activation('softmax', dtype='float32')(x)
 
     return models.Model(img_input, x, name='trivial')
+
+
+def small_classifier(num_classes: int,
+                     image_size: Optional[int] = None,
+                     num_filters: int = 0,
+                     weight_decay: float = 0.) -> tf.keras.Model:
+    """A small classifier of square images of `image_size`, or of any size.
+
+    Args:
+      num_classes: The number of softmax outputs.
+      image_size: The input image size, or None for images of any size.
+      num_filters: The number of filters of a 3x3 convolution before the
+        pooling, or 0 for none.
+      weight_decay: The L2 regularization of the convolution kernel.
+
+    Returns:
+      The uncompiled Keras model.
+    """
+    inputs = tf.keras.layers.Input(shape=(image_size, image_size, 3))
+    x = inputs
+    if num_filters:
+        x = tf.keras.layers.Conv2D(
+            num_filters, 3,
+            kernel_regularizer=(tf.keras.regularizers.l2(weight_decay)
+                                if weight_decay else None))(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+    return tf.keras.Model(inputs, x)
+
+
+def write_jpeg_records(
+        filename: str,
+        num_records: int,
+        num_classes: int = 4,
+        bboxes: Optional[Sequence[Sequence[Tuple[float, ...]]]] = None
+) -> List[str]:
+    """Writes an indexed TFRecord file of random 40x48 JPEG images.
+
+    The records are in the format of `imagenet/imagenet_to_tfrecord.py`, the
+    label of record `i` is `i % num_classes + 1`.
+
+    Args:
+      filename: The path of the TFRecord file.
+      num_records: The number of records.
+      num_classes: The number of classes of the labels.
+      bboxes: The (ymin, xmin, ymax, xmax) boxes of each record, if any. The
+        box features are only written when given.
+
+    Returns:
+      The list of the written file.
+    """
+    with tf.io.TFRecordWriter(filename) as writer:
+        for i in range(num_records):
+            image = tf.random.uniform((40, 48, 3), maxval=256, dtype=tf.int32)
+            encoded = tf.image.encode_jpeg(tf.cast(image, tf.uint8))
+            feature = {
+                'image/encoded': tf.train.Feature(
+                    bytes_list=tf.train.BytesList(value=[encoded.numpy()])),
+                'image/class/label': tf.train.Feature(
+                    int64_list=tf.train.Int64List(
+                        value=[i % num_classes + 1])),
+                'image/class/synset': tf.train.Feature(
+                    bytes_list=tf.train.BytesList(value=[b'n0000000'])),
+                'image/filename': tf.train.Feature(
+                    bytes_list=tf.train.BytesList(
+                        value=[b'image_%d.JPEG' % i])),
+            }
+            if bboxes is not None:
+                boxes = bboxes[i]
+                for key, values in zip(dataset_factory.BBOX_KEYS,
+                                       zip(*boxes) if boxes else [()] * 4):
+                    feature[key] = tf.train.Feature(
+                        float_list=tf.train.FloatList(value=values))
+            example = tf.train.Example(
+                features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
+    record_index.write_index(filename)
+    return [filename]